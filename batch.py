@@ -0,0 +1,338 @@
+# This file handles batch mode: a whole directory submitted as asynchronous batch jobs instead of one request per chunk.
+# For bulk jobs that aren't urgent the OpenAI Batch API and Anthropic Message Batches API cost half as much as
+# synchronous calls, and they don't count against the per-minute rate limits.
+#   1. Every file is chunked (and packed, with pack_tokens) and each request gets a custom_id
+#   2. The requests are submitted as one or more batches. The batch ids and which file and chunk indices each custom_id
+#      belongs to are saved to translation_batch.json in the output directory, so an interrupted run (or one started
+#      with wait=False) picks the same batches up again instead of resubmitting them
+#   3. The batches are polled until they end, then the results are mapped back to chunk indices and journaled
+#   4. Outputs are written as usual. Chunks whose request failed, expired or didn't split back are translated with
+#      normal synchronous requests first (retry_failed=False leaves them missing for a later run)
+# The system prompt (with the prompt context and prompt caching, see prompts.py) is the same as for synchronous calls.
+
+import json
+import os
+import time
+
+import checkpoint
+import packing
+import prompts
+import telemetry
+import translate_directory
+import translate_file
+
+STATE_NAME = "translation_batch.json"
+POLL_INTERVAL = 60
+
+class BatchRequest:
+    __slots__ = ("custom_id", "text", "system_prompt", "max_tokens", "cache_prompt")
+
+    def __init__(self, custom_id, text, system_prompt, max_tokens, cache_prompt=False):
+        self.custom_id = custom_id
+        self.text = text
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.cache_prompt = cache_prompt
+
+# OpenAI Batch API: the requests are uploaded as a JSONL file of /v1/responses calls
+class OpenAIBatch:
+    MAX_REQUESTS = 50000
+    ENDED = ("completed", "failed", "expired", "cancelled")
+
+    def __init__(self, translator, aimodel):
+        self.client = translator.client
+        self.aimodel = aimodel
+
+    def submit(self, requests):
+        lines = []
+        for request in requests:
+            body = {
+                "model": self.aimodel,
+                "input": [
+                    {"role": "system", "content": request.system_prompt},
+                    {"role": "user", "content": request.text},
+                ],
+                "max_output_tokens": request.max_tokens,
+            }
+            if request.cache_prompt:
+                body["prompt_cache_key"] = prompts.cache_key(request.system_prompt)
+            lines.append(json.dumps({"custom_id": request.custom_id, "method": "POST", "url": "/v1/responses", "body": body}, ensure_ascii=False))
+        upload = self.client.files.create(file=("translation_batch.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch")
+        return self.client.batches.create(input_file_id=upload.id, endpoint="/v1/responses", completion_window="24h").id
+
+    # returns (ended, description)
+    def status(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        if counts is None:
+            return batch.status in self.ENDED, batch.status
+        return batch.status in self.ENDED, f"{batch.status}, {counts.completed} of {counts.total} done, {counts.failed} failed"
+
+    # returns {custom_id: (text or None, usage)} for every request in the batch's output
+    def results(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        results = {}
+        if not batch.output_file_id:
+            return results
+        for line in self.client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") != 200:
+                results[result["custom_id"]] = (None, {})
+                continue
+            body = response["body"]
+            text = "".join(
+                content.get("text", "")
+                for item in body.get("output", []) if item.get("type") == "message"
+                for content in item.get("content", []) if content.get("type") == "output_text"
+            )
+            usage = body.get("usage") or {}
+            results[result["custom_id"]] = (text or None, {
+                "input_tokens": usage.get("input_tokens"),
+                "output_tokens": usage.get("output_tokens"),
+                "cached_input_tokens": (usage.get("input_tokens_details") or {}).get("cached_tokens"),
+            })
+        return results
+
+# Anthropic Message Batches API: the requests are sent inline as Messages API parameters
+class AnthropicBatch:
+    MAX_REQUESTS = 100000
+
+    def __init__(self, translator, aimodel):
+        self.client = translator.client
+        self.temperature = translator.temperature
+        self.aimodel = aimodel
+
+    def submit(self, requests):
+        from translationmodels.anthropic import system_blocks
+
+        batch = self.client.messages.batches.create(requests=[
+            {
+                "custom_id": request.custom_id,
+                "params": {
+                    "model": self.aimodel,
+                    "max_tokens": request.max_tokens,
+                    "temperature": self.temperature,
+                    "system": system_blocks(request.system_prompt) if request.cache_prompt else request.system_prompt,
+                    "messages": [{"role": "user", "content": [{"type": "text", "text": request.text}]}],
+                },
+            }
+            for request in requests
+        ])
+        return batch.id
+
+    def status(self, batch_id):
+        batch = self.client.messages.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return batch.processing_status == "ended", (
+            f"{batch.processing_status}, {counts.succeeded} succeeded, {counts.errored} errored, "
+            f"{counts.expired} expired, {counts.processing} processing"
+        )
+
+    def results(self, batch_id):
+        results = {}
+        for entry in self.client.messages.batches.results(batch_id):
+            if entry.result.type != "succeeded":
+                results[entry.custom_id] = (None, {})
+                continue
+            message = entry.result.message
+            text = "".join(block.text for block in message.content if block.type == "text")
+            cache_read = getattr(message.usage, "cache_read_input_tokens", None) or 0
+            cache_write = getattr(message.usage, "cache_creation_input_tokens", None) or 0
+            results[entry.custom_id] = (text or None, {
+                "input_tokens": message.usage.input_tokens + cache_read + cache_write,
+                "output_tokens": message.usage.output_tokens,
+                "cached_input_tokens": cache_read,
+                "cache_write_tokens": cache_write,
+            })
+        return results
+
+BACKENDS = {"openai": OpenAIBatch, "anthropic": AnthropicBatch}
+
+# One file of a batch run
+class BatchFile:
+    def __init__(self, filename, filepath, output_name, chunks, completed, journal_file):
+        self.filename = filename
+        self.filepath = filepath
+        self.output_name = output_name
+        self.chunks = chunks
+        self.completed = {
+            index: entry for index, entry in completed.items()
+            if index < len(chunks) and entry[0] == checkpoint.source_hash(chunks[index])
+        }
+        self.journal_file = journal_file
+        self.stats = telemetry.Telemetry(parent=translate_file.config.telemetry, source=filepath)
+
+def load_state(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+def save_state(path, state):
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(state, file)
+    os.replace(temporary, path)
+
+# Builds the batch requests for every chunk that isn't translated yet.
+# Returns (requests, {custom_id: {"output": output name, "indices": [...], "hashes": [...]}})
+def plan_requests(files, client, pack_tokens=None):
+    requests = []
+    mapping = {}
+    for file_number, file in enumerate(files):
+        to_translate = [(index, chunk) for index, chunk in enumerate(file.chunks) if index not in file.completed]
+        for group_number, group in enumerate(translate_file.group_chunks(to_translate, pack_tokens)):
+            texts = [str(chunk) for _, chunk in group]
+            if len(texts) > 1:
+                text, system_prompt, max_tokens = packing.build_prompt(texts), packing.PACKED_SYSTEM_PROMPT, packing.output_budget(texts)
+            else:
+                text, system_prompt, max_tokens = texts[0], None, client.max_tokens
+            system_prompt, cache_prompt = translate_file.request_prompt(client, system_prompt)
+            custom_id = f"{file_number}-{group_number}"
+            requests.append(BatchRequest(custom_id, text, system_prompt or client.SYSTEM_PROMPT, max_tokens, cache_prompt))
+            mapping[custom_id] = {
+                "output": file.output_name,
+                "indices": [index for index, _ in group],
+                "hashes": [checkpoint.source_hash(chunk) for _, chunk in group],
+            }
+    return requests, mapping
+
+# Maps one batch's results back to chunk indices, journals them and records their usage.
+# A result only counts if the chunk at that index still has the text it was submitted with.
+def apply_results(results, mapping, files, provider, aimodel):
+    by_output = {file.output_name: file for file in files}
+    journals = {}
+    try:
+        for custom_id, (text, usage) in results.items():
+            entry = mapping.get(custom_id)
+            file = by_output.get(entry["output"]) if entry is not None else None
+            if file is None:
+                continue
+            indices = entry["indices"]
+            translations = [text] if len(indices) == 1 else packing.parse_response(text, len(indices))
+            translations = translations or [None] * len(indices)
+
+            record = telemetry.RequestRecord()
+            record.batch = True
+            record.input_tokens = usage.get("input_tokens") or 0
+            record.output_tokens = usage.get("output_tokens") or 0
+            record.cached_input_tokens = usage.get("cached_input_tokens") or 0
+            record.cache_write_tokens = usage.get("cache_write_tokens") or 0
+            file.stats.record_request(record, [(index, file.chunks[index]) for index in indices if index < len(file.chunks)], translations, provider, aimodel)
+
+            for index, digest, translation in zip(indices, entry["hashes"], translations):
+                if translation is None or index >= len(file.chunks) or checkpoint.source_hash(file.chunks[index]) != digest:
+                    continue
+                file.completed[index] = (digest, translation, aimodel)
+                if file.output_name not in journals:
+                    journals[file.output_name] = checkpoint.ChunkJournal(file.journal_file, resume=True)
+                journals[file.output_name].record(index, file.chunks[index], translation, aimodel)
+    finally:
+        for journal in journals.values():
+            journal.close()
+
+# Translates every .txt file in directory through the provider's batch API (OpenAI and Anthropic models).
+# wait=False submits (or checks on) the batches and returns None while they are still running, run it again later
+# to collect the results. Otherwise the batches are polled every poll_interval seconds until they end.
+# resume=True skips completed outputs, replays journals and picks up batches from an earlier run.
+# Returns {filename: reason} for the files that failed, like translate_directory.
+def translate_directory_batch(directory, output_dir, aimodel, api_key=None, pack_tokens=None, poll_interval=POLL_INTERVAL, wait=True, resume=True, jsonl=False, content_defined=False, retry_failed=True, hard_split=False):
+    provider = translate_file.provider_name(aimodel)
+    if provider not in BACKENDS:
+        print(f"Batch mode needs an {' or '.join(BACKENDS)} model, {aimodel} is {provider}")
+        return None
+    os.makedirs(output_dir, exist_ok=True)
+    translate_file.initialize_clients(aimodel, api_key)
+    client = translate_file.config.clients.get(provider)
+    if client is None:
+        print(translate_file.client_error(provider))
+        return None
+    backend = BACKENDS[provider](client, aimodel)
+
+    manifest = checkpoint.load_manifest(output_dir) if resume else {}
+    failures = {}
+    files = []
+    for filename in translate_directory.list_txt_files(directory):
+        filepath = os.path.join(directory, filename)
+        output_name = f"{os.path.splitext(filename)[0]}_translated"
+        if resume and checkpoint.is_complete(output_dir, output_name, manifest):
+            continue
+        try:
+            chunks = list(translate_file.chunk_source(filepath, content_defined, hard_split))
+        except Exception as e:
+            print(f"\nError chunking {filename}: {e}")
+            failures[filename] = str(e)
+            continue
+        journal_file = checkpoint.journal_path(output_dir, output_name)
+        if not resume:
+            checkpoint.remove_journal(journal_file)
+        completed = checkpoint.load_journal(journal_file) if resume else {}
+        files.append(BatchFile(filename, filepath, output_name, chunks, completed, journal_file))
+
+    state_path = os.path.join(output_dir, STATE_NAME)
+    state = load_state(state_path) if resume else None
+    if state is not None and state.get("model") != aimodel:
+        print(f"Ignoring {STATE_NAME}, its batches were for {state.get('model')}")
+        state = None
+    if state is None:
+        requests, mapping = plan_requests(files, client, pack_tokens)
+        state = {"provider": provider, "model": aimodel, "batches": [], "requests": mapping}
+        for start in range(0, len(requests), backend.MAX_REQUESTS):
+            state["batches"].append(backend.submit(requests[start:start + backend.MAX_REQUESTS]))
+            save_state(state_path, state) # after every batch, so a crash never submits one twice
+        if requests:
+            print(f"Submitted {len(requests)} requests for {sum(len(entry['indices']) for entry in mapping.values())} chunks in {len(state['batches'])} batches")
+    else:
+        print(f"Resuming {len(state['batches'])} batches from {STATE_NAME}")
+
+    started = time.monotonic()
+    while state["batches"]:
+        statuses = [backend.status(batch_id) for batch_id in state["batches"]]
+        for batch_id, (_, description) in zip(state["batches"], statuses):
+            print(f"Batch {batch_id}: {description}")
+        if all(ended for ended, _ in statuses):
+            break
+        if not wait:
+            print("Batches still running, run again with resume=True to collect the results")
+            return None
+        time.sleep(poll_interval)
+    if state["batches"]:
+        print(f"Batches finished after {time.monotonic() - started:.0f}s of polling")
+
+    for batch_id in state["batches"]:
+        apply_results(backend.results(batch_id), state["requests"], files, provider, aimodel)
+
+    for file in files:
+        translations = [file.completed[index][1] if index in file.completed else None for index in range(len(file.chunks))]
+        models = [checkpoint.entry_model(file.completed[index], aimodel) if index in file.completed else aimodel for index in range(len(file.chunks))]
+        missing = translations.count(None)
+        if missing and retry_failed:
+            print(f"{file.filename}: {missing} chunks have no batch result, translating them directly")
+            with checkpoint.ChunkJournal(file.journal_file, resume=True) as journal:
+
+                def on_result(index, chunk, translation, model=None, replayed=False):
+                    models[index] = model or aimodel
+                    if not replayed:
+                        journal.record(index, chunk, translation, model)
+
+                _, translations = translate_file.translate_chunks(file.chunks, aimodel, completed=file.completed, on_result=on_result, pack_tokens=pack_tokens, stats=file.stats)
+        try:
+            failed = translate_file.finish_output(file.filepath, output_dir, aimodel, file.output_name, file.chunks, translations, file.stats.summary(), jsonl, models)
+        except Exception as e:
+            print(f"\nError writing {file.output_name}.txt: {e}")
+            failures[file.filename] = str(e)
+            continue
+        if failed:
+            failures[file.filename] = f"{failed} chunks failed"
+
+    # every result is in the journals now, the batches are no longer needed
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    if translate_file.config.telemetry is not None:
+        print(telemetry.describe(translate_file.config.telemetry.summary()))
+        translate_file.config.telemetry.write_metrics()
+    translate_directory.print_failures(failures)
+    return failures
@@ -0,0 +1,313 @@
+# Behaviour checks for the paths that only show up end to end: batch mode and Ollama throughput mode against the
+# local stand-in servers (fake_provider_api.py, fake_ollama.py), the recovery paths of jobqueue.py, and how well
+# content-defined chunking resyncs after an edit.
+# Every check builds its own small collection or text, raises AssertionError if the run doesn't end the way it should and
+# otherwise returns (figures, seconds) like a benchmark runner. run_benchmarks.py runs them as cases too.
+# Run from the repository root:
+#     python -m benchmarks.checks            # every check
+#     python -m benchmarks.checks jobqueue   # just the checks whose name contains "jobqueue"
+# A check that goes through a provider SDK is skipped when the SDK isn't installed, the rest still run.
+# Each check runs in its own process, they change module-level settings (clients, Ollama settings, base URLs).
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from benchmarks import corpora
+
+FAKE_MODEL = "fake-model" # any name translate_file sends to the llama client
+COLLECTION_FILES = 4
+COLLECTION_SIZE = 1000
+
+def install_fake_translator(**options):
+    import translate_file
+    from benchmarks.fake_translators import FakeTranslator
+    fake = FakeTranslator(**options)
+    translate_file.config.clients[translate_file.provider_name(FAKE_MODEL)] = fake
+    return fake
+
+def write_collection(workdir):
+    return corpora.write_collection(os.path.join(workdir, "collection"), count=COLLECTION_FILES, size=COLLECTION_SIZE)
+
+# Batch mode: submits without waiting, then resumes from the state file the way a second run would, with every
+# fail_every-th batch request failing so the direct retry path runs as well
+def check_batch(workdir, model, batch_seconds=0.5, fail_every=4):
+    import batch
+    import chunking
+    from benchmarks.fake_provider_api import FakeProviderAPI
+    directory = write_collection(workdir)
+    output = os.path.join(workdir, "output")
+    api = FakeProviderAPI(batch_seconds=batch_seconds, fail_every=fail_every)
+    url = api.start()
+    os.environ["OPENAI_BASE_URL"] = f"{url}/v1"
+    os.environ["ANTHROPIC_BASE_URL"] = url
+    files = [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+    chunk_count = sum(len(chunking.chunk_file(path)) for path in files)
+    try:
+        start = time.perf_counter()
+        submitted = batch.translate_directory_batch(directory, output, model, api_key="check", poll_interval=0.1, wait=False)
+        if submitted is not None or not os.path.exists(os.path.join(output, batch.STATE_NAME)):
+            raise AssertionError("wait=False returned before the batches ended without leaving a state file")
+        time.sleep(batch_seconds)
+        failures = batch.translate_directory_batch(directory, output, model, api_key="check", poll_interval=0.1)
+        elapsed = time.perf_counter() - start
+    finally:
+        api.stop()
+    if failures != {}:
+        raise AssertionError(f"resumed batch run failed: {failures}")
+    if os.path.exists(os.path.join(output, batch.STATE_NAME)):
+        raise AssertionError("state file left behind after the batches were collected")
+    written = [name for name in os.listdir(output) if name.endswith("_translated.txt")]
+    if len(written) != len(files):
+        raise AssertionError(f"{len(written)} of {len(files)} outputs written")
+    # the failed batch requests are answered once by the direct retry, nothing is translated twice
+    if api.requests != chunk_count:
+        raise AssertionError(f"{api.requests} requests answered for {chunk_count} chunks")
+    return {"chunks": chunk_count, "files": len(files), "requests": api.requests, "batches": len(api.batches)}, elapsed
+
+# Ollama throughput mode: several files must share one model load and fill every parallel slot, and no reply may be
+# cut off by num_predict (packed requests need their whole output budget)
+def check_ollama(workdir, model="llama3.1", num_parallel=4, pack_tokens=None, load_seconds=0.5, latency=0.05):
+    import chunking
+    import translate_directory
+    import translate_file
+    from benchmarks.fake_ollama import FakeOllamaServer
+    directory = write_collection(workdir)
+    server = FakeOllamaServer(load_seconds=load_seconds, latency=latency, num_parallel=num_parallel)
+    url = server.start()
+    files = translate_directory.list_txt_files(directory)
+    chunk_count = sum(len(chunking.chunk_file(os.path.join(directory, name), hard_split=True)) for name in files)
+    try:
+        translate_file.enable_ollama_throughput(num_parallel=num_parallel, base_url=url)
+        start = time.perf_counter()
+        # hard_split so no single chunk outgrows the default num_predict
+        failures = translate_directory.translate_directory(directory, os.path.join(workdir, "output"), model, parallel=True, pack_tokens=pack_tokens, hard_split=True)
+        elapsed = time.perf_counter() - start
+        stats = server.stats()
+    finally:
+        server.stop()
+    if failures:
+        raise AssertionError(f"ollama run failed: {failures}")
+    if stats["loads"] != 1:
+        raise AssertionError(f"model loaded {stats['loads']} times for {len(files)} files")
+    if stats["max_active"] != num_parallel:
+        raise AssertionError(f"{stats['max_active']} of {num_parallel} parallel slots used")
+    if stats["truncated"]:
+        raise AssertionError(f"{stats['truncated']} replies cut off by num_predict")
+    # a packed group that fell back costs its chunks' requests on top of its own
+    if pack_tokens and stats["requests"] >= chunk_count:
+        raise AssertionError(f"packing sent {stats['requests']} requests for {chunk_count} chunks")
+    result = {"chunks": chunk_count, "files": len(files)}
+    result.update(stats)
+    return result, elapsed
+
+# Job queue recovery, each scenario has to leave every file done without missing translations:
+#   lease_reclaim: a worker leases tasks and dies, a second worker takes them over once the leases run out
+#   late_complete: a task is reclaimed and both workers finish it, whichever finishes first keeps its translations
+#   stale_worker: the worker that lost a lease reports back while the new holder still works on it, the task stays
+#     with the holder (translations aside) and is credited to it
+#   retry_failed: every task fails, the files are finalized as failed, then retry_failed() and a second worker finish them
+def check_jobqueue(workdir, scenario, lease_seconds=0.5, max_attempts=2):
+    import jobqueue
+    from output_writer import MISSING_TRANSLATION
+    fake = install_fake_translator(latency=0.005, distribution="fixed")
+    directory = write_collection(workdir)
+    output = os.path.join(workdir, "output")
+    queue = jobqueue.JobQueue(os.path.join(workdir, "queue.sqlite3"), lease_seconds=lease_seconds, max_attempts=max_attempts)
+    try:
+        files, _ = queue.add_directory(directory, output, FAKE_MODEL)
+        start = time.perf_counter()
+        JOBQUEUE_SCENARIOS[scenario](queue, fake)
+        elapsed = time.perf_counter() - start
+        status = queue.status()
+        if status["files"] != {"done": files} or status["remaining"]:
+            raise AssertionError(f"queue not finished: {status['files']}, {status['remaining']} chunks remaining")
+        for name in os.listdir(output):
+            if name.endswith("_translated.txt"):
+                with open(os.path.join(output, name), "r", encoding="utf-8") as file:
+                    if MISSING_TRANSLATION in file.read():
+                        raise AssertionError(f"{name} still has missing translations")
+        result = {"chunks": status["chunks"], "files": files, "retries": status["retries"]}
+        result.update(fake.stats())
+    finally:
+        queue.close()
+    return result, elapsed
+
+def lease_reclaim(queue, fake):
+    import jobqueue
+    queue.register("crashed")
+    claimed = queue.claim("crashed", 2, FAKE_MODEL)
+    # started right away: it has to wait for the leases to run out, then take the tasks over
+    jobqueue.run_worker(queue, "survivor", poll_interval=queue.lease_seconds / 4)
+    status = queue.status()
+    workers = {worker["name"]: worker for worker in status["workers"]}
+    if workers["crashed"]["alive"] or workers["crashed"]["stopped"]:
+        raise AssertionError("the crashed worker isn't reported as gone")
+    if workers["survivor"]["alive"] or not workers["survivor"]["stopped"]:
+        raise AssertionError("the worker that exited isn't reported as stopped")
+    if workers["survivor"]["tasks_done"] != sum(status["tasks"].values()) or status["retries"] != len(claimed):
+        raise AssertionError(f"{len(claimed)} leases weren't taken over: {workers['survivor']['tasks_done']} tasks done, {status['retries']} retries")
+
+def late_complete(queue, fake):
+    import jobqueue
+    late = queue.claim("late", 1000, FAKE_MODEL)
+    time.sleep(queue.lease_seconds * 1.5)
+    reclaimed = queue.claim("prompt", 1000, FAKE_MODEL)
+    if [task.id for task in reclaimed] != [task.id for task in late]:
+        raise AssertionError("expired leases weren't reclaimed")
+    # the first half is finished first by the worker that lost its lease, the second half by the one that took over.
+    # Only the worker holding the lease settles a task, but the late translations that came first are kept.
+    half = len(late) // 2
+    order = [(late[:half], "late", False), (reclaimed, "prompt", True), (late[half:], "late", True)]
+    for tasks, worker, done in order:
+        for task in tasks:
+            translations = [f"{worker} {index}" for index in task.indices]
+            if queue.complete(worker, task, translations, [FAKE_MODEL] * len(translations)) != done:
+                raise AssertionError(f"task {task.id} {'not ' if done else ''}done after {worker} completed it")
+    first = {task.id: "late" for task in late[:half]}
+    first.update({task.id: "prompt" for task in reclaimed[half:]})
+    conn = queue._connection()
+    for task in late:
+        translations = [row[0] for row in conn.execute("SELECT translation FROM chunks WHERE file_id = ? AND idx BETWEEN ? AND ?", (task.file_id, task.indices[0], task.indices[-1]))]
+        if any(not translation.startswith(first[task.id]) for translation in translations):
+            raise AssertionError(f"task {task.id}: the later completion overwrote the first")
+    jobqueue.finalize_ready(queue, "prompt")
+
+def stale_worker(queue, fake):
+    import jobqueue
+    queue.register("stale")
+    queue.register("holder")
+    stale = queue.claim("stale", 1000, FAKE_MODEL)
+    time.sleep(queue.lease_seconds * 1.5)
+    reclaimed = queue.claim("holder", 1000, FAKE_MODEL)
+    conn = queue._connection()
+    leases = conn.execute("SELECT id, status, worker, lease_until, attempts FROM tasks ORDER BY id").fetchall()
+    # the stale worker comes back with a chunk missing from every task, then with all of them
+    for task in stale:
+        translations = [None] + [f"stale {index}" for index in task.indices[1:]]
+        if queue.complete("stale", task, translations, [FAKE_MODEL] * len(translations), error="simulated"):
+            raise AssertionError(f"task {task.id} settled by a worker that lost its lease")
+    if conn.execute("SELECT id, status, worker, lease_until, attempts FROM tasks ORDER BY id").fetchall() != leases:
+        raise AssertionError("a stale worker's incomplete result changed tasks another worker holds")
+    for task in stale:
+        translations = [f"stale {index}" for index in task.indices]
+        queue.complete("stale", task, translations, [FAKE_MODEL] * len(translations))
+    if conn.execute("SELECT COUNT(*) FROM tasks WHERE status = 'leased' AND worker = 'holder'").fetchone()[0] != len(reclaimed):
+        raise AssertionError("a stale worker's complete result settled tasks another worker holds")
+    for task in reclaimed:
+        if not queue.complete("holder", task, [None] * len(task.indices), [FAKE_MODEL] * len(task.indices)):
+            raise AssertionError(f"task {task.id} not done once its holder completed it")
+    workers = {worker["name"]: worker for worker in queue.status()["workers"]}
+    if workers["stale"]["tasks_done"] or workers["holder"]["tasks_done"] != len(reclaimed):
+        raise AssertionError("tasks credited to the worker that lost their leases")
+    jobqueue.finalize_ready(queue, "holder")
+
+def retry_failed(queue, fake):
+    import jobqueue
+    fake.error_rate = 1.0
+    jobqueue.run_worker(queue, "failing", poll_interval=0.05)
+    status = queue.status()
+    if status["files"].get("failed") != sum(status["files"].values()) or status["tasks"].get("failed") != sum(status["tasks"].values()):
+        raise AssertionError(f"expected every task and file to fail, got {status['tasks']} and {status['files']}")
+    fake.error_rate = 0.0
+    if queue.retry_failed() != status["tasks"]["failed"]:
+        raise AssertionError("retry_failed() didn't reopen every failed task")
+    jobqueue.run_worker(queue, "retrying", poll_interval=0.05)
+
+JOBQUEUE_SCENARIOS = {
+    "lease_reclaim": lease_reclaim,
+    "late_complete": late_complete,
+    "stale_worker": stale_worker,
+    "retry_failed": retry_failed,
+}
+
+# Content-defined chunking after a one-character insert into text punctuated only with commas, where every cut is a
+# fallback (no sentence endings): most chunks must come out unchanged, so an incremental rerun can reuse them
+def check_content_defined_resync(workdir, trials=20, size=20000, min_reuse=0.8, seed=0):
+    import chunking
+    rng = random.Random(seed)
+    characters = corpora.CHARACTERS
+
+    def chunk_texts(text):
+        path = os.path.join(workdir, "resync.txt")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text)
+        return [str(chunk) for chunk in chunking.iter_content_defined_spans(path)]
+
+    reuse = []
+    start = time.perf_counter()
+    for _ in range(trials):
+        clauses = []
+        while sum(len(clause) for clause in clauses) < size:
+            clauses.append("".join(rng.choice(characters) for _ in range(rng.randint(4, 12))) + "，")
+        text = "".join(clauses)
+        position = rng.randrange(len(text))
+        edited = text[:position] + rng.choice(characters) + text[position:]
+        before, after = chunk_texts(text), set(chunk_texts(edited))
+        reuse.append(sum(chunk in after for chunk in before) / len(before))
+    elapsed = time.perf_counter() - start
+    if min(reuse) < min_reuse:
+        raise AssertionError(f"after one insert only {min(reuse):.0%} of the chunks were reusable (at least {min_reuse:.0%} expected)")
+    return {"trials": trials, "min_reuse": round(min(reuse), 3), "mean_reuse": round(sum(reuse) / trials, 3)}, elapsed
+
+# Name -> (the SDK module it needs or None, check function, keyword arguments)
+CHECKS = {
+    "batch/openai": ("openai", check_batch, {"model": "gpt-4o-mini"}),
+    "batch/anthropic": ("anthropic", check_batch, {"model": "claude-3-5-haiku-latest"}),
+    "ollama/throughput": ("langchain_ollama", check_ollama, {}),
+    "ollama/throughput/packed": ("langchain_ollama", check_ollama, {"pack_tokens": 1500}),
+    **{f"jobqueue/{scenario}": (None, check_jobqueue, {"scenario": scenario}) for scenario in JOBQUEUE_SCENARIOS},
+    "chunking/content_defined/resync": (None, check_content_defined_resync, {}),
+}
+
+# Why a check can't run here (its SDK isn't installed), or None
+def skip_reason(name):
+    module = CHECKS[name][0]
+    if module is not None and importlib.util.find_spec(module) is None:
+        return f"{module} is not installed"
+    return None
+
+# Runs in a fresh process: one check in a scratch directory, with its output silenced
+def run_check(name):
+    _, check, options = CHECKS[name]
+    workdir = tempfile.mkdtemp(prefix="check_")
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            return check(workdir, **options)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end behaviour checks against the stand-in servers and fake translators.")
+    parser.add_argument("only", nargs="?", help="only run checks whose name contains this text")
+    args = parser.parse_args()
+
+    failed = 0
+    for name in CHECKS:
+        if args.only and args.only not in name:
+            continue
+        reason = skip_reason(name)
+        if reason is not None:
+            print(f"{name:<40} skipped: {reason}")
+            continue
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            try:
+                _, elapsed = executor.submit(run_check, name).result()
+            except Exception as e:
+                failed += 1
+                print(f"{name:<40} FAILED: {e}")
+                continue
+        print(f"{name:<40} ok ({elapsed:.2f}s)")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# Synthetic Classical Chinese corpora for the benchmarks, in the shapes we see in real collections:
+#   punctuated: modern punctuated prose, paragraphs of a few hundred characters
+#   unpunctuated: scans with no punctuation at all, so chunking has to fall back to hard splits
+#   short_lines: many short lines (headings, formula lists), which stress merging
+#   huge_line: one enormous line, which stresses paragraph splitting
+# Text is drawn from a fixed seed so every run benchmarks the same input.
+
+import os
+import random
+
+# common characters from medical and literary texts, weighted by repetition
+CHARACTERS = (
+    "之而不也其者以人为所于曰有则其病气血脉寒热风湿虚实阴阳表里"
+    "汤丸散方治主用服一二三水火土金木心肝脾肺肾胃中上下日月"
+    "子王天下道德仁义礼君臣民国家言行事时古今大小可无如此故"
+)
+PUNCTUATION = ["。", "！", "？", "，", "，", "，", "；", "："]
+STOPS = {"。", "！", "？"}
+
+SHAPES = ["punctuated", "unpunctuated", "short_lines", "huge_line"]
+
+def sentence(rng, punctuated=True):
+    clauses = []
+    for _ in range(rng.randint(1, 4)):
+        clause = "".join(rng.choice(CHARACTERS) for _ in range(rng.randint(3, 12)))
+        if punctuated:
+            clause += rng.choice(PUNCTUATION)
+        clauses.append(clause)
+    text = "".join(clauses)
+    if punctuated and text[-1] not in STOPS:
+        text = text[:-1] + "。"
+    return text
+
+def paragraph(rng, length, punctuated=True):
+    text = ""
+    while len(text) < length:
+        text += sentence(rng, punctuated)
+    return text
+
+# Returns the text of a corpus of about size characters
+def generate(shape, size=200000, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    total = 0
+    while total < size:
+        if shape == "punctuated":
+            line = paragraph(rng, rng.randint(80, 600))
+        elif shape == "unpunctuated":
+            line = paragraph(rng, rng.randint(200, 2000), punctuated=False)
+        elif shape == "short_lines":
+            line = paragraph(rng, rng.randint(4, 30), punctuated=rng.random() < 0.5)
+        elif shape == "huge_line":
+            line = paragraph(rng, size)
+        else:
+            raise ValueError(f"Unknown corpus shape: {shape}")
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)
+
+# Writes one corpus file and returns its path
+def write_corpus(directory, shape, size=200000, seed=0, name=None):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name or f"{shape}.txt")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(generate(shape, size, seed))
+    return path
+
+# Writes a directory of count files of mixed shapes and sizes (for translate_directory) and returns it
+def write_collection(directory, count=20, size=20000, seed=0):
+    rng = random.Random(seed)
+    for number in range(count):
+        shape = SHAPES[number % len(SHAPES)]
+        write_corpus(directory, shape, size=rng.randint(size // 4, size * 2), seed=seed + number, name=f"{number:03d}_{shape}.txt")
+    return directory
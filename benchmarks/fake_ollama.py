@@ -0,0 +1,214 @@
+# A local stand-in for an Ollama server, to test throughput mode (translationmodels/ollama.py) without a GPU.
+# It speaks enough of the Ollama HTTP API for langchain_ollama and the warm-up request:
+#   POST /api/chat, /api/generate (streamed NDJSON or stream=false; a generate without a prompt only loads the model)
+#   GET /api/ps, /api/tags, /api/version
+# and emulates what matters for throughput:
+#   load_seconds: paid by the first request for a model that isn't loaded, or whose keep_alive ran out
+#   latency: seconds per request once the model is loaded
+#   num_parallel: requests processed at once (OLLAMA_NUM_PARALLEL), the rest queue
+# Replies keep packed-request markers, like fake_translators.respond. A reply counts as long as its prompt (in estimated
+# tokens) and is cut off at the request's options.num_predict like a real one, done_reason "length".
+#
+#     python -m benchmarks.fake_ollama --port 11434 --num-parallel 4
+
+import argparse
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.fake_translators import respond
+from translationmodels.governor import estimate_tokens
+
+# Ollama prompts carry the instructions in the same message as the text, and the packed instructions quote a marker:
+# only the markers packing.build_prompt puts at the start of a line begin segments
+SEGMENTS = re.compile(r"^<<<\s*\d+\s*>>>", re.MULTILINE)
+
+DEFAULT_KEEP_ALIVE = 300 # Ollama unloads an idle model after 5 minutes unless told otherwise
+
+# keep_alive as Ollama accepts it: seconds, or a duration like "30s", "10m", "1h". Negative means forever.
+def parse_keep_alive(value):
+    if value is None:
+        return DEFAULT_KEEP_ALIVE
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        match = re.fullmatch(r"\s*(-?\d+(?:\.\d+)?)\s*(ms|s|m|h)?\s*", str(value))
+        if match is None:
+            raise ValueError(f"invalid keep_alive: {value}")
+        seconds = float(match.group(1)) * {None: 1, "ms": 0.001, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+    return float("inf") if seconds < 0 else seconds
+
+def timestamp():
+    return datetime.now(timezone.utc).isoformat()
+
+class FakeOllamaServer:
+    def __init__(self, host="127.0.0.1", port=0, load_seconds=0.5, latency=0.05, num_parallel=4):
+        self.load_seconds = load_seconds
+        self.latency = latency
+        self.num_parallel = num_parallel
+        self.loaded = {} # model -> time.monotonic() it expires at
+        self.loads = 0
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self.truncated = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._slots = threading.Semaphore(num_parallel)
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "loads": self.loads, "max_active": self.max_active, "truncated": self.truncated}
+
+    # Loads the model if needed (one load at a time, like a single GPU) and extends its keep_alive.
+    # Returns the nanoseconds spent loading, as reported in load_duration.
+    def load(self, model, keep_alive):
+        start = time.monotonic()
+        with self._load_lock:
+            if self.loaded.get(model, 0) <= time.monotonic():
+                time.sleep(self.load_seconds)
+                with self._lock:
+                    self.loads += 1
+            self.loaded[model] = time.monotonic() + parse_keep_alive(keep_alive)
+        return int((time.monotonic() - start) * 1e9)
+
+    def generate(self, model, text, keep_alive, num_predict=None):
+        with self._slots:
+            with self._lock:
+                self.requests += 1
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+            try:
+                load_duration = self.load(model, keep_alive)
+                start = time.monotonic()
+                time.sleep(self.latency)
+                first = SEGMENTS.search(text)
+                reply = respond(text[first.start():] if first else text)
+                eval_duration = int((time.monotonic() - start) * 1e9)
+            finally:
+                with self._lock:
+                    self.active -= 1
+        done_reason = "stop"
+        needed = estimate_tokens(text)
+        if num_predict is not None and 0 <= num_predict < needed:
+            reply = reply[:len(reply) * num_predict // needed]
+            done_reason = "length"
+            with self._lock:
+                self.truncated += 1
+        return reply, done_reason, {
+            "total_duration": load_duration + eval_duration,
+            "load_duration": load_duration,
+            "prompt_eval_count": len(text),
+            "prompt_eval_duration": eval_duration // 4,
+            "eval_count": len(reply),
+            "eval_duration": eval_duration - eval_duration // 4,
+        }
+
+    def models(self):
+        now = time.monotonic()
+        return [
+            {"name": model, "model": model, "size": 0, "expires_at": "forever" if expires == float("inf") else round(expires - now, 1)}
+            for model, expires in self.loaded.items() if expires > now
+        ]
+
+    def handler(self):
+        stand_in = self
+
+        class OllamaHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def send_json(self, payload, status=200):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/api/ps":
+                    self.send_json({"models": stand_in.models()})
+                elif self.path == "/api/tags":
+                    self.send_json({"models": [{"name": model, "model": model} for model in stand_in.loaded]})
+                elif self.path == "/api/version":
+                    self.send_json({"version": "0.0.0-stand-in"})
+                else:
+                    self.send_json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                model = request.get("model")
+                if not model:
+                    self.send_json({"error": "model is required"}, 400)
+                    return
+                if self.path == "/api/chat":
+                    text = "\n".join(message.get("content", "") for message in request.get("messages", []))
+                elif self.path == "/api/generate":
+                    text = request.get("prompt")
+                    if not text:
+                        stand_in.load(model, request.get("keep_alive"))
+                        self.send_json({"model": model, "created_at": timestamp(), "response": "", "done": True, "done_reason": "load"})
+                        return
+                else:
+                    self.send_json({"error": "not found"}, 404)
+                    return
+
+                reply, done_reason, timings = stand_in.generate(model, text, request.get("keep_alive"), (request.get("options") or {}).get("num_predict"))
+                if self.path == "/api/chat":
+                    content = lambda piece: {"message": {"role": "assistant", "content": piece}}
+                else:
+                    content = lambda piece: {"response": piece}
+                final = {"model": model, "created_at": timestamp(), **content(""), "done": True, "done_reason": done_reason, **timings}
+                if not request.get("stream", True):
+                    self.send_json({**final, **content(reply)})
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                pieces = [{"model": model, "created_at": timestamp(), **content(word), "done": False} for word in re.findall(r"\S+\s*", reply)]
+                for piece in pieces + [final]:
+                    line = (json.dumps(piece) + "\n").encode("utf-8")
+                    self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def log_message(self, format, *args):
+                pass
+
+        return OllamaHandler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stand-in Ollama server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--load-seconds", type=float, default=0.5)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--num-parallel", type=int, default=4)
+    arguments = parser.parse_args()
+    server = FakeOllamaServer(arguments.host, arguments.port, arguments.load_seconds, arguments.latency, arguments.num_parallel)
+    print(f"Stand-in Ollama server at {server.base_url} ({arguments.num_parallel} parallel slots)")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,274 @@
+# A local stand-in for the OpenAI and Anthropic HTTP APIs, to test prompt caching (prompts.py) and batch mode (batch.py)
+# without an account. Point the SDKs at it with their usual environment variables:
+#     OPENAI_BASE_URL=http://127.0.0.1:8089/v1  ANTHROPIC_BASE_URL=http://127.0.0.1:8089
+# It serves:
+#   OpenAI:    POST /v1/responses, POST /v1/files, GET /v1/files/{id}/content, POST /v1/batches, GET /v1/batches/{id}
+#   Anthropic: POST /v1/messages, POST /v1/messages/batches, GET /v1/messages/batches/{id},
+#              GET /v1/messages/batches/{id}/results
+# Prompt caching is emulated like the real thing: a system prompt of at least min_cache_tokens is cached on first use
+# (Anthropic only if it's marked with cache_control, OpenAI automatically) and reported as cached input afterwards.
+# Batches end batch_seconds after they are created, every fail_every-th request in them fails.
+# Replies keep packed-request markers, like fake_translators.respond.
+#
+#     python -m benchmarks.fake_provider_api --port 8089 --batch-seconds 2
+
+import argparse
+import email.parser
+import hashlib
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.fake_translators import respond
+from translationmodels.governor import estimate_tokens
+
+def content_text(content):
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content or [])
+
+class FakeProviderAPI:
+    def __init__(self, host="127.0.0.1", port=0, batch_seconds=1.0, fail_every=None, min_cache_tokens=1024):
+        self.batch_seconds = batch_seconds
+        self.fail_every = fail_every
+        self.min_cache_tokens = min_cache_tokens
+        self.prompt_cache = set()
+        self.files = {} # id -> bytes
+        self.batches = {} # id -> {"kind", "created", "requests", ...}
+        self.requests = 0
+        self.cache_reads = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def new_id(self, prefix):
+        return f"{prefix}_{next(self._ids):06d}"
+
+    # Returns (cached tokens, tokens written to the cache) for a system prompt
+    def cache(self, system_prompt, cacheable, key=""):
+        tokens = estimate_tokens(system_prompt)
+        if not cacheable or tokens < self.min_cache_tokens:
+            return 0, 0
+        digest = hashlib.sha256((key + system_prompt).encode("utf-8")).hexdigest()
+        with self._lock:
+            if digest in self.prompt_cache:
+                self.cache_reads += 1
+                return tokens, 0
+            self.prompt_cache.add(digest)
+        return 0, tokens
+
+    def failing(self, number):
+        return self.fail_every is not None and number % self.fail_every == 0
+
+    def openai_response(self, body):
+        with self._lock:
+            self.requests += 1
+        messages = body.get("input", [])
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+        system_prompt = "".join(content_text(m.get("content")) for m in messages if m.get("role") in ("system", "developer"))
+        text = "".join(content_text(m.get("content")) for m in messages if m.get("role") == "user")
+        cached, _ = self.cache(system_prompt, True, body.get("prompt_cache_key") or "")
+        reply = respond(text)
+        input_tokens = estimate_tokens(system_prompt + text)
+        output_tokens = estimate_tokens(reply)
+        return {
+            "id": self.new_id("resp"), "object": "response", "created_at": int(time.time()), "status": "completed",
+            "model": body.get("model"), "error": None, "incomplete_details": None, "instructions": None, "metadata": {},
+            "parallel_tool_calls": True, "temperature": 1.0, "tool_choice": "auto", "tools": [], "top_p": 1.0,
+            "output": [{
+                "type": "message", "id": self.new_id("msg"), "status": "completed", "role": "assistant",
+                "content": [{"type": "output_text", "text": reply, "annotations": []}],
+            }],
+            "usage": {
+                "input_tokens": input_tokens, "input_tokens_details": {"cached_tokens": cached},
+                "output_tokens": output_tokens, "output_tokens_details": {"reasoning_tokens": 0},
+                "total_tokens": input_tokens + output_tokens,
+            },
+        }
+
+    def anthropic_message(self, body):
+        with self._lock:
+            self.requests += 1
+        system = body.get("system") or ""
+        system_prompt = content_text(system)
+        marked = isinstance(system, list) and any(block.get("cache_control") for block in system)
+        cache_read, cache_write = self.cache(system_prompt, marked)
+        text = "".join(content_text(m.get("content")) for m in body.get("messages", []) if m.get("role") == "user")
+        reply = respond(text)
+        return {
+            "id": self.new_id("msg"), "type": "message", "role": "assistant", "model": body.get("model"),
+            "content": [{"type": "text", "text": reply}], "stop_reason": "end_turn", "stop_sequence": None,
+            "usage": {
+                "input_tokens": estimate_tokens(system_prompt + text) - cache_read - cache_write,
+                "output_tokens": estimate_tokens(reply),
+                "cache_read_input_tokens": cache_read,
+                "cache_creation_input_tokens": cache_write,
+            },
+        }
+
+    # Runs a batch's requests once it's due, returns whether it has ended
+    def settle(self, batch):
+        if batch.get("results") is not None:
+            return True
+        if time.monotonic() - batch["created"] < self.batch_seconds:
+            return False
+        results = []
+        for number, request in enumerate(batch["requests"], start=1):
+            if batch["kind"] == "openai":
+                if self.failing(number):
+                    results.append({"id": self.new_id("batch_req"), "custom_id": request["custom_id"], "response": {"status_code": 500, "body": {"error": {"message": "simulated"}}}, "error": None})
+                else:
+                    results.append({"id": self.new_id("batch_req"), "custom_id": request["custom_id"], "response": {"status_code": 200, "request_id": self.new_id("req"), "body": self.openai_response(request["body"])}, "error": None})
+            elif self.failing(number):
+                results.append({"custom_id": request["custom_id"], "result": {"type": "errored", "error": {"type": "error", "error": {"type": "api_error", "message": "simulated"}}}})
+            else:
+                results.append({"custom_id": request["custom_id"], "result": {"type": "succeeded", "message": self.anthropic_message(request["params"])}})
+        batch["results"] = results
+        batch["ended_at"] = int(time.time())
+        if batch["kind"] == "openai":
+            batch["output_file_id"] = self.new_id("file")
+            self.files[batch["output_file_id"]] = "\n".join(json.dumps(result) for result in results).encode("utf-8")
+        return True
+
+    def openai_batch(self, batch):
+        ended = self.settle(batch)
+        failed = sum(1 for result in batch["results"] or [] if result["response"]["status_code"] != 200)
+        return {
+            "id": batch["id"], "object": "batch", "endpoint": batch["endpoint"], "input_file_id": batch["input_file_id"],
+            "completion_window": "24h", "status": "completed" if ended else "in_progress", "created_at": batch["created_at"],
+            "output_file_id": batch.get("output_file_id"), "error_file_id": None, "errors": None,
+            "request_counts": {"total": len(batch["requests"]), "completed": len(batch["requests"]) - failed if ended else 0, "failed": failed},
+        }
+
+    def anthropic_batch(self, batch, base_url):
+        ended = self.settle(batch)
+        errored = sum(1 for result in batch["results"] or [] if result["result"]["type"] != "succeeded")
+        return {
+            "id": batch["id"], "type": "message_batch", "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else len(batch["requests"]), "succeeded": len(batch["requests"]) - errored if ended else 0,
+                "errored": errored, "canceled": 0, "expired": 0,
+            },
+            "created_at": "2024-01-01T00:00:00Z", "expires_at": "2024-01-02T00:00:00Z", "ended_at": "2024-01-01T00:00:00Z" if ended else None,
+            "archived_at": None, "cancel_initiated_at": None,
+            "results_url": f"{base_url}/v1/messages/batches/{batch['id']}/results" if ended else None,
+        }
+
+    def handler(self):
+        api = self
+
+        class ProviderHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def send_body(self, body, content_type="application/json", status=200):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_json(self, payload, status=200):
+                self.send_body(json.dumps(payload).encode("utf-8"), status=status)
+
+            def not_found(self):
+                self.send_json({"error": {"type": "not_found_error", "message": f"{self.command} {self.path}"}}, 404)
+
+            def base_url(self):
+                return f"http://{self.headers.get('Host')}"
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                match = re.fullmatch(r"/v1/files/([\w-]+)/content", path)
+                if match and match.group(1) in api.files:
+                    self.send_body(api.files[match.group(1)], "application/octet-stream")
+                    return
+                match = re.fullmatch(r"/v1/batches/([\w-]+)", path)
+                if match and match.group(1) in api.batches:
+                    self.send_json(api.openai_batch(api.batches[match.group(1)]))
+                    return
+                match = re.fullmatch(r"/v1/messages/batches/([\w-]+)(/results)?", path)
+                if match and match.group(1) in api.batches:
+                    batch = api.batches[match.group(1)]
+                    if match.group(2):
+                        if not api.settle(batch):
+                            self.send_json({"error": {"type": "invalid_request_error", "message": "batch is still processing"}}, 400)
+                            return
+                        self.send_body("\n".join(json.dumps(result) for result in batch["results"]).encode("utf-8"), "application/x-jsonl")
+                    else:
+                        self.send_json(api.anthropic_batch(batch, self.base_url()))
+                    return
+                self.not_found()
+
+            def do_POST(self):
+                path = self.path.split("?")[0]
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if path == "/v1/files":
+                    message = email.parser.BytesParser().parsebytes(
+                        f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8") + raw
+                    )
+                    content = next((part.get_payload(decode=True) for part in message.get_payload() if part.get_filename()), b"")
+                    file_id = api.new_id("file")
+                    api.files[file_id] = content
+                    self.send_json({"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()), "filename": "batch.jsonl", "purpose": "batch", "status": "processed"})
+                    return
+                body = json.loads(raw or b"{}")
+                if path == "/v1/responses":
+                    self.send_json(api.openai_response(body))
+                elif path == "/v1/messages":
+                    self.send_json(api.anthropic_message(body))
+                elif path == "/v1/batches":
+                    content = api.files.get(body.get("input_file_id"))
+                    if content is None:
+                        self.send_json({"error": {"message": "unknown input_file_id"}}, 400)
+                        return
+                    batch = {
+                        "id": api.new_id("batch"), "kind": "openai", "created": time.monotonic(), "created_at": int(time.time()),
+                        "endpoint": body.get("endpoint"), "input_file_id": body["input_file_id"], "results": None,
+                        "requests": [json.loads(line) for line in content.decode("utf-8").splitlines() if line.strip()],
+                    }
+                    api.batches[batch["id"]] = batch
+                    self.send_json(api.openai_batch(batch))
+                elif path == "/v1/messages/batches":
+                    batch = {"id": api.new_id("msgbatch"), "kind": "anthropic", "created": time.monotonic(), "requests": body.get("requests", []), "results": None}
+                    api.batches[batch["id"]] = batch
+                    self.send_json(api.anthropic_batch(batch, self.base_url()))
+                else:
+                    self.not_found()
+
+            def log_message(self, format, *args):
+                pass
+
+        return ProviderHandler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stand-in OpenAI / Anthropic API server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--batch-seconds", type=float, default=1.0)
+    parser.add_argument("--fail-every", type=int, default=None)
+    parser.add_argument("--min-cache-tokens", type=int, default=1024)
+    arguments = parser.parse_args()
+    api = FakeProviderAPI(arguments.host, arguments.port, arguments.batch_seconds, arguments.fail_every, arguments.min_cache_tokens)
+    print(f"Stand-in provider API at {api.base_url} (OPENAI_BASE_URL={api.base_url}/v1, ANTHROPIC_BASE_URL={api.base_url})")
+    try:
+        api.server.serve_forever()
+    except KeyboardInterrupt:
+        api.stop()
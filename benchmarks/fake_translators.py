@@ -0,0 +1,99 @@
+# Fake translators for the offline benchmarks. They have the same translate(text, model, ...) interface as the
+# clients in translationmodels, but sleep instead of calling an API, so throughput can be measured for free.
+#   latency: mean seconds per request, drawn from a "fixed", "uniform" or "lognormal" distribution
+#   error_rate: fraction of requests that fail with a permanent error (the chunk comes back as None)
+#   burst_every / burst_length: after every burst_every requests the next burst_length get a 429 with a
+#     Retry-After header, which the request governor has to wait out and retry
+# Requests go through a RequestGovernor just like the real clients, so retries and rate limits are exercised too.
+
+import math
+import random
+import re
+import threading
+import time
+
+import telemetry
+from translationmodels.governor import RequestGovernor, estimate_tokens
+
+MARKER = re.compile(r"<<<\s*(\d+)\s*>>>")
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+class FakeRateLimitError(Exception):
+    def __init__(self, retry_after):
+        super().__init__("429 Too Many Requests (simulated)")
+        self.status_code = 429
+        self.response = FakeResponse(429, {"retry-after": str(retry_after)})
+
+class FakeBadRequestError(Exception):
+    def __init__(self):
+        super().__init__("400 Bad Request (simulated)")
+        self.status_code = 400
+
+class FakeTranslator:
+    SYSTEM_PROMPT = "Translate the following Classical Chinese text to English with a focus on accuracy: "
+
+    def __init__(self, latency=0.05, distribution="lognormal", sigma=0.5, error_rate=0.0, burst_every=None, burst_length=0, retry_after=0.05, requests_per_minute=None, seed=0):
+        self.latency = latency
+        self.distribution = distribution
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.retry_after = retry_after
+        self.temperature = 0.0
+        self.max_tokens = 4000
+        self.governor = RequestGovernor("fake", requests_per_minute=requests_per_minute, base_delay=0.01, max_delay=0.5)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    def _delay(self):
+        with self._lock:
+            if self.distribution == "fixed":
+                return self.latency
+            if self.distribution == "uniform":
+                return self._random.uniform(0, 2 * self.latency)
+            # lognormal with the given mean: a long tail of slow requests, like real APIs
+            return self._random.lognormvariate(math.log(self.latency) - self.sigma ** 2 / 2, self.sigma)
+
+    def _send(self, text):
+        with self._lock:
+            self.requests += 1
+            number = self.requests
+            burst = self.burst_every and (number % (self.burst_every + self.burst_length)) >= self.burst_every
+            failure = not burst and self._random.random() < self.error_rate
+        if burst:
+            with self._lock:
+                self.rate_limited += 1
+            raise FakeRateLimitError(self.retry_after)
+        time.sleep(self._delay())
+        if failure:
+            raise FakeBadRequestError()
+        return respond(text)
+
+    def translate(self, text, model=None, max_tokens=None, temperature=None, system_prompt=None):
+        try:
+            response = self.governor.call(lambda: self._send(text), on_retry=telemetry.record_retry)
+            telemetry.record_usage(estimate_tokens(self.SYSTEM_PROMPT + text), estimate_tokens(response))
+            return response
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            print(f"Error: {e}")
+            return None
+
+    def stats(self):
+        return {"requests": self.requests, "rate_limited": self.rate_limited, "failed": self.failed}
+
+# A stand-in "translation": keeps packed-request markers so packing.parse_response accepts it
+def respond(text):
+    parts = MARKER.split(text)
+    if len(parts) == 1:
+        return f"[en] {len(text)} characters"
+    return "\n".join(f"<<<{number}>>>\n[en] {len(segment.strip())} characters" for number, segment in zip(parts[1::2], parts[2::2]))
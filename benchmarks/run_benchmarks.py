@@ -0,0 +1,230 @@
+# Offline benchmark suite: measures startup time, chunking and the full translation pipeline against fake
+# translators, so throughput regressions show up without spending API money.
+# Run from the repository root:
+#     python -m benchmarks.run_benchmarks                  # full run, results saved to benchmarks/results/
+#     python -m benchmarks.run_benchmarks --quick          # smaller corpora
+#     python -m benchmarks.run_benchmarks --only chunking  # just the cases whose name contains "chunking"
+#     python -m benchmarks.run_benchmarks --compare benchmarks/results/<earlier run>.json
+# Every case runs in its own process, so peak RSS is measured per case rather than for the whole run.
+# Each result has the wall time, chunks/sec and peak RSS (MB), plus the fake translator's request counts.
+# The behaviour checks in checks.py run as cases too and fail the run if they fail, the ones whose provider SDK
+# isn't installed are skipped.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from benchmarks import checks, corpora
+from benchmarks.checks import FAKE_MODEL
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Simulated providers: keyword arguments for fake_translators.FakeTranslator
+BACKENDS = {
+    "fast": {"latency": 0.005, "distribution": "fixed"},
+    "long_tail": {"latency": 0.02, "distribution": "lognormal", "sigma": 1.0},
+    "errors": {"latency": 0.01, "distribution": "uniform", "error_rate": 0.05},
+    "rate_limited": {"latency": 0.01, "distribution": "uniform", "burst_every": 40, "burst_length": 8, "retry_after": 0.05},
+}
+
+# peak resident memory of this process in MB, or None where the resource module doesn't exist (Windows)
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def install_fake_translator(backend):
+    return checks.install_fake_translator(**BACKENDS[backend])
+
+# chunking is fast enough to be noisy, so it's the best of CHUNKING_REPEATS runs
+CHUNKING_REPEATS = 3
+
+def run_chunking(case):
+    import chunking
+    best = None
+    for _ in range(CHUNKING_REPEATS):
+        start = time.perf_counter()
+        if case.get("content_defined"):
+            chunks = list(chunking.iter_content_defined_spans(case["path"]))
+        else:
+            chunks = chunking.chunk_file(case["path"], use_mmap=case.get("mmap", False))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {"chunks": len(chunks)}, best
+
+def run_translate_chunks(case):
+    import chunking
+    import translate_file
+    fake = install_fake_translator(case["backend"])
+    start = time.perf_counter()
+    chunks = chunking.iter_chunk_spans(case["path"])
+    untranslated, translated = translate_file.translate_chunks(chunks, FAKE_MODEL, max_workers=case["workers"], pack_tokens=case.get("pack_tokens"))
+    elapsed = time.perf_counter() - start
+    result = {"chunks": len(untranslated), "failed": sum(1 for t in translated if t is None)}
+    result.update(fake.stats())
+    return result, elapsed
+
+def run_translate_directory(case):
+    import chunking
+    import translate_directory
+    fake = install_fake_translator(case["backend"])
+    files = translate_directory.list_txt_files(case["directory"])
+    # counted before the clock starts, chunking is timed as part of the run below
+    chunk_count = sum(len(chunking.chunk_file(os.path.join(case["directory"], name))) for name in files)
+    output = tempfile.mkdtemp(prefix="benchmark_output_")
+    start = time.perf_counter()
+    failures = translate_directory.translate_directory(case["directory"], output, FAKE_MODEL, max_workers=case["workers"], parallel=case["parallel"], pack_tokens=case.get("pack_tokens"))
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(output, ignore_errors=True)
+    result = {"chunks": chunk_count, "files": len(files), "files_failed": len(failures)}
+    result.update(fake.stats())
+    return result, elapsed
+
+# Cold start: a fresh interpreter importing translate_file and resolving a provider, the way a one-file CLI run
+# or a new worker process starts. Reports the median of STARTUP_REPEATS runs and which provider SDKs got imported.
+STARTUP_REPEATS = 5
+STARTUP_SCRIPT = (
+    "import json, sys, translate_file; translate_file.provider_name({model!r}); "
+    "print(json.dumps(sorted(m for m in ('openai', 'anthropic', 'langchain_ollama', 'google.generativeai') if m in sys.modules)))"
+)
+
+def run_startup(case):
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    times = []
+    for _ in range(STARTUP_REPEATS):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT.format(model=case["model"])], cwd=repository, capture_output=True, text=True, check=True)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    result = {"sdks_imported": json.loads(completed.stdout)}
+    try:
+        import resource
+        result["child_peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        pass
+    return result, times[len(times) // 2]
+
+RUNNERS = {
+    "chunking": run_chunking,
+    "translate_chunks": run_translate_chunks,
+    "translate_directory": run_translate_directory,
+    "startup": run_startup,
+    "check": lambda case: checks.run_check(case["name"]),
+}
+
+# Runs in a fresh process: executes one case with its output silenced and adds the timing and memory figures
+def run_case(case):
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        result, elapsed = RUNNERS[case["kind"]](case)
+    result["wall_seconds"] = round(elapsed, 4)
+    result["chunks_per_second"] = round(result["chunks"] / elapsed, 1) if "chunks" in result and elapsed > 0 else None
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+def build_cases(workdir, quick=False):
+    size = 50000 if quick else 400000
+    cases = [{"name": f"startup/{model}", "kind": "startup", "model": model} for model in ("gpt-4o-mini", "llama3.1")]
+    paths = {shape: corpora.write_corpus(workdir, shape, size=size) for shape in corpora.SHAPES}
+    for shape, path in paths.items():
+        cases.append({"name": f"chunking/{shape}", "kind": "chunking", "path": path})
+        cases.append({"name": f"chunking/{shape}/mmap", "kind": "chunking", "path": path, "mmap": True})
+        cases.append({"name": f"chunking/{shape}/content_defined", "kind": "chunking", "path": path, "content_defined": True})
+
+    pipeline_path = corpora.write_corpus(workdir, "punctuated", size=size // 4, name="pipeline.txt")
+    for backend in BACKENDS:
+        cases.append({"name": f"translate_chunks/{backend}", "kind": "translate_chunks", "path": pipeline_path, "backend": backend, "workers": 8})
+    cases.append({"name": "translate_chunks/fast/packed", "kind": "translate_chunks", "path": pipeline_path, "backend": "fast", "workers": 8, "pack_tokens": 1500})
+
+    directory = corpora.write_collection(os.path.join(workdir, "collection"), count=8 if quick else 24, size=size // 40)
+    for parallel in (False, True):
+        mode = "parallel" if parallel else "sequential"
+        cases.append({"name": f"translate_directory/{mode}", "kind": "translate_directory", "directory": directory, "backend": "long_tail", "workers": 8, "parallel": parallel})
+
+    cases.extend({"name": name, "kind": "check"} for name in checks.CHECKS)
+    return cases
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_comparison(results, previous_path):
+    with open(previous_path, "r", encoding="utf-8") as file:
+        previous = {case["name"]: case for case in json.load(file)["cases"]}
+    print(f"\nCompared with {previous_path}:")
+    for case in results["cases"]:
+        before = previous.get(case["name"])
+        if not before:
+            continue
+        # throughput where there is one, otherwise wall time
+        measure, unit = ("chunks_per_second", "chunks/s") if case.get("chunks_per_second") else ("wall_seconds", "s")
+        if not before.get(measure) or not case.get(measure):
+            continue
+        change = (case[measure] / before[measure] - 1) * 100
+        print(f"\t{case['name']:<40} {before[measure]:>12} -> {case[measure]:>12} {unit} ({change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for chunking and translation throughput.")
+    parser.add_argument("--quick", action="store_true", help="use smaller corpora")
+    parser.add_argument("--only", help="only run cases whose name contains this text")
+    parser.add_argument("--output", help="where to save the results JSON (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="an earlier results JSON to compare chunks/sec against")
+    args = parser.parse_args()
+
+    results = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "cases": [],
+    }
+    failed = False
+    with tempfile.TemporaryDirectory(prefix="benchmark_corpora_") as workdir:
+        cases = [case for case in build_cases(workdir, args.quick) if not args.only or args.only in case["name"]]
+        for case in cases:
+            reason = checks.skip_reason(case["name"]) if case["kind"] == "check" else None
+            if reason is not None:
+                print(f"{case['name']:<40} skipped: {reason}")
+                results["cases"].append({"name": case["name"], "skipped": reason})
+                continue
+            # a new process per case so peak RSS isn't inherited from earlier cases
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                try:
+                    result = executor.submit(run_case, case).result()
+                except Exception as e:
+                    failed = True
+                    print(f"{case['name']:<40} failed: {e}")
+                    results["cases"].append({"name": case["name"], "error": str(e)})
+                    continue
+            result["name"] = case["name"]
+            results["cases"].append(result)
+            print(f"{case['name']:<40} {result['wall_seconds']:>9.3f}s {str(result['chunks_per_second']):>12} chunks/s {result['peak_rss_mb']:>8} MB")
+
+    output = args.output or os.path.join(RESULTS_DIRECTORY, f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults saved to {output}")
+    if args.compare:
+        print_comparison(results, args.compare)
+    # a failed case (an exception or an unmet check) fails the run, so it can gate CI
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
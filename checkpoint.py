@@ -0,0 +1,206 @@
+# This file handles crash-safe checkpointing so long runs can be resumed.
+# Every finished chunk is appended to a per-file journal (<output name>.journal.jsonl) as soon as it completes,
+# and every finished output file is appended to a directory-level manifest (translation_manifest.jsonl).
+# A resumed run replays the journal, only translates the chunks that are missing or failed (None),
+# and skips output files the manifest already lists as complete.
+# Next to each output there is also a chunk manifest (<output name>.chunks.jsonl) with the source hash and translation
+# of every chunk, so after the source file is edited a rerun can reuse every chunk that didn't change.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+MANIFEST_NAME = "translation_manifest.jsonl"
+
+def source_hash(text):
+    return hashlib.sha256(str(text).encode("utf-8")).hexdigest()
+
+def journal_path(output_directory, output_filepath_name):
+    return os.path.join(output_directory, f"{output_filepath_name}.journal.jsonl")
+
+# Append-only journal of finished chunks. Each record is flushed and fsynced before the next chunk is recorded,
+# so at most the line being written when the process dies is lost.
+class ChunkJournal:
+    def __init__(self, path, resume=False):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    # model: the model that produced the translation, if it should be kept (see hedging.py)
+    def record(self, index, source, translation, model=None):
+        record = {"index": index, "source_hash": source_hash(source), "translation": translation}
+        if model is not None:
+            record["model"] = model
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+# Replays a journal, returning {index: (source_hash, translation, model)} with the latest successful translation of
+# each chunk (model is None if it wasn't recorded). translate_chunks only reuses an entry if the chunk at that index
+# still has the same source hash.
+def load_journal(path):
+    completed = {}
+    if not os.path.exists(path):
+        return completed
+
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue # a partially written last line from a crash
+            index = record.get("index")
+            if not isinstance(index, int):
+                continue
+            if record.get("translation") is None:
+                completed.pop(index, None)
+            else:
+                completed[index] = (record.get("source_hash"), record["translation"], record.get("model"))
+    return completed
+
+# The model that produced a load_journal / reusable_chunks entry, default if it wasn't recorded
+def entry_model(entry, default):
+    return entry[2] if len(entry) > 2 and entry[2] is not None else default
+
+def remove_journal(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+# Returns {output name: manifest record} for every output file that finished in this directory.
+def load_manifest(output_directory):
+    finished = {}
+    path = os.path.join(output_directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return finished
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            finished[record["output"]] = record
+    return finished
+
+def mark_complete(output_directory, output_filepath_name, source_path, chunk_count):
+    record = {"output": output_filepath_name, "source": source_path, "chunks": chunk_count}
+    path = os.path.join(output_directory, MANIFEST_NAME)
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+# An output counts as complete when the manifest lists it and its txt file is still there.
+def is_complete(output_directory, output_filepath_name, manifest=None):
+    if manifest is None:
+        manifest = load_manifest(output_directory)
+    output_path = os.path.join(output_directory, f"{output_filepath_name}.txt")
+    return output_filepath_name in manifest and os.path.exists(output_path)
+
+def chunk_manifest_path(output_directory, output_filepath_name):
+    return os.path.join(output_directory, f"{output_filepath_name}.chunks.jsonl")
+
+# Writes a chunk manifest one chunk at a time, as results come in, so a streamed run never holds every chunk and
+# translation just to write it. Like the output writer it puts records back in index order with a small reorder
+# buffer and spools them to an anonymous temp file; finish() writes the header (the model, which the translations are only reused for, and the chunk count)
+# followed by the records and swaps the manifest in atomically. Without finish() the previous manifest is kept.
+# model: the model that produced a translation, recorded if it isn't aimodel (failovers and hedges).
+class ChunkManifestWriter:
+    def __init__(self, path, aimodel, source_path):
+        self.path = path
+        self.aimodel = aimodel
+        self.source_path = source_path
+        self.count = 0
+        self.pending = {} # index -> record line that arrived before an earlier chunk
+        self._lock = threading.Lock()
+        self._records = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+
+    def add(self, index, chunk, translation, model=None):
+        record = {"index": index, "source_hash": source_hash(chunk), "length": len(chunk), "translation": translation}
+        if hasattr(chunk, "line_start"):
+            record["lines"] = [chunk.line_start, chunk.line_end]
+        if translation is not None and model is not None and model != self.aimodel:
+            record["model"] = model
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self.pending[index] = line
+            while self.count in self.pending:
+                self._records.write(self.pending.pop(self.count) + "\n")
+                self.count += 1
+
+    def finish(self):
+        temporary = f"{self.path}.tmp"
+        with self._lock, open(temporary, "w", encoding="utf-8") as file:
+            file.write(json.dumps({"model": self.aimodel, "source": self.source_path, "chunks": self.count + len(self.pending)}, ensure_ascii=False) + "\n")
+            self._records.seek(0)
+            shutil.copyfileobj(self._records, file)
+            for index in sorted(self.pending): # only if a chunk never arrived
+                file.write(self.pending[index] + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+        self.close()
+
+    def close(self):
+        self._records.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+# Saves every chunk's source hash, line range and translation (atomically, replacing the previous manifest),
+# see ChunkManifestWriter. models: the model that produced each translation.
+def write_chunk_manifest(path, aimodel, source_path, chunks, translations, models=None):
+    models = models or [None] * len(chunks)
+    with ChunkManifestWriter(path, aimodel, source_path) as manifest:
+        for index, (chunk, translation, model) in enumerate(zip(chunks, translations, models)):
+            manifest.add(index, chunk, translation, model)
+        manifest.finish()
+
+# Returns {source_hash: (translation, model)} for the translated chunks of a previous run with the same model
+def load_chunk_manifest(path, aimodel):
+    translations = {}
+    if not os.path.exists(path):
+        return translations
+    with open(path, "r", encoding="utf-8") as file:
+        try:
+            header = json.loads(next(file, "{}"))
+        except json.JSONDecodeError:
+            return translations
+        if header.get("model") != aimodel:
+            return translations
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("translation") is not None:
+                translations[record["source_hash"]] = (record["translation"], record.get("model"))
+    return translations
+
+# Diffs the chunks of the current source against a previous chunk manifest.
+# Returns {index: (source_hash, translation, model)} for every chunk that can be reused, in the same form as load_journal.
+def reusable_chunks(chunks, previous):
+    reusable = {}
+    for index, chunk in enumerate(chunks):
+        digest = source_hash(chunk)
+        if digest in previous:
+            reusable[index] = (digest, *previous[digest])
+    return reusable
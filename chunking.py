@@ -47,7 +47,15 @@
 #                 │ + delimiter "-----CHUNK---│
 #                 └───────────────────────────┘
 
+from bisect import bisect_left, bisect_right
 from collections import deque
+from functools import lru_cache
+from itertools import accumulate, repeat
+from operator import add, sub
+import mmap
+import os
+import re
+import zlib
 
 # any paragraph longer than PARAGRAPH_SIZE will be split into equal smaller chunks with smart chunking
 PUNCTUATION = ['。', '!', '?'] #recognized punctuation for sentence ending.
@@ -64,74 +72,313 @@ def find_paragraph(line, min_chunk_size, max_chunk_size): #
             return True
     return False
 
+# weaker punctuation, only used to place a fallback split (hard_split=True) when no sentence ending fits
+SOFT_PUNCTUATION = ['，', '；', '：', '、']
+
+@lru_cache(maxsize=None)
+def _punctuation_pattern(punctuation):
+    return re.compile('[' + ''.join(re.escape(p) for p in punctuation) + ']')
+
+# returns the sorted offsets of every punctuation character in text, built in one pass
+# (the running sum of the text lengths between punctuation marks, kept at C speed)
+def punctuation_index(text, punctuation=PUNCTUATION):
+    between = _punctuation_pattern(tuple(punctuation)).split(text)[:-1]
+    return list(map(sub, accumulate(map(add, map(len, between), repeat(1))), repeat(1)))
+
+# Finds where to split text[start:end] using a punctuation index of the whole line (binary search, no scanning).
+# Both pieces must be at least min_chunk_size long. Returns the split offset, or -1 if there is none.
+def find_split_point(positions, start, end, min_chunk_size):
+    mid_point = start + (end - start) // 2
+    lowest = max(start, start + min_chunk_size - 1) # punctuation at i splits at i + 1
+    highest = min(end - 1, end - min_chunk_size - 1)
+
+    # nearest punctuation at or to the left of the mid point
+    i = bisect_right(positions, min(mid_point, highest)) - 1
+    if i >= 0 and positions[i] >= lowest:
+        return positions[i] + 1
+    # if not found, the nearest to the right
+    i = bisect_left(positions, max(mid_point, lowest))
+    if i < len(positions) and positions[i] <= highest:
+        return positions[i] + 1
+    return -1
+
 # logic for splitting paragraphs which are longer than PARAGRAPH_SIZE
     # 1. Find length of the paragraph and divide by 2 to get the mid point
     # 2. Look for the nearest punctuation to the mid point (either direction)
     # 3. Split the paragraph at that punctuation
-def split_paragraph(paragraph, min_chunk_size, max_chunk_size):
-    if len(paragraph) <= max_chunk_size:
-        return [paragraph]
-
-    mid_point = len(paragraph) // 2
-    split_index = -1
-
-    # Search for nearest punctuation to the left
-    for i in range(mid_point, -1, -1):
-        if paragraph[i] in PUNCTUATION:
-            if i + 1 >= min_chunk_size and (len(paragraph) - (i + 1)) >= min_chunk_size:
-                split_index = i + 1
-                break
-    # If not found, search to the right
-    if split_index == -1:
-        for i in range(mid_point, len(paragraph)):
-            if paragraph[i] in PUNCTUATION:
-                if i + 1 >= min_chunk_size and (len(paragraph) - (i + 1)) >= min_chunk_size:
-                    split_index = i + 1
-                    break
-    # If no valid split point, just return whole paragraph
-    if split_index == -1:
-        print("sketchy split!")
-        return [paragraph]
-    
-    left = paragraph[:split_index]
-    right = paragraph[split_index:]
-    return split_paragraph(left, min_chunk_size=min_chunk_size, max_chunk_size=max_chunk_size) + split_paragraph(right, min_chunk_size=min_chunk_size, max_chunk_size=max_chunk_size)
-
-def chunk_file(filepath, min_chunk_size=128, max_chunk_size=384):
-    with open(filepath, 'r', encoding='utf-8') as file:
-        content = file.read()
-        chunks = content.split('\n')
-
-        new_chunks = []
-        for line in chunks:
-            if find_paragraph(line, min_chunk_size, max_chunk_size):
-                # split_paragraph may return 1 or many pieces
-                new_chunks.extend(split_paragraph(line, min_chunk_size, max_chunk_size))
-            else:
-                new_chunks.append(line)
-
-        chunks = new_chunks
-        # First pass processing complete! Split the paragraphs correctly
-
-        # Second pass: Finalize the chunks by merging smaller chunks as necessary.
-            # 1. From the bottom up, if merging the current chunk with the previous chunk does not exceed MAX_CHUNK_SIZE, do so.
-            # 2. Continue until all chunks are processed.
-        finalized_chunks = deque()
-        for chunk in reversed(chunks):
-            if finalized_chunks and len(chunk) + len(finalized_chunks[0]) <= max_chunk_size:
-                # Preserve the newline between merged chunks, keeps the formatting consistent.
-                merged_chunk = chunk + '\n' + finalized_chunks.popleft()
-                finalized_chunks.appendleft(merged_chunk)
-            else:
-                finalized_chunks.appendleft(chunk)
-        # # Save finalized chunks to a new file (can be used to check chunk sizes)
-        # with open('finalized_chunks.txt', 'w', encoding='utf-8') as finalfile:
-        #     for i, chunk in enumerate(finalized_chunks):
-        #         # finalfile.write(chunk + '\n')
-        #         # write delimiter between chunks (not after the last chunk)
-        #         if i != len(finalized_chunks) - 1:
-        #             finalfile.write(f"-----CHUNK----- ({len(chunk)} chars)\n")
-    return finalized_chunks
+    # 4. Repeat on each half until every piece fits
+# Works on (start, end) offsets into the paragraph, so only the final pieces are ever sliced.
+# If a piece has no valid split point it is kept whole ("sketchy split!"), unless hard_split is set, in which case
+# it is split at the SOFT_PUNCTUATION nearest the mid point, or at the mid point itself for unpunctuated text.
+def split_paragraph_spans(paragraph, min_chunk_size, max_chunk_size, hard_split=False):
+    positions = punctuation_index(paragraph)
+    soft_positions = None
+    spans = []
+    remaining = [(0, len(paragraph))]
+    while remaining:
+        start, end = remaining.pop()
+        if end - start <= max_chunk_size:
+            spans.append((start, end))
+            continue
+
+        split_index = find_split_point(positions, start, end, min_chunk_size)
+        if split_index == -1 and hard_split:
+            if soft_positions is None:
+                soft_positions = punctuation_index(paragraph, SOFT_PUNCTUATION)
+            split_index = find_split_point(soft_positions, start, end, min_chunk_size)
+            if split_index == -1:
+                split_index = start + (end - start) // 2
+        # If no valid split point, just keep the whole piece
+        if not start < split_index < end:
+            print("sketchy split!")
+            spans.append((start, end))
+            continue
+
+        # right half is pushed first so the left half is handled first, keeping the pieces in order
+        remaining.append((split_index, end))
+        remaining.append((start, split_index))
+    return spans
+
+def split_paragraph(paragraph, min_chunk_size, max_chunk_size, hard_split=False):
+    return [paragraph[start:end] for start, end in split_paragraph_spans(paragraph, min_chunk_size, max_chunk_size, hard_split)]
+
+# Yields the lines of a file one at a time without their newline, matching content.split('\n') on the whole file
+# (so a trailing newline, or an empty file, yields a final empty line). With use_mmap=True the file is memory
+# mapped instead of read through a buffered text stream, newlines are normalized the same way ('\r\n' and '\r' -> '\n').
+def read_lines(filepath, use_mmap=False):
+    ended_with_newline = True
+    if use_mmap and os.path.getsize(filepath) > 0:
+        with open(filepath, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for raw_line in iter(mapped.readline, b''):
+                parts = raw_line.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n').split('\n')
+                yield from parts[:-1]
+                ended_with_newline = parts[-1] == ''
+                if not ended_with_newline:
+                    yield parts[-1]
+    else:
+        with open(filepath, 'r', encoding='utf-8') as file:
+            for line in file:
+                ended_with_newline = line.endswith('\n')
+                yield line[:-1] if ended_with_newline else line
+    if ended_with_newline:
+        yield ''
+
+# A chunk stored as (start, end) spans into a source buffer shared by its neighbouring chunks, instead of its own string.
+# Merging never copies text, the text is built once by str(chunk) when it's sent to a model or written out.
+# Spans are joined with '\n', exactly like the merged strings used to be. Merged whole lines are already '\n' separated
+# in the buffer, so they are a single span, only pieces of a split paragraph add more.
+# length: len(str(chunk)) without building it, line_start/line_end: 0-based source line range,
+# byte_offset: where the chunk starts in the UTF-8 encoded file (counting '\n' newlines).
+class Chunk:
+    __slots__ = ('source', 'spans', 'length', 'line_start', 'line_end', 'byte_offset')
+
+    def __init__(self, source, spans, length, line_start, line_end, byte_offset):
+        self.source = source
+        self.spans = spans
+        self.length = length
+        self.line_start = line_start
+        self.line_end = line_end
+        self.byte_offset = byte_offset
+
+    @property
+    def text(self):
+        return '\n'.join(self.source[start:end] for start, end in self.spans)
+
+    def __str__(self):
+        return self.text
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return f"Chunk(lines {self.line_start}-{self.line_end}, {self.length} chars)"
+
+# Second pass: Finalize the chunks by merging smaller chunks as necessary.
+    # 1. From the bottom up, if merging the current chunk with the previous chunk does not exceed MAX_CHUNK_SIZE, do so.
+    # 2. Continue until all chunks are processed.
+# The merge only looks at lengths, each resulting Chunk is then built once from its pieces.
+# lines: the source lines the pieces come from, joined into the buffer all of the Chunks point into
+# spans, piece_lines: each piece's (start, end) in that buffer and its line number
+# splits: splits[i] counts the pieces up to i that continue the same line as the piece before them. Those are the only
+#   places a merged chunk isn't one contiguous slice of the buffer.
+# byte_offset: UTF-8 offset of the first line in the file. Returns the chunks and the byte offset of the next
+# segment's first line, which is this segment's last line again if keep_last_line (a paragraph split across segments).
+def merge_chunks(lines, spans, piece_lines, splits, max_chunk_size, byte_offset=0, keep_last_line=False):
+    source = '\n'.join(lines)
+
+    groups = [] # (first piece, last piece, merged length), bottom-up
+    for index in range(len(spans) - 1, -1, -1):
+        start, end = spans[index]
+        if groups and (end - start) + groups[-1][2] <= max_chunk_size:
+            # Preserve the newline between merged chunks, keeps the formatting consistent.
+            groups[-1] = (index, groups[-1][1], (end - start) + 1 + groups[-1][2])
+        else:
+            groups.append((index, index, end - start))
+
+    finalized_chunks = deque()
+    cursor = 0
+    for first, last, length in reversed(groups):
+        if splits[first] == splits[last]:
+            chunk_spans = [(spans[first][0], spans[last][1])]
+        else:
+            chunk_spans = [spans[first]]
+            for start, end in spans[first + 1:last + 1]:
+                if chunk_spans[-1][1] + 1 == start:
+                    chunk_spans[-1] = (chunk_spans[-1][0], end)
+                else:
+                    chunk_spans.append((start, end))
+        byte_offset += len(source[cursor:chunk_spans[0][0]].encode('utf-8'))
+        cursor = chunk_spans[0][0]
+        finalized_chunks.append(Chunk(source, chunk_spans, length, piece_lines[first], piece_lines[last], byte_offset))
+
+    next_line_offset = len(source) - len(lines[-1]) if keep_last_line else len(source) + 1
+    if next_line_offset >= cursor:
+        byte_offset += len(source[cursor:next_line_offset].encode('utf-8')) + (0 if keep_last_line else 1)
+    else:
+        byte_offset -= len(source[next_line_offset:cursor].encode('utf-8'))
+    return finalized_chunks, byte_offset
+
+# Streaming version of chunk_file: reads the file lazily and yields each finalized Chunk as soon as its boundaries are known.
+# First pass: split paragraphs into pieces of at most max_chunk_size (where possible), other lines stay whole.
+# The bottom-up merge normally needs the whole file, but whenever two neighbouring pieces are together longer than
+# max_chunk_size no merge can ever cross between them (the lower piece's chunk is at least as long as that piece).
+# Everything above such a boundary is final, so only the pieces since the last boundary are held in memory.
+# The chunk texts are identical to chunk_file.
+def iter_chunk_spans(filepath, min_chunk_size=128, max_chunk_size=384, use_mmap=False, hard_split=False):
+    lines, spans, piece_lines, splits = [], [], [], []
+    split_count = 0
+    buffer_length = -1 # length of '\n'.join(lines)
+    previous_length = 0
+    byte_offset = 0
+    for line_number, line in enumerate(read_lines(filepath, use_mmap)):
+        # with hard_split every overlong line is split, punctuated or not (scans often have no sentence endings)
+        if find_paragraph(line, min_chunk_size, max_chunk_size) or (hard_split and len(line) > max_chunk_size):
+            # split_paragraph_spans may return 1 or many pieces
+            pieces = split_paragraph_spans(line, min_chunk_size, max_chunk_size, hard_split)
+        else:
+            pieces = ((0, len(line)),)
+
+        line_added = False
+        for start, end in pieces:
+            if spans and previous_length + (end - start) > max_chunk_size:
+                finalized_chunks, byte_offset = merge_chunks(lines, spans, piece_lines, splits, max_chunk_size, byte_offset, keep_last_line=line_added)
+                yield from finalized_chunks
+                lines = [line] if line_added else []
+                buffer_length = len(line) if line_added else -1
+                spans, piece_lines, splits = [], [], []
+                split_count = 0
+            if not line_added:
+                lines.append(line)
+                buffer_length += 1 + len(line)
+                line_added = True
+            elif spans:
+                split_count += 1
+            line_offset = buffer_length - len(line)
+            spans.append((line_offset + start, line_offset + end))
+            piece_lines.append(line_number)
+            splits.append(split_count)
+            previous_length = end - start
+    finalized_chunks, _ = merge_chunks(lines, spans, piece_lines, splits, max_chunk_size, byte_offset)
+    yield from finalized_chunks
+
+# Same as iter_chunk_spans, but yields plain strings
+def iter_chunks(filepath, min_chunk_size=128, max_chunk_size=384, use_mmap=False, hard_split=False):
+    for chunk in iter_chunk_spans(filepath, min_chunk_size, max_chunk_size, use_mmap, hard_split):
+        yield chunk.text
+
+def chunk_file(filepath, min_chunk_size=128, max_chunk_size=384, use_mmap=False, hard_split=False):
+    return deque(iter_chunks(filepath, min_chunk_size=min_chunk_size, max_chunk_size=max_chunk_size, use_mmap=use_mmap, hard_split=hard_split))
+
+# Content-defined chunking: boundaries anchored to the text around them instead of to accumulated lengths.
+# With the bottom-up merge a one-character edit can shift every boundary before it, so a cache or a diff sees all
+# of those chunks as new. Here a chunk may only end at a sentence ending or a line break (a candidate), and it ends
+# at the first candidate at least min_chunk_size in whose preceding CUT_WINDOW characters hash to 0 mod cut_divisor.
+# That depends only on the nearby text, so after an edit the boundaries fall back into place at the next such
+# candidate and every chunk further on is unchanged.
+#   - no hashed cut before max_chunk_size: the same hash picks among the candidates in the window, then among the
+#     soft punctuation (comma-only text), then (unpunctuated scans) among the characters, each time the first one
+#     hashing to 0 mod a smaller divisor or else the one with the smallest hash. A cut at a fixed distance from the
+#     previous one would carry an edit's shift on into every later chunk, so max_chunk_size itself is only used when
+#     the window is too short to hold a cut.
+#   - a cut at a line break drops that '\n', chunks that only continue a line start right after the punctuation
+# cut_divisor sets how far past min_chunk_size chunks run on average (bigger = longer chunks).
+CUT_PUNCTUATION = PUNCTUATION + ['！', '？']
+CUT_WINDOW = 16
+SOFT_CUT_DIVISOR = 4
+UNPUNCTUATED_CUT_DIVISOR = 32
+_cut_candidates = re.compile('[' + ''.join(re.escape(p) for p in CUT_PUNCTUATION) + '\n]')
+
+def _cut_hash(text, start, cut):
+    return zlib.crc32(text[max(start, cut - CUT_WINDOW):cut].encode('utf-8'))
+
+# The first of cuts whose window hashes to 0 mod divisor, else the one with the smallest hash (None without cuts)
+def _hashed_cut(text, start, cuts, divisor):
+    best = None
+    for cut in cuts:
+        value = _cut_hash(text, start, cut)
+        if value % divisor == 0:
+            return cut
+        if best is None or value < best[0]:
+            best = (value, cut)
+    return best[1] if best is not None else None
+
+# Where the chunk starting at text[start] ends, or None if more text is needed to decide (final=False)
+def content_defined_cut(text, start, min_chunk_size, max_chunk_size, cut_divisor=8, final=False):
+    available = len(text) - start
+    if available <= max_chunk_size and final:
+        limit = len(text)
+    else:
+        limit = start + min(available, max_chunk_size)
+    candidates = []
+    for match in _cut_candidates.finditer(text, start, min(len(text), limit + 1)):
+        cut = match.start() if match.group() == '\n' else match.end()
+        if cut > limit or cut - start < min_chunk_size:
+            continue
+        if _cut_hash(text, start, cut) % cut_divisor == 0:
+            return cut
+        candidates.append(cut)
+    if available <= max_chunk_size:
+        return len(text) if final else None
+    if candidates:
+        return _hashed_cut(text, start, candidates, SOFT_CUT_DIVISOR)
+    soft = [match.end() for match in _punctuation_pattern(tuple(SOFT_PUNCTUATION)).finditer(text, start + min_chunk_size, limit)]
+    if soft:
+        return _hashed_cut(text, start, soft, SOFT_CUT_DIVISOR)
+    # no punctuation at all: any character can be a candidate
+    cut = _hashed_cut(text, start, range(start + min_chunk_size, limit), UNPUNCTUATED_CUT_DIVISOR)
+    return cut if cut is not None else limit
+
+# Yields Chunks with content-defined boundaries (see content_defined_cut). Reads the file lazily like iter_chunk_spans,
+# holding only the text since the last boundary plus the next window, which the chunks in it share as their source.
+def iter_content_defined_spans(filepath, min_chunk_size=128, max_chunk_size=384, use_mmap=False, cut_divisor=8):
+    lines = read_lines(filepath, use_mmap)
+    buffer = next(lines, '')
+    position = 0 # start of the next chunk in buffer
+    line_number = 0
+    byte_offset = 0
+    final = False
+    while True:
+        # read on until the buffer holds a full window (or the whole rest of the file)
+        if not final and len(buffer) - position <= max_chunk_size:
+            buffer = buffer[position:]
+            position = 0
+            while not final and len(buffer) <= max_chunk_size:
+                line = next(lines, None)
+                if line is None:
+                    final = True
+                else:
+                    buffer += '\n' + line
+        end = content_defined_cut(buffer, position, min_chunk_size, max_chunk_size, cut_divisor, final)
+        next_start = end + 1 if buffer[end:end + 1] == '\n' else end
+        if final and next_start >= len(buffer) and buffer.endswith('\n'):
+            end = len(buffer) - 1 # the file's trailing newline
+        if end > position:
+            yield Chunk(buffer, [(position, end)], end - position, line_number, line_number + buffer.count('\n', position, end), byte_offset)
+        line_number += buffer.count('\n', position, next_start)
+        byte_offset += len(buffer[position:next_start].encode('utf-8'))
+        position = next_start
+        if final and position >= len(buffer):
+            return
 
 # FILEPATH = "recreated_chinese.txt"
 # MIN_CHUNK_SIZE = 128
@@ -0,0 +1,144 @@
+# This file handles chunk deduplication between chunking and translation.
+# Our source collections quote the same passages, formula lists and headings over and over, so each unique
+# chunk is translated once and its translation is fanned out to every other occurrence.
+#   1. Exact duplicates: same text after normalization (NFKC, whitespace removed), found by hash
+#   2. Near duplicates (optional): MinHash signatures over character n-grams, with LSH banding to find
+#      candidates and the estimated Jaccard similarity to confirm them (>= threshold)
+# Keys can be anything hashable, e.g. a chunk index for one file or (file, index) across a directory run.
+
+import hashlib
+import re
+import unicodedata
+import zlib
+
+from translationmodels.governor import estimate_tokens
+
+WHITESPACE = re.compile(r"\s+")
+
+def normalize(text):
+    return WHITESPACE.sub("", unicodedata.normalize("NFKC", text))
+
+class Deduplicator:
+    # near_duplicates: also match chunks whose n-gram Jaccard similarity is at least threshold
+    # num_hashes / bands: MinHash signature size and LSH bands (num_hashes must be divisible by bands)
+    # min_length: shorter chunks are only matched exactly, n-gram similarity means little for them
+    def __init__(self, near_duplicates=False, threshold=0.9, ngram=3, num_hashes=64, bands=16, min_length=32):
+        self.near_duplicates = near_duplicates
+        self.threshold = threshold
+        self.ngram = ngram
+        self.num_hashes = num_hashes
+        self.bands = bands
+        self.rows = num_hashes // bands
+        self.min_length = min_length
+
+        self.exact = {} # normalized text hash -> first key
+        self.buckets = {} # (band, band values) -> keys
+        self.signatures = {} # key -> signature
+
+        self.translations = {} # key -> translation of every first occurrence that finished, see resolve()
+        self.models = {} # key -> model that produced it, when known
+        self.matches = {} # key of a duplicate -> (near, estimated tokens) until reused() counts it
+        self._scopes = 0
+
+        self.exact_duplicates = 0
+        self.near_duplicates_found = 0
+        self.saved_tokens = 0
+
+    # One-permutation MinHash: every n-gram is hashed once, the hash picks a bin and each bin keeps its minimum.
+    # Empty bins borrow from the next non-empty bin (densification) so short texts still get a full signature.
+    def signature(self, normalized):
+        k = self.num_hashes
+        bins = [None] * k
+        for i in range(len(normalized) - self.ngram + 1):
+            h = zlib.crc32(normalized[i:i + self.ngram].encode("utf-8"))
+            b, value = h % k, h // k
+            if bins[b] is None or value < bins[b]:
+                bins[b] = value
+        if all(value is None for value in bins):
+            return None
+        signature = []
+        for b in range(k):
+            distance = 0
+            while bins[(b + distance) % k] is None:
+                distance += 1
+            signature.append((bins[(b + distance) % k], distance))
+        return signature
+
+    def similarity(self, first, second):
+        return sum(1 for a, b in zip(first, second) if a == b) / self.num_hashes
+
+    # Returns the key of an earlier chunk this text duplicates, or None if it's the first occurrence
+    # (it's then registered under key, so later duplicates point back to it).
+    def check(self, key, text):
+        normalized = normalize(text)
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        if digest in self.exact:
+            self.matches[key] = (False, estimate_tokens(text))
+            return self.exact[digest]
+        self.exact[digest] = key
+
+        if not self.near_duplicates or len(normalized) < self.min_length:
+            return None
+        signature = self.signature(normalized)
+        if signature is None:
+            return None
+
+        band_keys = [(band, tuple(signature[band * self.rows:(band + 1) * self.rows])) for band in range(self.bands)]
+        best, best_similarity = None, self.threshold
+        for band_key in band_keys:
+            for candidate in self.buckets.get(band_key, ()):
+                similarity = self.similarity(signature, self.signatures[candidate])
+                if similarity >= best_similarity:
+                    best, best_similarity = candidate, similarity
+        if best is not None:
+            self.matches[key] = (True, estimate_tokens(text))
+            return best
+
+        self.signatures[key] = signature
+        for band_key in band_keys:
+            self.buckets.setdefault(band_key, []).append(key)
+        return None
+
+    # A fresh key prefix for one translate_chunks call, so a shared Deduplicator can span several files
+    def new_scope(self):
+        self._scopes += 1
+        return self._scopes
+
+    # Records the translation of a first occurrence so duplicates found later (even in other files) can reuse it
+    def resolve(self, key, translation, model=None):
+        self.translations[key] = translation
+        if model is not None:
+            self.models[key] = model
+
+    # Counts a duplicate as saved once an earlier translation is actually filled in for it. Nothing is counted
+    # when the first occurrence failed (translation is None) or the duplicate was replayed from a journal.
+    def reused(self, key, translation):
+        match = self.matches.pop(key, None)
+        if match is None or translation is None:
+            return
+        near, tokens = match
+        if near:
+            self.near_duplicates_found += 1
+        else:
+            self.exact_duplicates += 1
+        self.saved_tokens += tokens
+
+    # chunks rather than requests: with pack_tokens a chunk is only part of a request
+    def report(self):
+        saved = self.exact_duplicates + self.near_duplicates_found
+        return (
+            f"Deduplication: {saved} duplicate chunks ({self.exact_duplicates} exact, {self.near_duplicates_found} near) "
+            f"reused an earlier translation instead of being sent, saving ~{self.saved_tokens} input tokens"
+        )
+
+# dedup: None/False (off), True/"exact", "near" (exact + MinHash near-duplicates) or a Deduplicator to share
+def make_deduplicator(dedup):
+    if not dedup:
+        return None
+    if isinstance(dedup, Deduplicator):
+        return dedup
+    if dedup is True:
+        dedup = "exact"
+    if dedup not in ("exact", "near"):
+        raise ValueError(f"dedup must be 'exact' or 'near', not {dedup!r}")
+    return Deduplicator(near_duplicates=(dedup == "near"))
@@ -0,0 +1,221 @@
+# This file handles hedged requests and failover, so one stuck or failing request can't stall a whole file.
+#   1. Hedging: once a request has been running longer than the rolling latency percentile of its model (p95 of
+#      the last `window` requests by default), a duplicate is sent to the hedge model (the secondary model, or the
+#      same model if there is none) and whichever answers first is used. The other answer is ignored (still recorded
+#      in telemetry, it was paid for).
+#   2. Failover: chunks the primary model returns as None (errors, or a request that raised) are sent to the
+#      secondary model before they are given up on.
+# Every chunk comes back with the model that produced it, so the output can say which model translated what.
+# HedgedRequests replaces the executor/pending-futures bookkeeping in the schedulers (translate_file.translate_chunks
+# and translate_directory.translate_directory_parallel). Without a policy each group is one request, exactly as before.
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import telemetry
+
+class HedgePolicy:
+    # secondary: model used for failover (and for hedges unless hedge_model is set). Its client is initialized with
+    #   the primary's (translate_file.initialize_clients), the API key comes from its provider's environment variable.
+    # percentile: a request still running after this latency percentile of its model gets hedged
+    # hedge_model: where hedges go, defaults to secondary, or the primary model itself without a secondary
+    # min_samples: no hedging until this many requests to the model finished (the percentile means nothing before)
+    # window: number of recent latencies the percentile is taken over (requests that went to the model, cache hits
+    #   don't count)
+    # min_delay: never hedge sooner than this many seconds, so fast runs don't hedge on noise
+    # failover: resend failed chunks to the secondary model
+    def __init__(self, secondary=None, percentile=0.95, hedge_model=None, min_samples=20, window=200, min_delay=1.0, failover=True):
+        self.secondary = secondary
+        self.percentile = percentile
+        self.hedge_model = hedge_model
+        self.min_samples = min_samples
+        self.window = window
+        self.min_delay = min_delay
+        self.failover = failover
+        self.latencies = {} # model -> deque of recent request latencies
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self._lock = threading.Lock()
+
+    def observe(self, model, latency):
+        with self._lock:
+            self.latencies.setdefault(model, deque(maxlen=self.window)).append(latency)
+
+    # seconds after which a request to model gets hedged, None while there aren't enough samples
+    def delay(self, model):
+        with self._lock:
+            latencies = list(self.latencies.get(model, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, telemetry.percentile(latencies, self.percentile))
+
+    def hedge_target(self, model):
+        return self.hedge_model or self.secondary or model
+
+    def report(self):
+        return f"Hedging: {self.hedged} requests hedged ({self.hedge_wins} won by the hedge), {self.failovers} failovers to {self.secondary}"
+
+# One request for some of a group's chunks
+class Attempt:
+    __slots__ = ("key", "positions", "model", "kind", "started")
+
+    def __init__(self, key, positions, model, kind="primary"):
+        self.key = key
+        self.positions = positions # which of the group's texts it carries
+        self.model = model
+        self.kind = kind # "primary", "hedge" or "failover"
+        self.started = None # set by the worker thread once the request is actually sent
+
+class Group:
+    def __init__(self, texts):
+        self.texts = texts
+        self.translations = [None] * len(texts)
+        self.models = [None] * len(texts)
+        self.attempts = set() # futures still running for this group
+        self.tried = set()
+        self.primary = None # the first attempt, the one that gets hedged
+        self.hedged = False
+        self.fell_back = 0
+
+    def missing(self):
+        return [position for position, translation in enumerate(self.translations) if translation is None]
+
+class HedgedRequests:
+    # max_workers: requests to the primary model in flight at once. Hedges and failovers get their own pool of the
+    #   same size, so they don't queue behind the requests they are meant to overtake.
+    # send: function(texts, model, pack_tokens) -> (translations, fell_back), e.g. translate_file.translate_group
+    # on_attempt: called as on_attempt(key, positions, record, model, translations, error) for every finished request,
+    #   including hedges that lost, for telemetry and error messages
+    def __init__(self, max_workers, send, aimodel, pack_tokens=None, policy=None, on_attempt=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.send = send
+        self.aimodel = aimodel
+        self.pack_tokens = pack_tokens
+        self.policy = policy
+        self.max_workers = max_workers
+        self.on_attempt = on_attempt
+        self.groups = {} # key -> Group still waiting for translations
+        self.attempts = {} # future -> Attempt, for every request still running
+        self.extra = None
+
+    def __len__(self):
+        return len(self.groups)
+
+    # Sends a group of chunk texts, key identifies it in the results of wait()
+    def submit(self, key, texts):
+        group = Group(texts)
+        self.groups[key] = group
+        group.primary = self._send(Attempt(key, list(range(len(texts))), self.aimodel), self.executor)
+
+    def _run(self, attempt, submitted, texts):
+        attempt.started = time.monotonic()
+        return telemetry.timed_request(self.send, submitted, texts, attempt.model, self.pack_tokens)
+
+    def _send(self, attempt, executor):
+        group = self.groups[attempt.key]
+        group.tried.add(attempt.model)
+        texts = [group.texts[position] for position in attempt.positions]
+        future = executor.submit(self._run, attempt, time.monotonic(), texts)
+        self.attempts[future] = attempt
+        group.attempts.add(future)
+        return future
+
+    def _send_extra(self, attempt):
+        if self.extra is None:
+            self.extra = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._send(attempt, self.extra)
+
+    # Hedges every request that is past its deadline, returns the seconds until the next one could be (or None).
+    # A request still queued in the pool can't be due before a full delay from now.
+    def _hedge_due(self):
+        delay = self.policy.delay(self.aimodel) if self.policy is not None else None
+        if delay is None:
+            return None
+        now = time.monotonic()
+        soonest = None
+        for key, group in list(self.groups.items()):
+            attempt = self.attempts.get(group.primary)
+            if group.hedged or attempt is None:
+                continue
+            remaining = delay if attempt.started is None else attempt.started + delay - now
+            if remaining > 0:
+                soonest = remaining if soonest is None else min(soonest, remaining)
+                continue
+            group.hedged = True
+            self.policy.hedged += 1
+            self._send_extra(Attempt(key, group.missing(), self.policy.hedge_target(self.aimodel), "hedge"))
+        return soonest
+
+    # Blocks until at least one group is finished, returns [(key, translations, models, fell_back)].
+    # A translation is None only if every model tried failed on it.
+    def wait(self):
+        while True:
+            timeout = self._hedge_due()
+            done, _ = wait(self.attempts, timeout=timeout, return_when=FIRST_COMPLETED)
+            finished = []
+            for future in done:
+                result = self._collect(future)
+                if result is not None:
+                    finished.append(result)
+            if finished:
+                return finished
+
+    def _collect(self, future):
+        attempt = self.attempts.pop(future)
+        record = None
+        error = None
+        try:
+            (translations, fell_back), record = future.result()
+        except Exception as e:
+            error = e
+            translations = [None] * len(attempt.positions)
+            fell_back = 0
+        if self.on_attempt is not None:
+            self.on_attempt(attempt.key, attempt.positions, record, attempt.model, translations, error)
+        # answers from the local translation cache take a millisecond, counting them would drag the percentile
+        # down to min_delay and hedge nearly every real request
+        if self.policy is not None and record is not None and attempt.kind == "primary" and not record.cached:
+            self.policy.observe(self.aimodel, record.latency)
+
+        group = self.groups.get(attempt.key)
+        if group is None:
+            return None # a hedge (or the original request) that lost the race
+        group.attempts.discard(future)
+        won = False
+        for position, translation in zip(attempt.positions, translations):
+            if group.translations[position] is None and translation is not None:
+                group.translations[position] = translation
+                group.models[position] = attempt.model
+                won = True
+        if won and attempt.kind == "hedge":
+            self.policy.hedge_wins += 1
+        group.fell_back += fell_back
+
+        missing = group.missing()
+        if missing and not group.attempts and self.policy is not None and self.policy.failover:
+            secondary = self.policy.secondary
+            if secondary is not None and secondary not in group.tried:
+                self.policy.failovers += 1
+                self._send_extra(Attempt(attempt.key, missing, secondary, "failover"))
+        if missing and group.attempts:
+            return None
+        del self.groups[attempt.key]
+        return attempt.key, group.translations, group.models, group.fell_back
+
+    # Stops waiting for requests that lost a race (they finish in the background, but no longer hold up the output).
+    # Losers that already finished are still passed to on_attempt.
+    def close(self):
+        for future in [future for future in self.attempts if future.done()]:
+            self._collect(future)
+        for executor in (self.executor, self.extra):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,579 @@
+# This file holds a durable job queue for translating large collections with any number of worker processes, on one
+# machine or several. Everything lives in one SQLite database:
+#   files: one row per source file, with its output location and model. A file is also a task of its own: once all of
+#     its chunks are translated, one worker claims it and assembles the output (the finalizer)
+#   chunks: every chunk's source text and, once translated, its translation and the model that produced it
+#   tasks: one request's worth of chunks (a single chunk, or a packed group with pack_tokens)
+#   workers: who is (or was) working on the queue and how much they did
+# Workers claim tasks with a lease (lease_seconds). A heartbeat thread keeps extending the leases of the tasks a worker
+# is still translating; a task whose lease runs out (the worker crashed, was killed or lost its connection) goes back
+# to the queue and is claimed by someone else. Tasks that fail are retried up to max_attempts times.
+# Chunk texts are stored in the database, so workers only need the database and the output directory, not the sources.
+#
+#     python jobqueue.py add COLLECTION translations_output --model gpt-4o-mini-2024-07-18 --pack-tokens 1500
+#     python jobqueue.py work            # on as many machines / in as many terminals as you like
+#     python jobqueue.py status
+#
+# Several processes on one host can share the default WAL database. For workers on several hosts put the database on
+# shared storage that supports file locks and open it with shared_storage=True (--shared-storage): WAL needs shared
+# memory, which network filesystems don't provide, so the rollback journal is used instead.
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import checkpoint
+import hedging
+import telemetry
+import translate_directory
+import translate_file
+
+DEFAULT_QUEUE_PATH = "translation_queue.sqlite3"
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+THROUGHPUT_WINDOW = 600 # seconds of finished tasks the status throughput is measured over
+
+# A chunk as the finalizer hands it to the output writer: its text, plus the source lines it came from
+class QueuedChunk(str):
+    def __new__(cls, text, line_start=None, line_end=None):
+        chunk = super().__new__(cls, text)
+        if line_start is not None:
+            chunk.line_start = line_start
+            chunk.line_end = line_end
+        return chunk
+
+class Task:
+    __slots__ = ("id", "file_id", "model", "pack_tokens", "indices", "texts", "attempts")
+
+    def __init__(self, id, file_id, model, pack_tokens, indices, texts, attempts):
+        self.id = id
+        self.file_id = file_id
+        self.model = model
+        self.pack_tokens = pack_tokens
+        self.indices = indices # chunk indices still untranslated, a retry only resends those
+        self.texts = texts
+        self.attempts = attempts
+
+class JobQueue:
+    # lease_seconds: how long a claimed task stays with its worker without a heartbeat
+    # max_attempts: claims per task before it is marked failed (retry_failed() puts failed tasks back)
+    # shared_storage: the database is on a network filesystem used by several hosts, see the top of the file
+    def __init__(self, path=DEFAULT_QUEUE_PATH, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS, shared_storage=False):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.shared_storage = shared_storage
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "id INTEGER PRIMARY KEY, source TEXT NOT NULL, output_dir TEXT NOT NULL, output_name TEXT NOT NULL, "
+                "model TEXT NOT NULL, pack_tokens INTEGER, jsonl INTEGER NOT NULL DEFAULT 0, chunk_count INTEGER NOT NULL, "
+                "status TEXT NOT NULL DEFAULT 'queued', worker TEXT, lease_until REAL, failed_chunks INTEGER, "
+                "created_at REAL NOT NULL, finished_at REAL, UNIQUE (output_dir, output_name))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "file_id INTEGER NOT NULL, idx INTEGER NOT NULL, text TEXT NOT NULL, line_start INTEGER, line_end INTEGER, "
+                "translation TEXT, model TEXT, PRIMARY KEY (file_id, idx))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                "id INTEGER PRIMARY KEY, file_id INTEGER NOT NULL, first_index INTEGER NOT NULL, last_index INTEGER NOT NULL, "
+                "status TEXT NOT NULL DEFAULT 'pending', worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+                "last_error TEXT, finished_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_until)")
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_file ON tasks (file_id, status)")
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_finished ON tasks (finished_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS workers ("
+                "name TEXT PRIMARY KEY, host TEXT, pid INTEGER, started_at REAL, heartbeat_at REAL, "
+                "tasks_done INTEGER NOT NULL DEFAULT 0, chunks_done INTEGER NOT NULL DEFAULT 0)"
+            )
+
+    # one connection per thread, like translation_cache.TranslationCache. Transactions are started explicitly
+    # (isolation_level=None) so a claim can take the write lock before it reads.
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False, isolation_level=None)
+            if self.shared_storage:
+                conn.execute("PRAGMA journal_mode=DELETE")
+                conn.execute("PRAGMA synchronous=FULL")
+            else:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    # BEGIN IMMEDIATE takes the write lock up front, so two workers can never claim the same rows
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # Queues a file: chunks it and stores one task per request (packed groups with pack_tokens).
+    # Returns the number of chunks queued, or None if the output is already queued (or complete in its manifest).
+    def add_file(self, filepath, output_dir, aimodel, output_name=None, pack_tokens=None, jsonl=False, content_defined=False, hard_split=False):
+        output_dir = os.path.abspath(output_dir)
+        if output_name is None:
+            output_name = f"{os.path.splitext(os.path.basename(filepath))[0]}_translated"
+        if checkpoint.is_complete(output_dir, output_name):
+            return None
+        conn = self._connection()
+        if conn.execute("SELECT 1 FROM files WHERE output_dir = ? AND output_name = ?", (output_dir, output_name)).fetchone():
+            return None
+
+        chunks = list(translate_file.chunk_source(filepath, content_defined, hard_split))
+        groups = list(translate_file.group_chunks(list(enumerate(chunks)), pack_tokens))
+        with self._transaction() as conn:
+            file_id = conn.execute(
+                "INSERT OR IGNORE INTO files (source, output_dir, output_name, model, pack_tokens, jsonl, chunk_count, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(filepath), output_dir, output_name, aimodel, pack_tokens, int(jsonl), len(chunks), time.time()),
+            ).lastrowid
+            if not file_id:
+                return None
+            conn.executemany(
+                "INSERT INTO chunks (file_id, idx, text, line_start, line_end) VALUES (?, ?, ?, ?, ?)",
+                [(file_id, index, str(chunk), getattr(chunk, "line_start", None), getattr(chunk, "line_end", None)) for index, chunk in enumerate(chunks)],
+            )
+            conn.executemany(
+                "INSERT INTO tasks (file_id, first_index, last_index) VALUES (?, ?, ?)",
+                [(file_id, group[0][0], group[-1][0]) for group in groups],
+            )
+            if not chunks:
+                conn.execute("UPDATE files SET status = 'done', failed_chunks = 0, finished_at = ? WHERE id = ?", (time.time(), file_id))
+        return len(chunks)
+
+    # Queues every .txt file in directory, returns (files queued, chunks queued)
+    def add_directory(self, directory, output_dir, aimodel, pack_tokens=None, jsonl=False, content_defined=False, hard_split=False):
+        files = 0
+        chunks = 0
+        for filename in translate_directory.list_txt_files(directory):
+            try:
+                added = self.add_file(os.path.join(directory, filename), output_dir, aimodel, pack_tokens=pack_tokens, jsonl=jsonl, content_defined=content_defined, hard_split=hard_split)
+            except Exception as e:
+                print(f"\nError queueing {filename}: {e}")
+                continue
+            if added is not None:
+                files += 1
+                chunks += added
+        return files, chunks
+
+    def register(self, worker):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO workers (name, host, pid, started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET host = excluded.host, pid = excluded.pid, started_at = excluded.started_at, heartbeat_at = excluded.heartbeat_at",
+                (worker, socket.gethostname(), os.getpid(), now, now),
+            )
+
+    # Tasks whose lease ran out after their last allowed attempt are failed instead of handed out again
+    def _expire(self, conn, now):
+        conn.execute(
+            "UPDATE tasks SET status = 'failed', worker = NULL, lease_until = NULL, last_error = 'lease expired' "
+            "WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+            (now, self.max_attempts),
+        )
+
+    # (model, pack_tokens) of the oldest task that can be claimed now, or None
+    def next_work(self):
+        row = self._connection().execute(
+            "SELECT files.model, files.pack_tokens FROM tasks JOIN files ON files.id = tasks.file_id "
+            "WHERE (tasks.status = 'pending' OR (tasks.status = 'leased' AND tasks.lease_until < ? AND tasks.attempts < ?)) "
+            "ORDER BY tasks.id LIMIT 1",
+            (time.time(), self.max_attempts),
+        ).fetchone()
+        return tuple(row) if row is not None else None
+
+    # Leases up to count tasks for one model and pack size: pending ones, and leased ones whose lease ran out
+    def claim(self, worker, count, model, pack_tokens=None):
+        now = time.time()
+        with self._transaction() as conn:
+            self._expire(conn, now)
+            rows = conn.execute(
+                "SELECT tasks.id, tasks.file_id, tasks.first_index, tasks.last_index, tasks.attempts FROM tasks "
+                "JOIN files ON files.id = tasks.file_id "
+                "WHERE (tasks.status = 'pending' OR (tasks.status = 'leased' AND tasks.lease_until < ?)) "
+                "AND files.model = ? AND files.pack_tokens IS ? ORDER BY tasks.id LIMIT ?",
+                (now, model, pack_tokens, count),
+            ).fetchall()
+            tasks = []
+            for task_id, file_id, first_index, last_index, attempts in rows:
+                conn.execute(
+                    "UPDATE tasks SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                    (worker, now + self.lease_seconds, task_id),
+                )
+                chunks = conn.execute(
+                    "SELECT idx, text FROM chunks WHERE file_id = ? AND idx BETWEEN ? AND ? AND translation IS NULL ORDER BY idx",
+                    (file_id, first_index, last_index),
+                ).fetchall()
+                tasks.append(Task(task_id, file_id, model, pack_tokens, [index for index, _ in chunks], [text for _, text in chunks], attempts + 1))
+        return tasks
+
+    # Extends the lease of every task the worker still holds
+    def heartbeat(self, worker):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("UPDATE tasks SET lease_until = ? WHERE worker = ? AND status = 'leased'", (now + self.lease_seconds, worker))
+            conn.execute("UPDATE files SET lease_until = ? WHERE worker = ? AND status = 'finalizing'", (now + self.lease_seconds, worker))
+            conn.execute("UPDATE workers SET heartbeat_at = ? WHERE name = ?", (now, worker))
+
+    # Stores a task's translations. Translations are kept even if the lease was lost in the meantime (the first worker
+    # to finish a chunk wins). A task with chunks still missing goes back to the queue, or fails after max_attempts.
+    # A worker whose lease was taken over by another (still live) worker only contributes its translations, the task
+    # itself is left to the worker holding it. Returns True if the task is done.
+    def complete(self, worker, task, translations, models, error=None):
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT status, file_id, first_index, last_index, attempts, worker, lease_until FROM tasks WHERE id = ?", (task.id,)).fetchone()
+            if row is None or row[0] in ("done", "failed"):
+                return row is not None and row[0] == "done"
+            status, file_id, first_index, last_index, attempts, holder, lease_until = row
+            conn.executemany(
+                "UPDATE chunks SET translation = ?, model = ? WHERE file_id = ? AND idx = ? AND translation IS NULL",
+                [(translation, model, file_id, index) for index, translation, model in zip(task.indices, translations, models) if translation is not None],
+            )
+            if status == "leased" and holder != worker and lease_until >= now:
+                return False
+            missing = conn.execute(
+                "SELECT COUNT(*) FROM chunks WHERE file_id = ? AND idx BETWEEN ? AND ? AND translation IS NULL", (file_id, first_index, last_index)
+            ).fetchone()[0]
+            if missing == 0:
+                conn.execute("UPDATE tasks SET status = 'done', worker = ?, lease_until = NULL, finished_at = ? WHERE id = ?", (worker, now, task.id))
+                conn.execute(
+                    "UPDATE workers SET tasks_done = tasks_done + 1, chunks_done = chunks_done + ? WHERE name = ?",
+                    (last_index - first_index + 1, worker),
+                )
+                return True
+            status = "failed" if attempts >= self.max_attempts else "pending"
+            conn.execute(
+                "UPDATE tasks SET status = ?, worker = NULL, lease_until = NULL, last_error = ? WHERE id = ?",
+                (status, error or f"{missing} chunks came back without a translation", task.id),
+            )
+            return False
+
+    # Hands a worker's unfinished tasks and finalizations back to the queue (on shutdown), without using up an attempt.
+    # The worker's heartbeat is cleared, so status() reports it as stopped rather than active until its lease runs out.
+    def release(self, worker):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = 'pending', worker = NULL, lease_until = NULL, attempts = MAX(attempts - 1, 0) "
+                "WHERE worker = ? AND status = 'leased'",
+                (worker,),
+            )
+            conn.execute("UPDATE files SET status = 'queued', worker = NULL, lease_until = NULL WHERE worker = ? AND status = 'finalizing'", (worker,))
+            conn.execute("UPDATE workers SET heartbeat_at = NULL WHERE name = ?", (worker,))
+
+    # Leases a file whose tasks have all ended (done or failed) for finalizing, or returns None
+    def claim_file(self, worker):
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id FROM files WHERE (status = 'queued' OR (status = 'finalizing' AND lease_until < ?)) "
+                "AND NOT EXISTS (SELECT 1 FROM tasks WHERE tasks.file_id = files.id AND tasks.status NOT IN ('done', 'failed')) "
+                "ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE files SET status = 'finalizing', worker = ?, lease_until = ? WHERE id = ?", (worker, now + self.lease_seconds, row[0]))
+        return row[0]
+
+    # Writes a file's output from the stored translations (chunks that failed are marked missing, like any other run)
+    # and marks it done, or failed if any chunk is missing. Returns the number of failed chunks.
+    def finalize(self, worker, file_id):
+        conn = self._connection()
+        source, output_dir, output_name, model, jsonl = conn.execute(
+            "SELECT source, output_dir, output_name, model, jsonl FROM files WHERE id = ?", (file_id,)
+        ).fetchone()
+        rows = conn.execute(
+            "SELECT text, line_start, line_end, translation, model FROM chunks WHERE file_id = ? ORDER BY idx", (file_id,)
+        ).fetchall()
+        chunks = [QueuedChunk(text, line_start, line_end) for text, line_start, line_end, _, _ in rows]
+        translations = [translation for _, _, _, translation, _ in rows]
+        models = [chunk_model or model for _, _, _, _, chunk_model in rows]
+        os.makedirs(output_dir, exist_ok=True)
+        failed = translate_file.finish_output(source, output_dir, model, output_name, chunks, translations, None, bool(jsonl), models)
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE files SET status = ?, worker = NULL, lease_until = NULL, failed_chunks = ?, finished_at = ? WHERE id = ? AND worker = ?",
+                ("failed" if failed else "done", failed, time.time(), file_id, worker),
+            )
+        return failed
+
+    # A file whose output couldn't be written, retry_failed() doesn't reopen it (rerun finalize once the cause is fixed)
+    def fail_file(self, worker, file_id):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE files SET status = 'failed', worker = NULL, lease_until = NULL, finished_at = ? WHERE id = ? AND worker = ?",
+                (time.time(), file_id, worker),
+            )
+
+    # Puts failed tasks back in the queue with fresh attempts and reopens their files
+    def retry_failed(self):
+        with self._transaction() as conn:
+            retried = conn.execute("UPDATE tasks SET status = 'pending', attempts = 0, last_error = NULL WHERE status = 'failed'").rowcount
+            conn.execute(
+                "UPDATE files SET status = 'queued', failed_chunks = NULL, finished_at = NULL WHERE status = 'failed' "
+                "AND EXISTS (SELECT 1 FROM tasks WHERE tasks.file_id = files.id AND tasks.status = 'pending')"
+            )
+        return retried
+
+    # True once no task can be claimed or is still being worked on and no file is waiting to be finalized
+    def drained(self):
+        conn = self._connection()
+        tasks = conn.execute("SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased')").fetchone()[0]
+        files = conn.execute("SELECT COUNT(*) FROM files WHERE status IN ('queued', 'finalizing')").fetchone()[0]
+        return tasks == 0 and files == 0
+
+    # Progress, throughput over the last THROUGHPUT_WINDOW seconds and the workers seen, see describe_status
+    def status(self, window=THROUGHPUT_WINDOW):
+        now = time.time()
+        conn = self._connection()
+        files = dict(conn.execute("SELECT status, COUNT(*) FROM files GROUP BY status").fetchall())
+        tasks = dict(conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+        total_chunks, translated = conn.execute("SELECT COUNT(*), COUNT(translation) FROM chunks").fetchone()
+        recent = conn.execute(
+            "SELECT COALESCE(SUM(last_index - first_index + 1), 0), MIN(finished_at) FROM tasks WHERE finished_at >= ?", (now - window,)
+        ).fetchone()
+        retries = conn.execute("SELECT COALESCE(SUM(attempts - 1), 0) FROM tasks WHERE attempts > 1").fetchone()[0]
+        workers = conn.execute(
+            "SELECT name, heartbeat_at, tasks_done, chunks_done, "
+            "(SELECT COUNT(*) FROM tasks WHERE tasks.worker = workers.name AND tasks.status = 'leased') FROM workers ORDER BY name"
+        ).fetchall()
+
+        recent_chunks, oldest = recent
+        elapsed = min(window, now - oldest) if oldest is not None else 0
+        rate = recent_chunks / elapsed * 60 if elapsed > 0 else 0.0 # chunks per minute
+        remaining = total_chunks - translated
+        return {
+            "files": files,
+            "tasks": tasks,
+            "chunks": total_chunks,
+            "translated": translated,
+            "remaining": remaining,
+            "retries": retries,
+            "chunks_per_minute": rate,
+            "eta_seconds": remaining / rate * 60 if rate > 0 and remaining else None,
+            "workers": [
+                {
+                    "name": name, "alive": heartbeat_at is not None and now - heartbeat_at < self.lease_seconds, "stopped": heartbeat_at is None,
+                    "tasks_done": tasks_done, "chunks_done": chunks_done, "leased": leased,
+                }
+                for name, heartbeat_at, tasks_done, chunks_done, leased in workers
+            ],
+        }
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+def describe_status(status):
+    files = status["files"]
+    tasks = status["tasks"]
+    lines = [
+        f"Files: {sum(files.values())} in total, {files.get('done', 0)} done, {files.get('failed', 0)} failed, "
+        f"{files.get('queued', 0) + files.get('finalizing', 0)} in progress",
+        f"Chunks: {status['translated']} of {status['chunks']} translated ({status['translated'] / max(status['chunks'], 1):.1%}), {status['remaining']} remaining",
+        f"Tasks: {tasks.get('pending', 0)} pending, {tasks.get('leased', 0)} leased, {tasks.get('done', 0)} done, "
+        f"{tasks.get('failed', 0)} failed ({status['retries']} retries)",
+    ]
+    throughput = f"Throughput: {status['chunks_per_minute']:.1f} chunks/min over the last {THROUGHPUT_WINDOW // 60} minutes"
+    if status["eta_seconds"] is not None:
+        throughput += f", about {status['eta_seconds'] / 60:.0f} minutes left"
+    lines.append(throughput)
+    alive = sum(1 for worker in status["workers"] if worker["alive"])
+    stopped = sum(1 for worker in status["workers"] if worker["stopped"])
+    # gone: no heartbeat within a lease and never released, i.e. killed or cut off
+    lines.append(f"Workers: {alive} active, {stopped} stopped, {len(status['workers']) - alive - stopped} gone")
+    for worker in status["workers"]:
+        if worker["alive"]:
+            state = f", {worker['leased']} leased"
+        else:
+            state = " (stopped)" if worker["stopped"] else " (no heartbeat)"
+        lines.append(f"\t{worker['name']}: {worker['chunks_done']} chunks in {worker['tasks_done']} tasks{state}")
+    return "\n".join(lines)
+
+# Keeps the worker's leases alive while it translates
+class Heartbeat:
+    def __init__(self, queue, worker):
+        self.queue = queue
+        self.worker = worker
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.queue.lease_seconds / 3):
+            try:
+                self.queue.heartbeat(self.worker)
+            except sqlite3.Error as e:
+                print(f"\nHeartbeat failed for {self.worker}: {e}")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stopped.set()
+        self.thread.join()
+
+# Translates claimed tasks for one model until none are left, keeping max_workers * 2 tasks claimed at a time
+def translate_tasks(queue, worker, aimodel, pack_tokens, max_workers, stats):
+    chunk_texts = {} # task id -> texts, for telemetry
+
+    def record_attempt(task_id, positions, record, model, translations, error):
+        texts = chunk_texts.get(task_id, [])
+        if error is not None:
+            print(f"\nError translating task {task_id} with {model}: {error}")
+        stats.record_request(record, [(position, texts[position]) for position in positions if position < len(texts)], translations, translate_file.provider_name(model), model)
+
+    active = {}
+    with hedging.HedgedRequests(max_workers, translate_file.translate_group, aimodel, pack_tokens, translate_file.config.hedging, record_attempt) as requests:
+
+        def top_up():
+            for task in queue.claim(worker, max_workers * 2 - len(requests), aimodel, pack_tokens):
+                if not task.texts: # every chunk was translated by an earlier attempt
+                    queue.complete(worker, task, [], [])
+                    continue
+                active[task.id] = task
+                chunk_texts[task.id] = task.texts
+                requests.submit(task.id, task.texts)
+
+        top_up()
+        while requests:
+            for task_id, translations, models, _ in requests.wait():
+                task = active.pop(task_id)
+                chunk_texts.pop(task_id, None)
+                queue.complete(worker, task, translations, [model or aimodel for model in models])
+            top_up()
+
+# Finalizes every file that is ready, returns how many
+def finalize_ready(queue, worker):
+    finalized = 0
+    while True:
+        file_id = queue.claim_file(worker)
+        if file_id is None:
+            return finalized
+        try:
+            queue.finalize(worker, file_id)
+        except Exception as e:
+            print(f"\nError finalizing file {file_id}: {e}")
+            queue.fail_file(worker, file_id)
+            continue
+        finalized += 1
+
+# Runs one worker: claims tasks for whichever model is next in the queue, translates them, finalizes finished files.
+# exit_when_drained=False keeps polling (every poll_interval seconds) for new work instead of exiting once the queue is empty.
+# While other workers still hold leases the worker waits, in case their leases run out and the tasks come back.
+def run_worker(queue, name=None, api_key=None, max_workers=None, cache_path=None, exit_when_drained=True, poll_interval=10):
+    worker = name or f"{socket.gethostname()}-{os.getpid()}"
+    queue.register(worker)
+    if cache_path is not None:
+        translate_file.enable_cache(cache_path)
+    stats = telemetry.Telemetry(parent=translate_file.config.telemetry, source=queue.path)
+    print(f"Worker {worker} started on {queue.path}")
+    try:
+        with Heartbeat(queue, worker):
+            while True:
+                work = queue.next_work()
+                if work is not None:
+                    aimodel, pack_tokens = work
+                    translate_file.initialize_clients(aimodel, api_key)
+                    if translate_file.provider_name(aimodel) not in translate_file.config.clients:
+                        print(translate_file.client_error(translate_file.provider_name(aimodel)))
+                        break
+                    workers = max_workers or translate_file.MAX_IN_FLIGHT.get(translate_file.provider_name(aimodel), 1)
+                    translate_tasks(queue, worker, aimodel, pack_tokens, workers, stats)
+                if finalize_ready(queue, worker) or work is not None:
+                    continue
+                if exit_when_drained and queue.drained():
+                    break
+                time.sleep(poll_interval)
+    finally:
+        queue.release(worker)
+    print(telemetry.describe(stats.summary()))
+    if translate_file.config.telemetry is not None:
+        translate_file.config.telemetry.write_metrics()
+    return stats.summary()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Durable translation job queue for any number of workers.")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_PATH, help="queue database")
+    parser.add_argument("--shared-storage", action="store_true", help="the database is on a network filesystem shared by several hosts")
+    parser.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS)
+    parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="queue every .txt file of a directory")
+    add.add_argument("directory")
+    add.add_argument("output_dir")
+    add.add_argument("--model", required=True)
+    add.add_argument("--pack-tokens", type=int)
+    add.add_argument("--jsonl", action="store_true")
+    add.add_argument("--content-defined", action="store_true")
+    add.add_argument("--hard-split", action="store_true", help="also split overlong lines without sentence endings")
+
+    work = commands.add_parser("work", help="claim and translate tasks until the queue is empty")
+    work.add_argument("--name", help="worker name (default host-pid)")
+    work.add_argument("--api-key")
+    work.add_argument("--max-workers", type=int)
+    work.add_argument("--cache", help="translation cache database shared by the workers")
+    work.add_argument("--events", help="append telemetry events to this JSONL file")
+    work.add_argument("--keep-polling", action="store_true", help="wait for new work instead of exiting when the queue is empty")
+
+    status = commands.add_parser("status", help="report progress, throughput and workers")
+    status.add_argument("--json", action="store_true")
+    status.add_argument("--watch", type=float, help="repeat every this many seconds")
+
+    commands.add_parser("finalize", help="write the outputs of every file whose tasks have all ended")
+    commands.add_parser("retry-failed", help="put failed tasks back in the queue")
+
+    arguments = parser.parse_args()
+    queue = JobQueue(arguments.queue, arguments.lease_seconds, arguments.max_attempts, arguments.shared_storage)
+    if arguments.command == "add":
+        files, chunks = queue.add_directory(arguments.directory, arguments.output_dir, arguments.model, arguments.pack_tokens, arguments.jsonl, arguments.content_defined, arguments.hard_split)
+        print(f"Queued {chunks} chunks from {files} files")
+    elif arguments.command == "work":
+        if arguments.events:
+            translate_file.enable_telemetry(arguments.events)
+        run_worker(queue, arguments.name, arguments.api_key, arguments.max_workers, arguments.cache, exit_when_drained=not arguments.keep_polling)
+    elif arguments.command == "status":
+        while True:
+            current = queue.status()
+            print(json.dumps(current, indent=2) if arguments.json else describe_status(current))
+            if not arguments.watch:
+                break
+            time.sleep(arguments.watch)
+            print()
+    elif arguments.command == "finalize":
+        worker = f"{socket.gethostname()}-{os.getpid()}"
+        print(f"Finalized {finalize_ready(queue, worker)} files")
+    elif arguments.command == "retry-failed":
+        print(f"{queue.retry_failed()} failed tasks queued again")
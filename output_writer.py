@@ -0,0 +1,152 @@
+# This file writes the translated output incrementally instead of all at once at the end of a run.
+# Results come back out of order from the worker threads, so they wait in a small reorder buffer until every
+# earlier chunk is in, then the English and Chinese sections are appended to two spool files (anonymous temp files)
+# and the character totals updated. finish() assembles <name>.txt from the spools with the same layout as before
+# and swaps it in with os.replace, so a crash never leaves a half-written output behind.
+# A chunk without a translation (None) gets MISSING_TRANSLATION in the English section instead of crashing the write.
+# Each chunk can name the model that translated it (failovers and hedges, see hedging.py). If that's not aimodel for
+# every chunk, the header lists each model with its chunk count, so it never claims a model that didn't do the work.
+# With jsonl=True an aligned <name>.jsonl is written as well, one record per chunk:
+#     {"marker": 1, "source": "...", "translation": "...", "model": "...", "line_start": 0, "line_end": 3}
+# so downstream tools can load huge translations without parsing the text format.
+
+import json
+import os
+import shutil
+import tempfile
+from collections import Counter
+
+MISSING_TRANSLATION = "[translation missing]"
+
+class OutputWriter:
+    def __init__(self, directory_path, output_filepath_name, aimodel, jsonl=False):
+        self.directory_path = directory_path
+        self.output_filepath_name = output_filepath_name
+        self.aimodel = aimodel
+        self.english = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+        self.chinese = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+        self.jsonl = None
+        if jsonl:
+            self.jsonl = open(self.temporary_path("jsonl"), "w", encoding="utf-8")
+        self.pending = {} # index -> (chunk, translation) that arrived before an earlier chunk
+        self.next_index = 0
+        self.english_length = 0
+        self.chinese_length = 0
+        self.missing = 0
+        self.models = Counter() # model -> chunks it translated
+
+    # Adds one chunk's result, in any order. Everything up to the first gap is written straight away.
+    # model: the model that produced the translation, aimodel if not given
+    def add(self, index, chunk, translation, model=None):
+        self.pending[index] = (chunk, translation, model or self.aimodel)
+        while self.next_index in self.pending:
+            self._write(*self.pending.pop(self.next_index))
+            self.next_index += 1
+
+    def _write(self, chunk, translation, model):
+        marker = self.next_index + 1
+        chinese_text = str(chunk)
+        if translation is None:
+            self.missing += 1
+            english_text = MISSING_TRANSLATION
+            model = None
+        else:
+            english_text = translation
+            self.english_length += len(translation)
+            self.models[model] += 1
+        self.chinese_length += len(chinese_text)
+        self.english.write(english_text + '[' + str(marker) + "p]" + '\n')
+        self.chinese.write(chinese_text + '[' + str(marker) + "p]" + '\n')
+        if self.jsonl is not None:
+            record = {"marker": marker, "source": chinese_text, "translation": translation, "model": model}
+            if hasattr(chunk, "line_start"):
+                record["line_start"] = chunk.line_start
+                record["line_end"] = chunk.line_end
+            self.jsonl.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    # Where <name>.<extension> is assembled before the swap. Opened with open() rather than tempfile so it gets the
+    # usual umask permissions (tempfile creates 0600 files, other users of a shared output directory couldn't read them).
+    def temporary_path(self, extension):
+        return os.path.join(self.directory_path, f".{self.output_filepath_name}.{os.getpid()}.{extension}.tmp")
+
+    @property
+    def count(self):
+        return self.next_index
+
+    # Assembles and atomically replaces <name>.txt (and <name>.jsonl). Returns the txt path, or None if there
+    # was nothing to write. stats: optional telemetry summary for the Summary Statistics.
+    def finish(self, stats=None):
+        if self.pending:
+            raise ValueError(f"Chunk {self.next_index + 1} never arrived, can't finish {self.output_filepath_name}")
+        if not self.count:
+            print("Your file is probably empty or something! Figure this out")
+            self.close()
+            return None
+
+        write_path = os.path.join(self.directory_path, f"{self.output_filepath_name}.txt")
+        temporary = self.temporary_path("txt")
+        with open(temporary, "w", encoding="utf-8") as file:
+            file.write(self.header())
+
+            # english section
+            self.english.seek(0)
+            shutil.copyfileobj(self.english, file)
+
+            # intermediate section
+            file.write("\n\nBelow is the original Chinese:\n\n\n")
+
+            # chinese section
+            self.chinese.seek(0)
+            shutil.copyfileobj(self.chinese, file)
+
+            file.write(self.summary(stats))
+        os.replace(temporary, write_path)
+
+        if self.jsonl is not None:
+            self.jsonl.close()
+            os.replace(self.jsonl.name, os.path.join(self.directory_path, f"{self.output_filepath_name}.jsonl"))
+            self.jsonl = None
+        self.close()
+        return write_path
+
+    # Names the model that made the translations, or every model with its share when there was more than one
+    def header(self):
+        if set(self.models) <= {self.aimodel}:
+            return f"Translation created with model: {self.aimodel} \n\n"
+        if len(self.models) == 1:
+            return f"Translation created with model: {next(iter(self.models))} \n\n"
+        ordered = sorted(self.models.items(), key=lambda item: (item[0] != self.aimodel, -item[1]))
+        return "Translation created with models: " + ", ".join(f"{model} ({count} chunks)" for model, count in ordered) + " \n\n"
+
+    def summary(self, stats=None):
+        lines = ["\n\n\n\nSummary Statistics\n"]
+        lines.append("\t\nTotal English characters: " + str(self.english_length))
+        lines.append("\t\nTotal Chinese characters: " + str(self.chinese_length))
+        lines.append("\t\nAverage English chunk length: " + str(round(self.english_length / self.count, 2)))
+        lines.append("\t\nAverage Chinese chunk length: " + str(round(self.chinese_length / self.count, 2)))
+        lines.append("\t\nTotal: " + str(self.chinese_length + self.english_length))
+        if self.missing:
+            lines.append("\t\nMissing translations: " + str(self.missing))
+        if stats and stats["p50_latency"] is not None:
+            lines.append("\t\np50 request latency (s): " + str(round(stats["p50_latency"], 3)))
+            lines.append("\t\np95 request latency (s): " + str(round(stats["p95_latency"], 3)))
+            lines.append("\t\nTotal tokens: " + str(stats["total_tokens"]) + " (" + str(stats["input_tokens"]) + " input, " + str(stats["output_tokens"]) + " output)")
+            if stats["cost"] is not None:
+                lines.append("\t\nEstimated cost (USD): " + str(round(stats["cost"], 4)))
+        return "".join(lines)
+
+    # Drops the spools (and the unfinished jsonl) without writing anything
+    def close(self):
+        self.english.close()
+        self.chinese.close()
+        if self.jsonl is not None:
+            self.jsonl.close()
+            if os.path.exists(self.jsonl.name):
+                os.remove(self.jsonl.name)
+            self.jsonl = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
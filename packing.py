@@ -0,0 +1,79 @@
+# This file handles packed requests: several consecutive chunks translated in one API call.
+# Each chunk is only a few hundred characters, so on its own the system prompt, connection setup and
+# time to first token dominate every request. Packing sends a group of chunks with numbered markers:
+#     <<<1>>>
+#     first chunk
+#     <<<2>>>
+#     second chunk
+# and the response is split back on the same markers. If the model merges, drops or reorders a segment the
+# group is retranslated one chunk at a time, so a bad packed response never misaligns the [Np] markers.
+
+import re
+
+from translationmodels.governor import estimate_tokens
+
+PACKED_SYSTEM_PROMPT = (
+    "Translate each numbered Classical Chinese segment below to English with a focus on accuracy. "
+    "Every segment starts with a marker such as <<<1>>>. Output every marker exactly as given, in the same order, "
+    "each followed by the English translation of that segment only. Do not merge, split or skip segments, "
+    "and output nothing besides the markers and translations.\n\n"
+)
+
+DEFAULT_TOKEN_BUDGET = 1500 # estimated input tokens of source text per packed request
+MAX_SEGMENTS = 12
+# English output runs longer than the Classical Chinese input, leave room for it plus the markers
+OUTPUT_TOKENS_PER_INPUT_TOKEN = 2.5
+
+MARKER = re.compile(r"<<<\s*(\d+)\s*>>>")
+
+def build_prompt(texts):
+    return "\n".join(f"<<<{number}>>>\n{text}" for number, text in enumerate(texts, start=1))
+
+def output_budget(texts):
+    return int(sum(estimate_tokens(text) for text in texts) * OUTPUT_TOKENS_PER_INPUT_TOKEN) + 16 * len(texts)
+
+# Splits a packed response back into one translation per segment.
+# Returns None unless it has exactly the markers 1..count, in order, each with a non-empty translation.
+def parse_response(response, count):
+    if not response:
+        return None
+    parts = MARKER.split(response)
+    # parts = [text before the first marker, "1", translation, "2", translation, ...]
+    numbers = [int(number) for number in parts[1::2]]
+    translations = [translation.strip() for translation in parts[2::2]]
+    if numbers != list(range(1, count + 1)):
+        return None
+    if any(not translation for translation in translations):
+        return None
+    return translations
+
+# Groups consecutive (index, chunk) pairs so each group stays within token_budget and max_segments.
+# A chunk larger than the budget on its own still gets a group of its own.
+def pack_chunks(indexed_chunks, token_budget=DEFAULT_TOKEN_BUDGET, max_segments=MAX_SEGMENTS):
+    group = []
+    group_tokens = 0
+    for index, chunk in indexed_chunks:
+        tokens = estimate_tokens(str(chunk))
+        if group and (group_tokens + tokens > token_budget or len(group) >= max_segments):
+            yield group
+            group, group_tokens = [], 0
+        group.append((index, chunk))
+        group_tokens += tokens
+    if group:
+        yield group
+
+# Translates a group of texts with a single packed request, falling back to one request per text if the
+# response can't be split back into exactly len(texts) translations.
+# translate: the translate(text, aimodel, system_prompt=..., max_tokens=...) function to send requests with.
+# Returns (translations, fell_back).
+def translate_packed(texts, aimodel, translate):
+    if len(texts) == 1:
+        return [translate(texts[0], aimodel)], False
+
+    response = translate(build_prompt(texts), aimodel, system_prompt=PACKED_SYSTEM_PROMPT, max_tokens=output_budget(texts))
+    translations = parse_response(response, len(texts))
+    if translations is not None:
+        return translations, False
+
+    print(f"\nPacked response for {len(texts)} chunks didn't match, translating them one at a time")
+    return [translate(text, aimodel) for text in texts], True
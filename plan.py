@@ -0,0 +1,275 @@
+# This file is the dry-run planner: it estimates what translating a collection will take before anything is sent.
+# Every file is chunked exactly as a real run would chunk it (and packed, with pack_tokens) in a process pool, and each
+# request's tokens are counted:
+#   - with the provider's tokenizer where one is available offline (tiktoken for OpenAI models, if installed)
+#   - otherwise with governor.estimate_tokens' rule, CJK characters times a tokens-per-character ratio
+# The totals are then priced with pricing.py and checked against governor.PROVIDER_LIMITS and the concurrency, giving
+# the request count, tokens, cost and the minimum wall time (the slowest of: the requests-per-minute limit, the
+# tokens-per-minute limit, and the requests' own latency spread over the requests in flight).
+# Output length and latency can't be counted up front. By default output is projected at packing's
+# OUTPUT_TOKENS_PER_INPUT_TOKEN (the budget a packed request is given, so the cost is an upper bound) and latency at
+# REQUEST_SECONDS + SECONDS_PER_OUTPUT_TOKEN per output token. calibrate() replaces both, and the tokens-per-character
+# ratio, with what an earlier run with the same model recorded in its telemetry events (see telemetry.py).
+#
+#     python plan.py COLLECTION --model gpt-4o-mini-2024-07-18 --pack-tokens 1500 --events translation_events.jsonl
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import packing
+import pricing
+import translate_directory
+import translate_file
+from translationmodels import governor, registry
+
+REQUEST_SECONDS = 1.0 # connection setup and time to first token
+SECONDS_PER_OUTPUT_TOKEN = 0.015 # generation speed, about 65 tokens/s
+MIN_CALIBRATION_EVENTS = 20
+MIN_CACHED_PROMPT_TOKENS = 1024 # providers only cache prompts at least this long (see prompts.py)
+DEFAULT_SYSTEM_PROMPT = "Translate the following Classical Chinese text to English with a focus on accuracy:"
+
+# The ratios a plan is projected with, from calibrate() or the defaults
+class Calibration:
+    def __init__(self, tokens_per_character=1.0, output_ratio=packing.OUTPUT_TOKENS_PER_INPUT_TOKEN, seconds_per_output_token=SECONDS_PER_OUTPUT_TOKEN, request_seconds=REQUEST_SECONDS, events=0, source=None):
+        self.tokens_per_character = tokens_per_character # input tokens per CJK character, without a tokenizer
+        self.output_ratio = output_ratio # output tokens per source token
+        self.seconds_per_output_token = seconds_per_output_token
+        self.request_seconds = request_seconds
+        self.events = events
+        self.source = source
+
+    def describe(self):
+        text = f"{self.output_ratio:.2f} output tokens per source token, {self.request_seconds:.1f}s + {self.seconds_per_output_token * 1000:.0f}ms per output token per request"
+        if self.source is None:
+            return text + " (defaults, output is an upper bound)"
+        return text + f" (calibrated from {self.events} events in {self.source})"
+
+# Fits a Calibration to the chunk events of an earlier run (telemetry events JSONL) with the same model.
+# Only translated, uncached, synchronous chunks count. The estimated system prompt tokens (with the current prompt
+# context) are taken off the recorded input to get the tokens of the source text alone.
+# Returns the defaults if there are fewer than MIN_CALIBRATION_EVENTS usable events.
+def calibrate(events_path, aimodel):
+    prompt_tokens, packed_prompt_tokens = (governor.estimate_tokens(prompt) for prompt in system_prompts(aimodel)[:2])
+    characters = source_tokens = output_tokens = requests = latency = 0.0
+    events = 0
+    with open(events_path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get("event") != "chunk" or event.get("model") != aimodel or not event.get("ok"):
+                continue
+            if event.get("cached") or event.get("batch") or not event.get("input_tokens") or event.get("latency") is None:
+                continue
+            packed = event.get("packed") or 1
+            events += 1
+            characters += event["characters"]
+            source_tokens += max(0, event["input_tokens"] - (packed_prompt_tokens if packed > 1 else prompt_tokens) / packed)
+            output_tokens += event["output_tokens"]
+            requests += 1 / packed # every chunk of a packed request carries the request's latency
+            latency += event["latency"] / packed
+    if events < MIN_CALIBRATION_EVENTS or not characters or not source_tokens or not output_tokens:
+        print(f"Not enough events for {aimodel} in {events_path} to calibrate ({events}), using the defaults")
+        return Calibration()
+    return Calibration(
+        tokens_per_character=source_tokens / characters,
+        output_ratio=output_tokens / source_tokens,
+        seconds_per_output_token=max(0.0, latency - requests * REQUEST_SECONDS) / output_tokens,
+        events=events,
+        source=events_path,
+    )
+
+# The system prompts requests to aimodel are sent with (single and packed), prompt context included.
+# The translator class is only loaded for its SYSTEM_PROMPT, no client is created and no key is needed.
+def system_prompts(aimodel):
+    try:
+        system_prompt = registry.get(translate_file.provider_name(aimodel)).load().SYSTEM_PROMPT
+    except Exception:
+        system_prompt = DEFAULT_SYSTEM_PROMPT
+    context = translate_file.config.prompt_context
+    if context is None:
+        return system_prompt, packing.PACKED_SYSTEM_PROMPT, False
+    return context.apply(system_prompt), context.apply(packing.PACKED_SYSTEM_PROMPT), context.cache
+
+_tokenizer = None
+
+# tiktoken's encoding for an OpenAI model, loaded once per pool process. None (estimate instead) for other providers,
+# or if tiktoken isn't installed or can't load its encoding.
+def load_tokenizer(provider, aimodel):
+    global _tokenizer
+    if provider != "openai":
+        return None
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            try:
+                _tokenizer = tiktoken.encoding_for_model(aimodel)
+            except KeyError:
+                _tokenizer = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _tokenizer = False
+    return _tokenizer or None
+
+def count_tokens(text, tokenizer, tokens_per_character):
+    if tokenizer is not None:
+        return len(tokenizer.encode_ordinary(text))
+    cjk = len(governor.CJK_CHARACTERS.findall(text))
+    return round(cjk * tokens_per_character) + (len(text) - cjk + 3) // 4
+
+# Plans one file in a pool process. options: (provider, aimodel, pack_tokens, content_defined, hard_split, tokens_per_character).
+# Returns (filepath, totals, error), totals counting chunks, characters, requests, source tokens (the text alone,
+# as packed) and the largest request's source tokens.
+def plan_file(filepath, options):
+    provider, aimodel, pack_tokens, content_defined, hard_split, tokens_per_character = options
+    tokenizer = load_tokenizer(provider, aimodel)
+    totals = {"chunks": 0, "characters": 0, "requests": 0, "packed_requests": 0, "source_tokens": 0, "largest_request": 0}
+    try:
+        chunks = list(translate_file.chunk_source(filepath, content_defined, hard_split))
+        for group in translate_file.group_chunks(list(enumerate(chunks)), pack_tokens):
+            texts = [str(chunk) for _, chunk in group]
+            text = packing.build_prompt(texts) if len(texts) > 1 else texts[0]
+            tokens = count_tokens(text, tokenizer, tokens_per_character)
+            totals["chunks"] += len(texts)
+            totals["characters"] += sum(len(chunk) for chunk in texts)
+            totals["requests"] += 1
+            totals["packed_requests"] += len(texts) > 1
+            totals["source_tokens"] += tokens
+            totals["largest_request"] = max(totals["largest_request"], tokens)
+    except Exception as e:
+        return filepath, totals, str(e)
+    return filepath, totals, None
+
+# Plans translating the files with aimodel. max_workers: requests in flight (defaults to MAX_IN_FLIGHT, like a run).
+# processes: pool size (default: one per CPU). calibration: a Calibration, e.g. from calibrate().
+# batch: price the run at the batch API discount (see batch.py), the rate limits then don't apply.
+def plan_files(filepaths, aimodel, pack_tokens=None, max_workers=None, content_defined=False, processes=None, calibration=None, batch=False, hard_split=False):
+    provider = translate_file.provider_name(aimodel)
+    calibration = calibration or Calibration()
+    if max_workers is None:
+        max_workers = translate_file.MAX_IN_FLIGHT.get(provider, 1)
+    system_prompt, packed_system_prompt, cache = system_prompts(aimodel)
+    tokenizer = load_tokenizer(provider, aimodel)
+    prompt_tokens = count_tokens(system_prompt, tokenizer, calibration.tokens_per_character)
+    packed_prompt_tokens = count_tokens(packed_system_prompt, tokenizer, calibration.tokens_per_character)
+
+    options = (provider, aimodel, pack_tokens, content_defined, hard_split, calibration.tokens_per_character)
+    totals = {"chunks": 0, "characters": 0, "requests": 0, "packed_requests": 0, "source_tokens": 0, "largest_request": 0}
+    failures = {}
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        # hand files out in batches, so with many small files scheduling doesn't cost more than the chunking
+        chunksize = max(1, len(filepaths) // (processes * 8))
+        for filepath, file_totals, error in pool.map(plan_file, filepaths, repeat(options), chunksize=chunksize):
+            if error is not None:
+                failures[filepath] = error
+            for key, value in file_totals.items():
+                totals[key] = max(totals[key], value) if key == "largest_request" else totals[key] + value
+
+    single_requests = totals["requests"] - totals["packed_requests"]
+    prompt_total = single_requests * prompt_tokens + totals["packed_requests"] * packed_prompt_tokens
+    input_tokens = totals["source_tokens"] + prompt_total
+    output_tokens = round(totals["source_tokens"] * calibration.output_ratio)
+    # with prompt caching, every request after the first reads a long enough prompt from the cache
+    cached_input_tokens = 0
+    if cache and provider in pricing.CACHE_READ_MULTIPLIER:
+        for count, tokens in ((single_requests, prompt_tokens), (totals["packed_requests"], packed_prompt_tokens)):
+            if tokens >= MIN_CACHED_PROMPT_TOKENS and count > 1:
+                cached_input_tokens += (count - 1) * tokens
+    cost = pricing.estimate_cost(aimodel, input_tokens, output_tokens, provider, cached_input_tokens, batch=batch)
+
+    limits = governor.PROVIDER_LIMITS.get(provider, {})
+    bounds = {"concurrency": (totals["requests"] * calibration.request_seconds + output_tokens * calibration.seconds_per_output_token) / max_workers}
+    if not batch:
+        if limits.get("requests_per_minute"):
+            bounds["requests per minute"] = totals["requests"] / limits["requests_per_minute"] * 60
+        if limits.get("tokens_per_minute"):
+            bounds["tokens per minute"] = (input_tokens + output_tokens) / limits["tokens_per_minute"] * 60
+    bound = max(bounds, key=bounds.get)
+    return {
+        "model": aimodel,
+        "provider": provider,
+        "files": len(filepaths),
+        "failed_files": failures,
+        **totals,
+        "input_tokens": input_tokens,
+        "cached_input_tokens": cached_input_tokens,
+        "output_tokens": output_tokens,
+        "cost": cost,
+        "batch": batch,
+        "max_workers": max_workers,
+        "limits": limits,
+        "wall_seconds": bounds[bound],
+        "bound_by": bound,
+        "tokenizer": tokenizer.name if tokenizer is not None else None,
+        "calibration": calibration,
+    }
+
+# Plans every .txt file in directory, see plan_files
+def plan_directory(directory, aimodel, pack_tokens=None, max_workers=None, content_defined=False, processes=None, calibration=None, batch=False, hard_split=False):
+    filepaths = [os.path.join(directory, filename) for filename in translate_directory.list_txt_files(directory)]
+    return plan_files(filepaths, aimodel, pack_tokens, max_workers, content_defined, processes, calibration, batch, hard_split)
+
+def format_duration(seconds):
+    if seconds < 120:
+        return f"{seconds:.0f}s"
+    if seconds < 7200:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+def describe_plan(plan):
+    if plan["tokenizer"] is not None:
+        counted = f"counted with tiktoken {plan['tokenizer']}"
+    else:
+        counted = f"estimated at {plan['calibration'].tokens_per_character:.2f} tokens per CJK character"
+    lines = [
+        f"Plan for {plan['files']} files with {plan['model']} ({plan['provider']}), tokens {counted}",
+        f"\t{plan['chunks']} chunks ({plan['characters']} characters) in {plan['requests']} requests "
+        f"({plan['packed_requests']} packed), the largest with ~{plan['largest_request']} source tokens",
+        f"\t~{plan['input_tokens']} input tokens"
+        + (f" ({plan['cached_input_tokens']} from the prompt cache)" if plan["cached_input_tokens"] else "")
+        + f" + ~{plan['output_tokens']} output tokens",
+    ]
+    if plan["cost"] is None:
+        lines.append(f"\tCost unknown, {plan['model']} has no price in pricing.PRICES")
+    else:
+        lines.append(f"\t~${plan['cost']:.2f}" + (" at the batch discount" if plan["batch"] else ""))
+    if plan["batch"]:
+        lines.append(f"\tBatches finish within 24h, at {plan['max_workers']} requests in flight the same work would take at least {format_duration(plan['wall_seconds'])}")
+    else:
+        limit = f", limited by {plan['bound_by']}" if plan["bound_by"] != "concurrency" else ""
+        lines.append(f"\tAt least {format_duration(plan['wall_seconds'])} with {plan['max_workers']} requests in flight{limit}")
+    lines.append(f"\tProjected with {plan['calibration'].describe()}")
+    if plan["failed_files"]:
+        lines.append(f"\t{len(plan['failed_files'])} files could not be chunked:")
+        lines.extend(f"\t\t{filepath}: {error}" for filepath, error in plan["failed_files"].items())
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate chunks, tokens, cost and wall time of translating a directory.")
+    parser.add_argument("directory")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--pack-tokens", type=int)
+    parser.add_argument("--max-workers", type=int, help="requests in flight (default: the provider's MAX_IN_FLIGHT)")
+    parser.add_argument("--content-defined", action="store_true")
+    parser.add_argument("--hard-split", action="store_true", help="also split overlong lines without sentence endings")
+    parser.add_argument("--processes", type=int, help="planning processes (default: one per CPU)")
+    parser.add_argument("--events", help="telemetry events of an earlier run to calibrate output length and latency with")
+    parser.add_argument("--glossary", help="glossary file added to every prompt (see prompts.py)")
+    parser.add_argument("--batch", action="store_true", help="price the run through the batch API")
+    parser.add_argument("--json", action="store_true")
+    arguments = parser.parse_args()
+
+    if arguments.glossary:
+        translate_file.enable_prompt_context(arguments.glossary)
+    calibration = None
+    if arguments.events:
+        calibration = calibrate(arguments.events, arguments.model)
+    plan = plan_directory(arguments.directory, arguments.model, arguments.pack_tokens, arguments.max_workers, arguments.content_defined, arguments.processes, calibration, arguments.batch, arguments.hard_split)
+    if arguments.json:
+        print(json.dumps({**plan, "calibration": vars(plan["calibration"])}, indent=2))
+    else:
+        print(describe_plan(plan))
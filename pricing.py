@@ -0,0 +1,68 @@
+# Approximate API prices in USD per million tokens, used for cost estimates in telemetry and planning.
+# These are list prices at the time of writing. Check the provider's pricing page before relying on them,
+# and add your own models to PRICES (or set them with set_price).
+# Model names are matched on the longest listed prefix, so dated snapshots such as gpt-4o-mini-2024-07-18 resolve too.
+# Local ollama models cost nothing per token.
+# Input read from a provider's prompt cache and requests sent through a batch API (see batch.py) are billed at a
+# fraction of the list price, Anthropic bills writing to its prompt cache at a premium.
+
+PRICES = {
+    # OpenAI
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "output": 10.00},
+    "gpt-4.1-nano": {"input": 0.10, "output": 0.40},
+    "gpt-4.1-mini": {"input": 0.40, "output": 1.60},
+    "gpt-4.1": {"input": 2.00, "output": 8.00},
+    "gpt-5-nano": {"input": 0.05, "output": 0.40},
+    "gpt-5-mini": {"input": 0.25, "output": 2.00},
+    "gpt-5": {"input": 1.25, "output": 10.00},
+    "o3": {"input": 2.00, "output": 8.00},
+    "o4-mini": {"input": 1.10, "output": 4.40},
+    # Anthropic
+    "claude-3-5-haiku": {"input": 0.80, "output": 4.00},
+    "claude-haiku-4-5": {"input": 1.00, "output": 5.00},
+    "claude-3-5-sonnet": {"input": 3.00, "output": 15.00},
+    "claude-3-7-sonnet": {"input": 3.00, "output": 15.00},
+    "claude-sonnet-4": {"input": 3.00, "output": 15.00},
+    "claude-opus-4": {"input": 15.00, "output": 75.00},
+    # Google
+    "gemini-2.0-flash": {"input": 0.10, "output": 0.40},
+    "gemini-2.5-flash-lite": {"input": 0.10, "output": 0.40},
+    "gemini-2.5-flash": {"input": 0.30, "output": 2.50},
+    "gemini-2.5-pro": {"input": 1.25, "output": 10.00},
+}
+
+LOCAL_PROVIDERS = {"llama", "deepseek"}
+
+# multipliers of the input price
+CACHE_READ_MULTIPLIER = {"openai": 0.5, "anthropic": 0.1, "gemini": 0.25}
+CACHE_WRITE_MULTIPLIER = {"anthropic": 1.25}
+BATCH_DISCOUNT = 0.5 # OpenAI Batch and Anthropic Message Batches are half price
+
+def set_price(model, input_per_million, output_per_million):
+    PRICES[model] = {"input": input_per_million, "output": output_per_million}
+
+# Returns {"input": ..., "output": ...} per million tokens, or None if the model isn't listed
+def model_price(model):
+    model = model.lower()
+    matches = [name for name in PRICES if model.startswith(name)]
+    if not matches:
+        return None
+    return PRICES[max(matches, key=len)]
+
+# Estimated cost in USD, 0 for local models, None if the price is unknown.
+# input_tokens includes cached_input_tokens (read from the prompt cache) and cache_write_tokens.
+def estimate_cost(model, input_tokens, output_tokens, provider=None, cached_input_tokens=0, cache_write_tokens=0, batch=False):
+    if provider in LOCAL_PROVIDERS:
+        return 0.0
+    price = model_price(model)
+    if price is None:
+        return None
+    uncached = input_tokens - cached_input_tokens - cache_write_tokens
+    input_cost = price["input"] * (
+        uncached
+        + cached_input_tokens * CACHE_READ_MULTIPLIER.get(provider, 1.0)
+        + cache_write_tokens * CACHE_WRITE_MULTIPLIER.get(provider, 1.0)
+    )
+    cost = (input_cost + output_tokens * price["output"]) / 1_000_000
+    return cost * BATCH_DISCOUNT if batch else cost
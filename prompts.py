@@ -0,0 +1,57 @@
+# This file handles what goes into the system prompt besides the translator's own instructions: a glossary
+# (term -> rendering) and free-form context (the work, its author, conventions to follow), plus provider prompt caching.
+# They are appended to the instructions of every request, packed ones included. The chunk text always goes in the user
+# message, so every request to a model starts with the same prefix, and with cache=True that prefix is marked for
+# the provider's prompt cache. A long glossary is then billed at the cached input rate after the first request
+# instead of in full on every chunk.
+#   Anthropic: the system block gets cache_control {"type": "ephemeral"} (cached for 5 minutes, refreshed on every hit)
+#   OpenAI: prompts over 1024 tokens are cached automatically, requests carry a prompt_cache_key (a hash of the prefix)
+#     so they are routed to the same cache
+#   Gemini and ollama reuse repeated prefixes on their own, there is nothing to mark
+# Providers only cache prefixes above a minimum length (1024 tokens for most models), shorter prompts are sent as usual.
+
+import hashlib
+import json
+import os
+
+class PromptContext:
+    # glossary: {term: rendering}, or a path to a JSON object or a text file of "term<TAB>rendering" / "term = rendering" lines
+    # context: text added after the glossary
+    # cache: mark the prompt for provider prompt caching
+    def __init__(self, glossary=None, context=None, cache=True):
+        if isinstance(glossary, str):
+            # a mistyped path would otherwise fail every request later on
+            if not os.path.isfile(glossary):
+                raise FileNotFoundError(f"Glossary file not found: {glossary}")
+            glossary = load_glossary(glossary)
+        self.glossary = glossary or {}
+        self.context = context
+        self.cache = cache
+
+    # The instructions followed by the glossary and context sections, always in the same order
+    def apply(self, system_prompt):
+        sections = [system_prompt.rstrip()]
+        if self.glossary:
+            sections.append("Use these renderings for the following terms:\n" + "\n".join(f"{term}: {rendering}" for term, rendering in self.glossary.items()))
+        if self.context:
+            sections.append("Context:\n" + self.context.strip())
+        # the packed prompt expects the text right after it, keep its trailing whitespace
+        return "\n\n".join(sections) + system_prompt[len(system_prompt.rstrip()):]
+
+def load_glossary(path):
+    with open(path, "r", encoding="utf-8") as file:
+        if path.lower().endswith(".json"):
+            return json.load(file)
+        glossary = {}
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            term, separator, rendering = line.partition("\t") if "\t" in line else line.partition("=")
+            if separator:
+                glossary[term.strip()] = rendering.strip()
+        return glossary
+
+# Routing key for OpenAI's prompt cache, the same for every request with the same system prompt
+def cache_key(system_prompt):
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:32]
@@ -0,0 +1,325 @@
+# This file handles per-chunk telemetry: where the time, tokens and money of a run go.
+# Every request is timed from the worker thread that sends it (queue wait, latency), and while it runs the
+# translators add what the provider reports to a thread-local record (tokens, retries, time to first token).
+# When the request finishes, an event is recorded for each chunk it carried:
+#   {"event": "chunk", "source": ..., "index": 3, "provider": "openai", "model": ..., "queue_wait": 0.01,
+#    "latency": 1.92, "ttft": null, "input_tokens": 310, "cached_input_tokens": 0, "output_tokens": 402, "retries": 0,
+#    "cost": 0.0003, ...}
+# input_tokens counts every input token, cached_input_tokens the part read from the provider's prompt cache.
+# Tokens and cost of a packed request are split between its chunks by source length.
+# A Telemetry object keeps the running totals (p50/p95 latency, tokens, cost) and can also append every event to a
+# JSONL log, write OpenMetrics text to a file, and serve the same text over HTTP for Prometheus to scrape.
+# Per-file Telemetry objects pass their events up to a parent, so one run-wide log collects everything.
+
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pricing
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_local = threading.local()
+
+# What a single request reported while it ran
+class RequestRecord:
+    __slots__ = ("queue_wait", "latency", "first_token", "input_tokens", "output_tokens", "retries", "cached", "cached_input_tokens", "cache_write_tokens", "batch")
+
+    def __init__(self):
+        self.queue_wait = None
+        self.latency = None
+        self.first_token = None
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.retries = 0
+        self.cached = False # answered from the local translation cache
+        self.cached_input_tokens = 0 # read from the provider's prompt cache
+        self.cache_write_tokens = 0 # written to it (Anthropic bills these above the input price)
+        self.batch = False # sent through a batch API (see batch.py), billed at the batch discount
+
+# The record of the request running on this thread, or None outside timed_request
+def current():
+    return getattr(_local, "record", None)
+
+def record_usage(input_tokens=None, output_tokens=None):
+    record = current()
+    if record is not None:
+        record.input_tokens += input_tokens or 0
+        record.output_tokens += output_tokens or 0
+
+def record_first_token(seconds):
+    record = current()
+    if record is not None and seconds is not None:
+        record.first_token = seconds if record.first_token is None else min(record.first_token, seconds)
+
+# has the governor's on_retry(attempt, error, delay) signature
+def record_retry(attempt=None, error=None, delay=None):
+    record = current()
+    if record is not None:
+        record.retries += 1
+
+# tokens read from / written to the provider's prompt cache (see prompts.py)
+def record_prompt_cache(read_tokens=None, write_tokens=None):
+    record = current()
+    if record is not None:
+        record.cached_input_tokens += read_tokens or 0
+        record.cache_write_tokens += write_tokens or 0
+
+def record_cache_hit():
+    record = current()
+    if record is not None:
+        record.cached = True
+
+# langchain_ollama responses carry token counts and Ollama's own timings (in nanoseconds). Loading the model plus
+# evaluating the prompt is the time before the first output token.
+def record_ollama_response(response):
+    usage = getattr(response, "usage_metadata", None) or {}
+    record_usage(usage.get("input_tokens"), usage.get("output_tokens"))
+    metadata = getattr(response, "response_metadata", None) or {}
+    if metadata.get("prompt_eval_duration") is not None:
+        record_first_token(((metadata.get("load_duration") or 0) + metadata["prompt_eval_duration"]) / 1e9)
+
+# Runs function(*args) on a worker thread with a fresh RequestRecord, returns (result, record).
+# submitted: time.monotonic() when the request was queued, the difference is its queue wait.
+def timed_request(function, submitted, *args):
+    record = RequestRecord()
+    start = time.monotonic()
+    record.queue_wait = start - submitted
+    _local.record = record
+    try:
+        result = function(*args)
+    finally:
+        record.latency = time.monotonic() - start
+        _local.record = None
+    return result, record
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+def split_evenly(total, weights):
+    whole = sum(weights)
+    if not whole:
+        return [total / len(weights)] * len(weights)
+    return [total * weight / whole for weight in weights]
+
+# Metric totals for one (provider, model) pair
+class ModelTotals:
+    def __init__(self):
+        self.requests = 0
+        self.chunks = 0
+        self.failed = 0
+        self.cache_hits = 0
+        self.input_tokens = 0
+        self.cached_input_tokens = 0
+        self.output_tokens = 0
+        self.retries = 0
+        self.cost = 0.0
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+
+class Telemetry:
+    # events_path: append every chunk event to this JSONL file
+    # metrics_path: OpenMetrics text file, rewritten by write_metrics()
+    # parent: another Telemetry that receives the same events (e.g. the run-wide one from translate_file.enable_telemetry)
+    # source: file name written into each event
+    def __init__(self, events_path=None, metrics_path=None, parent=None, source=None):
+        self.events_path = events_path
+        self.metrics_path = metrics_path
+        self.parent = parent
+        self.source = source
+        self.latencies = []
+        self.totals = {} # (provider, model) -> ModelTotals
+        self.unknown_cost = False
+        self.server = None
+        self._lock = threading.Lock()
+        self._events = open(events_path, "a", encoding="utf-8") if events_path else None
+
+    # Records a finished (or failed) request and one event per chunk it carried.
+    # record: the RequestRecord from timed_request, or None if the request raised before returning one
+    # chunks: [(index, chunk)] sent in the request, translations: the matching results (None for failures)
+    def record_request(self, record, chunks, translations, provider, model):
+        record = record or RequestRecord()
+        lengths = [len(chunk) for _, chunk in chunks]
+        # nothing reported means nothing billed (cache hits, failures before a response)
+        if record.input_tokens == record.output_tokens == 0:
+            cost = 0.0
+        else:
+            cost = pricing.estimate_cost(
+                model, record.input_tokens, record.output_tokens, provider, record.cached_input_tokens, record.cache_write_tokens, record.batch
+            )
+        input_shares = split_evenly(record.input_tokens, lengths)
+        cached_shares = split_evenly(record.cached_input_tokens, lengths)
+        output_shares = split_evenly(record.output_tokens, lengths)
+        cost_shares = split_evenly(cost, lengths) if cost is not None else [None] * len(chunks)
+
+        events = []
+        for (index, _), translation, length, input_tokens, cached_input_tokens, output_tokens, chunk_cost in zip(
+            chunks, translations, lengths, input_shares, cached_shares, output_shares, cost_shares
+        ):
+            events.append({
+                "event": "chunk",
+                "time": round(time.time(), 3),
+                "source": self.source,
+                "index": index,
+                "provider": provider,
+                "model": model,
+                "characters": length,
+                "packed": len(chunks),
+                "queue_wait": round(record.queue_wait, 4) if record.queue_wait is not None else None,
+                "latency": round(record.latency, 4) if record.latency is not None else None,
+                "ttft": round(record.first_token, 4) if record.first_token is not None else None,
+                "input_tokens": round(input_tokens),
+                "cached_input_tokens": round(cached_input_tokens),
+                "output_tokens": round(output_tokens),
+                "retries": record.retries,
+                "cached": record.cached,
+                "batch": record.batch,
+                "cost": round(chunk_cost, 8) if chunk_cost is not None else None,
+                "ok": translation is not None,
+            })
+        self.add(record, events, cost, provider, model)
+
+    def add(self, record, events, cost, provider, model):
+        with self._lock:
+            totals = self.totals.setdefault((provider, model), ModelTotals())
+            totals.requests += 1
+            totals.chunks += len(events)
+            totals.failed += sum(1 for event in events if not event["ok"])
+            totals.cache_hits += record.cached
+            totals.input_tokens += record.input_tokens
+            totals.cached_input_tokens += record.cached_input_tokens
+            totals.output_tokens += record.output_tokens
+            totals.retries += record.retries
+            if cost is None:
+                self.unknown_cost = True
+            else:
+                totals.cost += cost
+            if record.latency is not None:
+                self.latencies.append(record.latency)
+                totals.latency_sum += record.latency
+                totals.latency_count += 1
+                for number, bound in enumerate(LATENCY_BUCKETS):
+                    if record.latency <= bound:
+                        totals.latency_buckets[number] += 1
+            if self._events is not None:
+                for event in events:
+                    self._events.write(json.dumps(event, ensure_ascii=False) + "\n")
+                self._events.flush()
+        if self.parent is not None:
+            self.parent.add(record, events, cost, provider, model)
+
+    def summary(self):
+        with self._lock:
+            totals = list(self.totals.values())
+            latencies = list(self.latencies)
+        input_tokens = sum(t.input_tokens for t in totals)
+        output_tokens = sum(t.output_tokens for t in totals)
+        return {
+            "requests": sum(t.requests for t in totals),
+            "chunks": sum(t.chunks for t in totals),
+            "failed": sum(t.failed for t in totals),
+            "cache_hits": sum(t.cache_hits for t in totals),
+            "p50_latency": percentile(latencies, 0.50),
+            "p95_latency": percentile(latencies, 0.95),
+            "input_tokens": input_tokens,
+            "cached_input_tokens": sum(t.cached_input_tokens for t in totals),
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "retries": sum(t.retries for t in totals),
+            "cost": None if self.unknown_cost else round(sum(t.cost for t in totals), 6),
+        }
+
+    # Prometheus text exposition / OpenMetrics format
+    def metrics_text(self):
+        lines = []
+        with self._lock:
+            items = sorted(self.totals.items())
+
+            def counter(name, help_text, value_of):
+                lines.append(f"# TYPE {name} counter")
+                lines.append(f"# HELP {name} {help_text}")
+                for (provider, model), totals in items:
+                    lines.append(f'{name}_total{{provider="{provider}",model="{model}"}} {value_of(totals)}')
+
+            counter("translation_requests", "Translation requests sent.", lambda t: t.requests)
+            counter("translation_chunks", "Chunks translated, including failures.", lambda t: t.chunks)
+            counter("translation_chunks_failed", "Chunks that came back without a translation.", lambda t: t.failed)
+            counter("translation_cache_hits", "Requests answered from the translation cache.", lambda t: t.cache_hits)
+            counter("translation_input_tokens", "Input tokens reported by the provider.", lambda t: t.input_tokens)
+            counter("translation_cached_input_tokens", "Input tokens read from the provider's prompt cache.", lambda t: t.cached_input_tokens)
+            counter("translation_output_tokens", "Output tokens reported by the provider.", lambda t: t.output_tokens)
+            counter("translation_retries", "Retried requests.", lambda t: t.retries)
+            counter("translation_cost_usd", "Estimated cost in US dollars.", lambda t: round(t.cost, 8))
+
+            name = "translation_request_latency_seconds"
+            lines.append(f"# TYPE {name} histogram")
+            lines.append(f"# HELP {name} Request latency.")
+            for (provider, model), totals in items:
+                labels = f'provider="{provider}",model="{model}"'
+                for bound, count in zip(LATENCY_BUCKETS, totals.latency_buckets):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {totals.latency_count}')
+                lines.append(f"{name}_sum{{{labels}}} {round(totals.latency_sum, 6)}")
+                lines.append(f"{name}_count{{{labels}}} {totals.latency_count}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    # Rewrites the metrics file (atomically, so a scraper never reads half a file)
+    def write_metrics(self, path=None):
+        path = path or self.metrics_path
+        if not path:
+            return
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            file.write(self.metrics_text())
+        os.replace(temporary, path)
+
+    # Serves the metrics at http://host:port/metrics from a background thread
+    def serve_metrics(self, port, host="127.0.0.1"):
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = telemetry.metrics_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+    def close(self):
+        self.write_metrics()
+        with self._lock:
+            if self._events is not None and not self._events.closed:
+                self._events.close()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server = None
+
+# One-line summary printed after a file or run
+def describe(summary):
+    if not summary["requests"]:
+        return "No requests completed"
+    text = f"{summary['requests']} requests, "
+    # batch results (see batch.py) have no per-request latency
+    if summary["p50_latency"] is not None:
+        text += f"p50 latency {summary['p50_latency']:.2f}s, p95 {summary['p95_latency']:.2f}s, "
+    text += f"{summary['total_tokens']} tokens ({summary['input_tokens']} in / {summary['output_tokens']} out), {summary['retries']} retries"
+    if summary["cached_input_tokens"]:
+        text += f", {summary['cached_input_tokens']} input tokens from the prompt cache"
+    if summary["cost"] is not None:
+        text += f", ~${summary['cost']:.4f}"
+    return text
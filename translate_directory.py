@@ -2,18 +2,44 @@
 
 import os
 from tqdm import tqdm
+import checkpoint
+import deduplication
+import hedging
+import telemetry
 import translate_file
 
-def translate_directory(directory, output_dir, aimodel):
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    # Collect all .txt files in the directory
-    txt_files = [
+# Collect all .txt files in the directory
+def list_txt_files(directory):
+    return [
         f for f in os.listdir(directory)
         if os.path.isfile(os.path.join(directory, f)) and f.lower().endswith(".txt")
     ]
 
+def print_failures(failures):
+    if failures:
+        print(f"\n{len(failures)} files did not translate completely:")
+        for filename, reason in failures.items():
+            print(f"\t{filename}: {reason}")
+
+# resume=True skips files the output manifest lists as complete and resumes partially translated ones from their journals
+# parallel=True feeds the chunks of every file through one shared pool instead of one file at a time (see translate_directory_parallel)
+# dedup="exact" or "near" translates a chunk repeated anywhere in the directory only once (see deduplication.py)
+# jsonl=True also writes an aligned .jsonl next to every output txt (see output_writer.py)
+# content_defined / incremental: edit-stable chunking and reuse of unchanged chunks, see translate_file.translate_file
+# hard_split=True also splits overlong lines without sentence endings (unpunctuated scans), see translate_file.chunk_source
+# Returns {filename: reason} for every file that didn't translate completely, these are also printed at the end.
+def translate_directory(directory, output_dir, aimodel, api_key=None, max_workers=None, cache_path=None, resume=False, pack_tokens=None, parallel=False, dedup=None, jsonl=False, content_defined=False, incremental=False, hard_split=False):
+    if parallel:
+        return translate_directory_parallel(directory, output_dir, aimodel, api_key, max_workers=max_workers, cache_path=cache_path, resume=resume, pack_tokens=pack_tokens, dedup=dedup, jsonl=jsonl, content_defined=content_defined, incremental=incremental, hard_split=hard_split)
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    txt_files = list_txt_files(directory)
+    manifest = checkpoint.load_manifest(output_dir) if resume else {}
+    failures = {}
+    deduplicator = deduplication.make_deduplicator(dedup) # shared so repeats across files are caught too
+
     # Use tqdm to show progress
     with tqdm(total=len(txt_files), desc="Translating files", unit="file") as pbar:
         for filename in txt_files:
@@ -21,15 +47,223 @@ def translate_directory(directory, output_dir, aimodel):
             base_name = os.path.splitext(filename)[0]
             output_name = f"{base_name}_translated"
 
+            if resume and not incremental and checkpoint.is_complete(output_dir, output_name, manifest):
+                pbar.update(1)
+                continue
+
             try:
-                translate_file.translate_file(filepath, output_dir, aimodel, output_filepath_name=output_name)
+                failed = translate_file.translate_file(filepath, output_dir, aimodel, api_key, output_filepath_name=output_name, max_workers=max_workers, cache_path=cache_path, resume=resume, pack_tokens=pack_tokens, dedup=deduplicator, jsonl=jsonl, content_defined=content_defined, incremental=incremental, hard_split=hard_split)
+                if failed:
+                    failures[filename] = f"{failed} chunks failed"
             except Exception as e:
                 print(f"\nError translating {filename}: {e}")
+                failures[filename] = str(e)
 
             pbar.update(1)  # Update after each file
 
+    if deduplicator is not None:
+        print(deduplicator.report())
+    if translate_file.config.telemetry is not None:
+        print(telemetry.describe(translate_file.config.telemetry.summary()))
+        translate_file.config.telemetry.write_metrics()
+    print_failures(failures)
+    return failures
+
+# One file's progress in translate_directory_parallel
+class FileJob:
+    def __init__(self, filename, filepath, output_name, chunks, completed, journal_file, resume):
+        self.filename = filename
+        self.filepath = filepath
+        self.output_name = output_name
+        self.chunks = chunks
+        self.translated = [None] * len(chunks)
+        self.models = [None] * len(chunks) # model that produced each translation
+        self.to_translate = []
+        for index, chunk in enumerate(chunks):
+            if index in completed and completed[index][0] == checkpoint.source_hash(chunk):
+                self.translated[index] = completed[index][1]
+                self.models[index] = checkpoint.entry_model(completed[index], None)
+            else:
+                self.to_translate.append((index, chunk))
+        self.remaining = len(self.to_translate)
+        self.size = sum(len(chunk) for _, chunk in self.to_translate)
+        self.journal_file = journal_file
+        self.resume = resume
+        self.journal = None
+        self.finished = False
+        self.stats = telemetry.Telemetry(parent=translate_file.config.telemetry, source=filepath)
+
+    # sets a chunk's translation and journals it, the journal is only opened once the file gets its first result
+    def record(self, index, translation, model=None):
+        if self.journal is None:
+            self.journal = checkpoint.ChunkJournal(self.journal_file, resume=self.resume)
+        self.translated[index] = translation
+        self.models[index] = model
+        self.journal.record(index, self.chunks[index], translation, model)
+        self.remaining -= 1
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+
+# Directory mode with a global work scheduler. Every file is chunked first, then the chunks of all files go
+# through one shared pool with at most max_workers requests in flight (and a small bounded backlog) in total,
+# so a directory of many small files keeps the provider busy. Files are scheduled longest first so one
+# big file doesn't start last and drag out the run. Each file's translations are reassembled in order and
+# its output written as soon as its last chunk finishes. Failures are collected and reported at the end.
+# With dedup the whole directory is deduplicated before anything is sent: only first occurrences are scheduled
+# and each duplicate is filled in (and its file finished, if it was the last chunk) when its first occurrence returns.
+def translate_directory_parallel(directory, output_dir, aimodel, api_key=None, max_workers=None, cache_path=None, resume=False, pack_tokens=None, dedup=None, jsonl=False, content_defined=False, incremental=False, hard_split=False):
+    os.makedirs(output_dir, exist_ok=True)
+    translate_file.initialize_clients(aimodel, api_key)
+    if cache_path is not None:
+        translate_file.enable_cache(cache_path)
+    provider = translate_file.provider_name(aimodel)
+    if max_workers is None:
+        max_workers = translate_file.MAX_IN_FLIGHT.get(provider, 1)
+
+    manifest = checkpoint.load_manifest(output_dir) if resume else {}
+    failures = {}
+    jobs = []
+    for filename in list_txt_files(directory):
+        filepath = os.path.join(directory, filename)
+        output_name = f"{os.path.splitext(filename)[0]}_translated"
+        if resume and not incremental and checkpoint.is_complete(output_dir, output_name, manifest):
+            continue
+        try:
+            chunks = list(translate_file.chunk_source(filepath, content_defined, hard_split))
+        except Exception as e:
+            print(f"\nError chunking {filename}: {e}")
+            failures[filename] = str(e)
+            continue
+        journal_file = checkpoint.journal_path(output_dir, output_name)
+        completed = checkpoint.load_journal(journal_file) if resume else {}
+        if incremental:
+            completed = {**translate_file.reusable_translations(output_dir, output_name, aimodel, chunks), **completed}
+        jobs.append(FileJob(filename, filepath, output_name, chunks, completed, journal_file, resume))
+
+    # longest files first
+    jobs.sort(key=lambda job: job.size, reverse=True)
+
+    deduplicator = deduplication.make_deduplicator(dedup)
+    duplicates = {} # (filename, index) of a first occurrence -> [(job, index)] of its duplicates
+    if deduplicator is not None:
+        for job in jobs:
+            to_translate = []
+            waiting = {index for index, _ in job.to_translate}
+            for index, chunk in enumerate(job.chunks):
+                key = (job.filename, index)
+                first = deduplicator.check(key, str(chunk))
+                if index not in waiting:
+                    # replayed from the journal, it can still stand in for later duplicates
+                    if first is None:
+                        deduplicator.resolve(key, job.translated[index], job.models[index])
+                elif first in deduplicator.translations:
+                    deduplicator.reused(key, deduplicator.translations[first])
+                    job.translated[index] = deduplicator.translations[first]
+                    job.models[index] = deduplicator.models.get(first)
+                    job.remaining -= 1
+                elif first is not None:
+                    duplicates.setdefault(first, []).append((job, index))
+                else:
+                    to_translate.append((index, chunk))
+            job.to_translate = to_translate
+
+    def finish(job):
+        job.finished = True
+        job.close()
+        failed = sum(1 for t in job.translated if t is None)
+        try:
+            models = [model or aimodel for model in job.models]
+            translate_file.finish_output(job.filepath, output_dir, aimodel, job.output_name, job.chunks, job.translated, job.stats.summary(), jsonl, models)
+        except Exception as e:
+            print(f"\nError writing {job.output_name}.txt: {e}")
+            if not failed:
+                failures[job.filename] = str(e)
+        if failed:
+            failures[job.filename] = f"{failed} chunks failed"
+
+    # every request, including hedges and failovers, is recorded under the model it went to
+    def record_attempt(key, positions, record, model, translations, error):
+        job, group = key
+        if error is not None:
+            print(f"\nError translating chunk {group[positions[0]] + 1} of {job.filename} with {model}: {error}")
+        indices = [group[position] for position in positions]
+        job.stats.record_request(record, [(index, job.chunks[index]) for index in indices], translations, translate_file.provider_name(model), model)
+
+    total_chunks = sum(job.remaining for job in jobs)
+    with tqdm(total=total_chunks, desc="Translating chunks", unit="chunk") as pbar, hedging.HedgedRequests(
+        max_workers, translate_file.translate_group, aimodel, pack_tokens, translate_file.config.hedging, record_attempt
+    ) as requests:
+
+        # records one chunk's translation, fills in its duplicates and finishes any file that is now complete
+        def settle(job, index, translated_text, model):
+            job.record(index, translated_text, model)
+            pbar.update(1)
+            if deduplicator is not None and translated_text is not None:
+                deduplicator.resolve((job.filename, index), translated_text, model)
+            for duplicate_job, duplicate_index in duplicates.pop((job.filename, index), ()):
+                deduplicator.reused((duplicate_job.filename, duplicate_index), translated_text)
+                settle(duplicate_job, duplicate_index, translated_text, model)
+            if job.remaining == 0 and not job.finished:
+                finish(job)
+
+        def collect():
+            for (job, group), translations, models, _ in requests.wait():
+                for index, translated_text, model in zip(group, translations, models):
+                    settle(job, index, translated_text, model or aimodel)
+
+        for job in jobs:
+            if job.remaining == 0 and not job.finished:
+                finish(job) # everything was replayed from the journal (or reused from duplicates)
+                continue
+            for group in translate_file.group_chunks(job.to_translate, pack_tokens):
+                # the shared queue is bounded: wait for a slot before handing out more work
+                if len(requests) >= max_workers * 2:
+                    collect()
+                texts = [str(chunk) for _, chunk in group]
+                requests.submit((job, tuple(index for index, _ in group)), texts)
+        while requests:
+            collect()
+
+    if deduplicator is not None:
+        print(deduplicator.report())
+    if translate_file.config.hedging is not None:
+        print(translate_file.config.hedging.report())
+    if translate_file.config.telemetry is not None:
+        print(telemetry.describe(translate_file.config.telemetry.summary()))
+        translate_file.config.telemetry.write_metrics()
+    print_failures(failures)
+    return failures
+
 if __name__ == "__main__":
     DIRECTORY = "DIRECTORY_TO_TRANSLATE"
     OUTPUT_DIR = "DIRECTORY_FOR_TRANSLATED_FILES"
     AI_MODEL = "CHOSEN_MODEL_NAME" # TODO: Rewrite translation models system to work better with the system?
-    translate_directory(DIRECTORY, OUTPUT_DIR, AI_MODEL)
\ No newline at end of file
+    API_KEY = None # or set the provider's *_API_KEY environment variable
+    MAX_WORKERS = None # None uses the provider default from translate_file.MAX_IN_FLIGHT
+    CACHE_PATH = "translation_cache.sqlite3" # set to None to always call the API
+    RESUME = True # pick up where an interrupted run left off
+    PACK_TOKENS = None # e.g. 1500 to send several chunks per request
+    PARALLEL = True # translate chunks from every file through one shared pool
+    DEDUP = "exact" # "near" also reuses translations of near-identical chunks, None translates every copy
+    OLLAMA_KEEP_ALIVE = None # e.g. "30m" for local models: preload the model, keep it loaded across files and fill every server slot
+    GLOSSARY = None # e.g. "glossary.txt" ("term<TAB>rendering" lines) added to every prompt and cached by the provider
+    BATCH = False # OpenAI / Anthropic models: submit everything through the batch API (half price, done within 24h)
+    HARD_SPLIT = False # split overlong lines even without sentence endings (unpunctuated scans)
+    PLAN = False # only estimate the chunks, tokens, cost and wall time of the run (see plan.py), nothing is sent
+    if OLLAMA_KEEP_ALIVE is not None:
+        translate_file.enable_ollama_throughput(OLLAMA_KEEP_ALIVE)
+    if GLOSSARY is not None:
+        translate_file.enable_prompt_context(GLOSSARY)
+    if PLAN:
+        import plan
+        calibration = plan.calibrate("translation_events.jsonl", AI_MODEL) if os.path.exists("translation_events.jsonl") else None
+        print(plan.describe_plan(plan.plan_directory(DIRECTORY, AI_MODEL, PACK_TOKENS, MAX_WORKERS, calibration=calibration, batch=BATCH, hard_split=HARD_SPLIT)))
+    elif BATCH:
+        import batch
+        translate_file.enable_telemetry("translation_events.jsonl", metrics_path="translation_metrics.prom") # per-chunk latency, tokens and cost
+        batch.translate_directory_batch(DIRECTORY, OUTPUT_DIR, AI_MODEL, API_KEY, pack_tokens=PACK_TOKENS, resume=RESUME, hard_split=HARD_SPLIT)
+    else:
+        translate_file.enable_telemetry("translation_events.jsonl", metrics_path="translation_metrics.prom") # per-chunk latency, tokens and cost
+        translate_directory(DIRECTORY, OUTPUT_DIR, AI_MODEL, API_KEY, max_workers=MAX_WORKERS, cache_path=CACHE_PATH, resume=RESUME, pack_tokens=PACK_TOKENS, parallel=PARALLEL, dedup=DEDUP, hard_split=HARD_SPLIT)
@@ -6,180 +6,435 @@
 
 
 import chunking
+import checkpoint
+import deduplication
+import hedging
+import packing
+import prompts
+import telemetry
+from output_writer import OutputWriter
+from translation_cache import TranslationCache
 from tqdm import tqdm
 
 import time
 import subprocess, os
 
-# import anthropic
-from translationmodels.openai import OpenAITranslator
-from translationmodels.anthropic import AnthropicTranslator
-from translationmodels.llama import LlamaTranslator
-from translationmodels.deepseek import DeepSeekTranslator
+# provider SDKs (openai, anthropic, langchain_ollama...) are only imported once a model from that provider is used
+from translationmodels import registry
+from translationmodels import ollama
 
 
 # Configuration class to hold API clients
 class Config:
     def __init__(self):
-        self.openai_client = None
-        self.anthropic_client = None
-        self.llama_client = None
-        self.deepseek_client = None
-        self.gemini_client = None
+        self.clients = {} # provider name (see translationmodels/registry.py) -> translator
+        self.cache = None # TranslationCache, see enable_cache()
+        self.telemetry = None # run-wide telemetry.Telemetry, see enable_telemetry()
+        self.hedging = None # hedging.HedgePolicy, see enable_hedging()
+        self.prompt_context = None # prompts.PromptContext, see enable_prompt_context()
 
 config = Config()
 
+# default number of requests kept in flight at once for each provider (override with max_workers).
+# Local ollama models share a single GPU/CPU, so they stay at one request at a time by default
+# (enable_ollama_throughput() raises them to the server's parallel slot count).
+MAX_IN_FLIGHT = {
+    "openai": 8,
+    "anthropic": 8,
+    "gemini": 8,
+    "llama": 1,
+    "deepseek": 1,
+}
+
+# returns the provider name translate() will dispatch the given model to
+def provider_name(aimodel):
+    return registry.resolve(aimodel)
+
+# message printed when translate() is asked to use a provider whose client was never initialized
+def client_error(provider):
+    spec = registry.get(provider)
+    if spec.api_key_env is not None:
+        return f"Error: {spec.label} client not initialized. Provide a valid API key."
+    return f"Error: {spec.label} client not initialized."
+
+# turns on the persistent translation cache for every following translate() call
+def enable_cache(path="translation_cache.sqlite3", max_entries=None, max_age_days=None):
+    if config.cache is not None and config.cache.path == path:
+        return config.cache
+    if config.cache is not None:
+        config.cache.close()
+    config.cache = TranslationCache(path, max_entries=max_entries, max_age_days=max_age_days)
+    return config.cache
+
+# turns on the run-wide telemetry: every chunk event is appended to events_path, metrics_path gets
+# OpenMetrics text after each file and metrics_port serves the same at http://127.0.0.1:<port>/metrics
+def enable_telemetry(events_path="translation_events.jsonl", metrics_path=None, metrics_port=None):
+    if config.telemetry is not None:
+        config.telemetry.close()
+    config.telemetry = telemetry.Telemetry(events_path, metrics_path)
+    if metrics_port is not None:
+        config.telemetry.serve_metrics(metrics_port)
+    return config.telemetry
+
+# turns on hedged requests and failover for every following translate_chunks call (see hedging.py): a request
+# slower than the rolling percentile of its model gets a duplicate sent to the secondary model (or the same one
+# without a secondary), and chunks that fail are retried on the secondary. Options are passed to hedging.HedgePolicy.
+# Clients are kept per provider and the ollama and gemini clients are tied to one model, so the secondary should
+# be from another provider, or another model of a provider that takes the model per request (OpenAI, Anthropic).
+def enable_hedging(secondary=None, percentile=0.95, **options):
+    config.hedging = hedging.HedgePolicy(secondary, percentile, **options)
+    return config.hedging
+
+# adds a glossary and/or context to the system prompt of every request and, with cache=True, marks the prompt for
+# provider prompt caching so the shared prefix is billed at the cached rate (see prompts.py).
+# glossary: {term: rendering} or a path to a glossary file
+def enable_prompt_context(glossary=None, context=None, cache=True):
+    config.prompt_context = prompts.PromptContext(glossary, context, cache)
+    return config.prompt_context
+
+# The system prompt a request to client is sent with: system_prompt (or the client's own), plus the prompt context.
+# Also returns whether the client should mark it for prompt caching.
+def request_prompt(client, system_prompt=None):
+    if config.prompt_context is None:
+        return system_prompt, False
+    system_prompt = config.prompt_context.apply(system_prompt or getattr(client, "SYSTEM_PROMPT", ""))
+    return system_prompt, config.prompt_context.cache and getattr(client, "PROMPT_CACHING", False)
+
+# turns on throughput mode for local ollama models (see translationmodels/ollama.py): the model is preloaded when its
+# client is created and kept loaded for keep_alive between requests and files, and as many requests as the server has
+# parallel slots (num_parallel, default OLLAMA_NUM_PARALLEL) are kept in flight. Returns the slot count.
+def enable_ollama_throughput(keep_alive="30m", num_parallel=None, base_url=None):
+    slots = ollama.configure(keep_alive, num_parallel, base_url)
+    for provider in ("llama", "deepseek"):
+        MAX_IN_FLIGHT[provider] = slots
+        config.clients.pop(provider, None) # rebuilt with keep_alive (and warmed up) by the next initialize_clients
+    return slots
+
+# everything besides the text and model name that changes what a client returns, used in the cache key
+def cache_params(client):
+    return {
+        "client": type(client).__name__,
+        "temperature": getattr(client, "temperature", None),
+        "max_tokens": getattr(client, "max_tokens", None),
+    }
+
 # takes a parameter string and uses the OpenAI API to translate it to English (later added more api options)
 # from Classical Chinese (if the USE_AI constant is set to True)
 # TODO: Update this to work more consistently with multiple AI models, and better with olllama models
 # TODO: Support HuggingFace models as well?
-def translate(text, aimodel):
-    if "gpt" in aimodel.lower() and "gpt-oss" not in aimodel.lower(): # Make an OPENAI api call
-        if config.openai_client is None:
-            print("Error: OpenAI client not initialized. Provide a valid API key.")
-            return None
-        return config.openai_client.translate(text, aimodel)
-    elif "claude" in aimodel.lower():
-        if config.anthropic_client is None:
-            print("Error: Anthropic client not initialized. Provide a valid API key.")
-            return None
-        return config.anthropic_client.translate(text, aimodel)
-    elif "gemini" in aimodel.lower():
-        if config.gemini_client is None:
-            print("Error: Gemini client not initialized. Provide a valid API key.")
-            return None
-        return config.gemini_client.translate(text, aimodel)
-    elif "llama" in aimodel.lower():
-        if config.llama_client is None:
-            print("Error: Llama client not initialized.")
-            return None
-        return config.llama_client.translate(text, aimodel)
-    elif "deepseek" in aimodel.lower():
-        if config.deepseek_client is None:
-            print("Error: Deepseek client not initialized")
-            return None
-        return config.deepseek_client.translate(text, aimodel)
-    else:
-        if config.llama_client is None:
-            print("Error: ollama client not initialized.")
-            return None
-        return config.llama_client.translate(text, aimodel)
-        # print("Error: Unrecognized model selection.")
-        # return None
+# system_prompt and max_tokens override the client's defaults for this request (packed requests use them)
+def translate(text, aimodel, system_prompt=None, max_tokens=None):
+    provider = provider_name(aimodel)
+    client = config.clients.get(provider)
+    if client is None:
+        print(client_error(provider))
+        return None
+
+    system_prompt, cache_prompt = request_prompt(client, system_prompt)
+    overrides = {}
+    if system_prompt is not None:
+        overrides["system_prompt"] = system_prompt
+    if cache_prompt:
+        overrides["cache_prompt"] = True
+    if max_tokens is not None:
+        overrides["max_tokens"] = max_tokens
+
+    if config.cache is None:
+        return client.translate(text, aimodel, **overrides)
+
+    # check the persistent cache before paying for a request
+    params = cache_params(client)
+    if max_tokens is not None:
+        params["max_tokens"] = max_tokens
+    key = config.cache.make_key(text, aimodel, system_prompt or getattr(client, "SYSTEM_PROMPT", ""), params)
+    cached = config.cache.get(key)
+    if cached is not None:
+        telemetry.record_cache_hit()
+        return cached
+    translated_text = client.translate(text, aimodel, **overrides)
+    config.cache.put(key, aimodel, translated_text)
+    return translated_text
     
-# this will iterate through the chunks and translate them one by one, returning two lists: untranslated and translated
-def translate_chunks(untranslated_chunks, aimodel):
-    translated_chunks = []
-    if not untranslated_chunks:  # empty deque or list
-        print("You gave an empty document!")
-    else:
-        with tqdm(total=len(untranslated_chunks)) as pbar:
-            for chunk in untranslated_chunks:
-                translated_text = translate(chunk, aimodel)
-                translated_chunks.append(translated_text)
+# returns (translations, fell_back) for a group of chunk texts, packed into one request if pack_tokens is set
+def translate_group(texts, aimodel, pack_tokens=None):
+    if pack_tokens:
+        return packing.translate_packed(texts, aimodel, translate)
+    return [translate(texts[0], aimodel)], False
+
+# splits (index, chunk) pairs into the groups translate_group sends as one request each
+def group_chunks(indexed_chunks, pack_tokens=None):
+    if pack_tokens:
+        return packing.pack_chunks(indexed_chunks, token_budget=pack_tokens)
+    return ([item] for item in indexed_chunks)
+
+# this will translate the chunks concurrently, returning two lists: untranslated and translated
+# Up to max_workers requests are in flight at once (defaults to MAX_IN_FLIGHT for the provider).
+# translated_chunks is always in source order so the [Np] markers line up, and a chunk that
+# raises is recorded as None instead of cancelling the others.
+# untranslated_chunks can also be a generator (e.g. chunking.iter_chunk_spans), translation then starts while
+# the rest of the file is still being chunked and chunking never runs far ahead of the requests.
+# completed: {index: (source_hash, translation[, model])} replayed from a journal, matching chunks are not resent.
+# on_result: called as on_result(index, chunk, translation, model=...) as soon as each chunk finishes, and as
+#   on_result(index, chunk, translation, model=..., replayed=True) for each chunk taken from completed.
+#   model is the model that produced the translation (with enable_hedging() it isn't always aimodel).
+# pack_tokens: if set, consecutive chunks are packed into one request of up to this many estimated
+#   source tokens (see packing.py), groups whose response doesn't split back cleanly are sent chunk by chunk.
+# dedup: "exact", "near" or a shared deduplication.Deduplicator. Only the first occurrence of a repeated chunk is
+#   sent, its translation is filled in for every duplicate (see deduplication.py).
+# stats: a telemetry.Telemetry that records every request (by default a new one reporting to config.telemetry).
+# Requests go through hedging.HedgedRequests, which hedges slow ones and fails over failed ones if enable_hedging() is on.
+# retain=False drops every chunk and translation as soon as it has been handed to on_result and returns (None, None):
+#   with a generator as input, memory then stays bounded by the requests in flight instead of growing with the file.
+#   (A deduplicator still keeps the translation of every first occurrence, that's how it reuses them.)
+def translate_chunks(untranslated_chunks, aimodel, max_workers=None, completed=None, on_result=None, pack_tokens=None, dedup=None, stats=None, retain=True):
+    provider = provider_name(aimodel)
+    if max_workers is None:
+        max_workers = MAX_IN_FLIGHT.get(provider, 1)
+    if stats is None:
+        stats = telemetry.Telemetry(parent=config.telemetry)
+    completed = completed or {}
+    deduplicator = deduplication.make_deduplicator(dedup)
+    scope = deduplicator.new_scope() if deduplicator is not None else None
+    duplicates = {} # index of a first occurrence still in flight -> indices of its duplicates
+    total = len(untranslated_chunks) if hasattr(untranslated_chunks, "__len__") else None
+
+    chunks = {} # index -> chunk, only until its result is handed on unless retain
+    translated_chunks = {}
+    chunk_count = 0
+    requests_sent = 0
+    chunks_sent = 0
+    fallbacks = 0
+
+    # yields the chunks that still need a translation, filling in the ones replayed from the journal
+    def chunks_to_translate():
+        nonlocal chunk_count
+        for index, chunk in enumerate(untranslated_chunks):
+            chunk_count += 1
+            if index in completed and completed[index][0] == checkpoint.source_hash(chunk):
+                translated_text = completed[index][1]
+                model = checkpoint.entry_model(completed[index], aimodel)
+                if retain:
+                    chunks[index] = chunk
+                    translated_chunks[index] = translated_text
+                if on_result is not None:
+                    on_result(index, chunk, translated_text, model=model, replayed=True)
+                if deduplicator is not None and deduplicator.check((scope, index), str(chunk)) is None:
+                    deduplicator.resolve((scope, index), translated_text, model)
                 pbar.update(1)
+                continue
+            chunks[index] = chunk
+            if deduplicator is not None:
+                first = deduplicator.check((scope, index), str(chunk))
+                if first in deduplicator.translations:
+                    deduplicator.reused((scope, index), deduplicator.translations[first])
+                    fill(index, deduplicator.translations[first], deduplicator.models.get(first, aimodel))
+                    continue
+                if first is not None and first[0] == scope:
+                    duplicates.setdefault(first[1], []).append(index)
+                    continue
+                # otherwise it's new, or the first occurrence was in an earlier file and failed
+            yield index, chunk
 
-    return untranslated_chunks, translated_chunks
+    # sets a chunk's translation, including every duplicate waiting on it
+    def fill(index, translated_text, model):
+        if retain:
+            translated_chunks[index] = translated_text
+        if on_result is not None:
+            on_result(index, chunks[index], translated_text, model=model)
+        if not retain:
+            del chunks[index]
+        pbar.update(1)
+        if deduplicator is not None and translated_text is not None:
+            deduplicator.resolve((scope, index), translated_text, model)
+        for duplicate in duplicates.pop(index, ()):
+            deduplicator.reused((scope, duplicate), translated_text)
+            fill(duplicate, translated_text, model)
+
+    # every request, including hedges and failovers, is recorded under the model it went to
+    def record_attempt(group, positions, record, model, translations, error):
+        if error is not None:
+            print(f"\nError translating chunk {group[positions[0]] + 1} with {model}: {error}")
+        # with retain=False a hedge that lost can finish after its chunks were dropped, it's then weighted evenly
+        stats.record_request(record, [(group[position], chunks.get(group[position], "")) for position in positions], translations, provider_name(model), model)
+
+    with tqdm(total=total) as pbar, hedging.HedgedRequests(max_workers, translate_group, aimodel, pack_tokens, config.hedging, record_attempt) as requests:
+
+        def collect():
+            nonlocal fallbacks
+            for group, translations, models, fell_back in requests.wait():
+                fallbacks += fell_back
+                for index, translated_text, model in zip(group, translations, models):
+                    fill(index, translated_text, model or aimodel)
+
+        for group in group_chunks(chunks_to_translate(), pack_tokens):
+            # keep a small backlog queued behind the running requests, no more
+            if len(requests) >= max_workers * 2:
+                collect()
+            # chunks may be chunking.Chunk spans, the text is only built here when it's sent
+            texts = [str(chunk) for _, chunk in group]
+            requests.submit(tuple(index for index, _ in group), texts)
+            requests_sent += 1
+            chunks_sent += len(group)
+        while requests:
+            collect()
+
+    if not chunk_count:  # empty deque or list
+        print("You gave an empty document!")
+    elif pack_tokens:
+        print(f"Packed {chunks_sent} chunks into {requests_sent} requests ({fallbacks} groups fell back to one request per chunk)")
+    if config.hedging is not None and chunk_count:
+        print(config.hedging.report())
+    if deduplicator is not None and deduplicator is not dedup:
+        print(deduplicator.report())
+    if not retain:
+        return None, None
+    return [chunks[index] for index in range(chunk_count)], [translated_chunks[index] for index in range(chunk_count)]
 
 import os
 import time
 
-# This function generates and saves the translated txt file
+# This function generates and saves the translated txt file (see output_writer.py for the layout)
+# stats: optional telemetry summary (telemetry.Telemetry.summary()) added to the Summary Statistics
+# jsonl=True also writes <output_filepath_name>.jsonl with one record per chunk
 # TODO: Edit the first line to have more metadata (must integrate into the web UI later)
-def generate_txt(chinese_untranslated, english_translated, directory_path, aimodel, output_filepath_name):
-    english_length = 0
-    chinese_length = 0
-
-    write_path = os.path.join(directory_path, f"{output_filepath_name}.txt")
-    if chinese_untranslated and english_translated:
-        with open(write_path, "w", encoding="utf-8") as file:
-
-            file.write(f"Translation created with model: {aimodel} \n\n")
-
-            # english section
-            node_counter = 1
-            for eng_text in english_translated:
-                file.write(eng_text + '[' + str(node_counter) + "p]" + '\n')
-                english_length += len(eng_text)
-                node_counter += 1
-
-            # intermediate section
-            file.write("\n\nBelow is the original Chinese:\n\n\n")
-
-            # chinese section
-            node_counter = 1
-            for zh_text in chinese_untranslated:
-                file.write(zh_text + '[' + str(node_counter) + "p]" + '\n')
-                chinese_length += len(zh_text)
-                node_counter += 1
-            file.write("\n\n\n\nSummary Statistics\n")
-            file.write("\t\nTotal English characters: " + str(english_length))
-            file.write("\t\nTotal Chinese characters: " + str(chinese_length))
-            file.write("\t\nAverage English chunk length: " + str(round(sum(len(c) for c in english_translated) / len(english_translated), 2)) if english_translated else "0")
-            file.write("\t\nAverage Chinese chunk length: " + str(round(sum(len(c) for c in chinese_untranslated) / len(chinese_untranslated), 2)) if chinese_untranslated else "0")
-            file.write("\t\nTotal: " + str(chinese_length + english_length))
-    else:
-        print("Your file is probably empty or something! Figure this out")
-
-# Initializes appropriate API clients based on the selected model
-# TODO: Streamline this function / combine with translate function somehow?
+# models: the model that produced each translation, if they weren't all made by aimodel
+def generate_txt(chinese_untranslated, english_translated, directory_path, aimodel, output_filepath_name, stats=None, jsonl=False, models=None):
+    models = models or [aimodel] * len(english_translated)
+    with OutputWriter(directory_path, output_filepath_name, aimodel, jsonl=jsonl) as writer:
+        for index, (zh_text, eng_text, model) in enumerate(zip(chinese_untranslated, english_translated, models)):
+            writer.add(index, zh_text, eng_text, model)
+        writer.finish(stats)
+
+# Initializes the API client for the selected model's provider (see translationmodels/registry.py)
+# The key can also come from the provider's environment variable (OPENAI_API_KEY, ANTHROPIC_API_KEY, GEMINI_API_KEY).
+# With enable_hedging() the secondary model's client is initialized too (with api_key only if it's the same provider).
 def initialize_clients(aimodel, api_key=None):
+    initialize_client(aimodel, api_key)
+    if config.hedging is not None:
+        for model in (config.hedging.secondary, config.hedging.hedge_model):
+            if model is not None:
+                initialize_client(model, api_key if provider_name(model) == provider_name(aimodel) else None)
+
+def initialize_client(aimodel, api_key=None):
+    provider = provider_name(aimodel)
+    if provider in config.clients:
+        return
+    spec = registry.get(provider)
+
+    if spec.api_key_env is not None:
+        if api_key == f"Paste {spec.label} API key here":
+            api_key = None
+        if not api_key and not os.getenv(spec.api_key_env):
+            print(f"Paste your {spec.label} API key in the designated area")
+            return
 
-    if ("gpt" in aimodel.lower() or aimodel.startswith("o")) and "gpt-oss" not in aimodel.lower():
-        # OpenAI
-        if not api_key or api_key == "Paste OpenAI API key here":
-            print("Paste your OpenAI API key in the designated area")
-        else:
-            if config.openai_client is None:
-                config.openai_client = OpenAITranslator(api_key=api_key)
-
-    elif "claude" in aimodel.lower():
-        # Anthropic
-        if not api_key or api_key == "Paste Anthropic API key here":
-            print("Paste your Anthropic API key in the designated area")
-        else:
-            if config.anthropic_client is None:
-                config.anthropic_client = AnthropicTranslator(api_key=api_key)
-
-    elif "gemini" in aimodel.lower():
-        # Gemini
-        if not api_key or api_key == "Paste Gemini API key here":
-            print("Paste your Gemini API key in the designated area")
-        else:
-            if config.gemini_client is None:
-                from translationmodels.gemini import GeminiTranslator
-                config.gemini_client = GeminiTranslator(api_key=api_key)
-
-    elif "llama" in aimodel.lower():
-        # Llama (local or API-based)
-        if config.llama_client is None:
-            config.llama_client = LlamaTranslator(model=aimodel)
-
-    elif "deepseek" in aimodel.lower():
-        # DeepSeek
-        if config.deepseek_client is None:
-            config.deepseek_client = DeepSeekTranslator(model=aimodel)
-
-    else:
-        # Default to Ollama local Llama
-        if config.llama_client is None:
-            config.llama_client = LlamaTranslator(model=aimodel)
-
-def translate_file(filepath, output_directory, aimodel, api_key, output_filepath_name="DEFAULT"):
+    config.clients[provider] = spec.create(aimodel, api_key)
+
+# resume=True replays the journal left by an interrupted run and only translates the missing or failed chunks.
+# If the output is already listed as complete in the directory manifest, the file is skipped entirely.
+# stream=True chunks the file lazily (chunking.iter_chunk_spans) so translation starts before chunking finishes, and
+# only the chunks in flight (plus those waiting on an earlier one for the in-order output) are held in memory.
+# incremental=True still reads every chunk first, to diff them against the previous run.
+# pack_tokens packs consecutive chunks into one request of about that many source tokens (see packing.py).
+# jsonl=True also writes an aligned <output name>.jsonl next to the txt (see output_writer.py).
+# dedup="exact" or "near" translates repeated chunks once (see deduplication.py), pass a Deduplicator to share across files.
+# content_defined=True anchors chunk boundaries to the text (see chunking.iter_content_defined_spans), so an edit to
+# the source only changes the chunks around it.
+# incremental=True reuses the translation of every chunk whose text is unchanged since the last run (from the chunk
+# manifest written next to each output) and only translates the rest, even if the output was complete.
+# hard_split=True also splits overlong lines without sentence endings, see chunk_source.
+# Returns the number of chunks that failed to translate.
+def translate_file(filepath, output_directory, aimodel, api_key, output_filepath_name="DEFAULT", max_workers=None, cache_path=None, resume=False, stream=False, pack_tokens=None, dedup=None, jsonl=False, content_defined=False, incremental=False, hard_split=False):
     base_name = os.path.splitext(os.path.basename(filepath))[0]
 
     if output_filepath_name == "DEFAULT":
         output_filepath_name = f"{base_name}_translated"
 
+    os.makedirs(output_directory, exist_ok=True)
+    if resume and not incremental and checkpoint.is_complete(output_directory, output_filepath_name):
+        print(f"Skipping {filepath}, {output_filepath_name}.txt is already complete")
+        return 0
+
     initialize_clients(aimodel, api_key)
+    if cache_path is not None:
+        enable_cache(cache_path)
 
     # 1. Chunking- This is conducted in chunking.py, and will result in translatable chunks.
-    chunks = chunking.chunk_file(filepath)
-    print(len(chunks))
-    # 2. Translation- This will result in translated chunks.
-    untranslated_chunks, translated_chunks = translate_chunks(chunks, aimodel)
-    # 3. TXT Generation- This will result in a saved txt file with the translated and untranslated chunks.
-    generate_txt(untranslated_chunks, translated_chunks, output_directory, aimodel, output_filepath_name)
+    chunks = chunk_source(filepath, content_defined, hard_split)
+    if not stream or incremental:
+        chunks = list(chunks)
+        print(len(chunks))
+    # 2. Translation- This will result in translated chunks. Each one is journaled as soon as it finishes,
+    # 3. TXT Generation- and handed to the output writer, which spools it in order and assembles the txt at the end.
+    journal_file = checkpoint.journal_path(output_directory, output_filepath_name)
+    completed = checkpoint.load_journal(journal_file) if resume else {}
+    if completed:
+        print(f"Resuming: {len(completed)} translated chunks found in the journal")
+    if incremental:
+        completed = {**reusable_translations(output_directory, output_filepath_name, aimodel, chunks), **completed}
+    stats = telemetry.Telemetry(parent=config.telemetry, source=filepath)
+    manifest_file = checkpoint.chunk_manifest_path(output_directory, output_filepath_name)
+    # every result goes straight to the journal, the output writer and the chunk manifest, nothing else keeps it
+    # (retain=False), so with stream=True memory stays bounded by the requests in flight, not by the file
+    with checkpoint.ChunkJournal(journal_file, resume=resume) as journal, OutputWriter(output_directory, output_filepath_name, aimodel, jsonl=jsonl) as writer, \
+            checkpoint.ChunkManifestWriter(manifest_file, aimodel, filepath) as manifest:
+
+        def on_result(index, chunk, translation, model=None, replayed=False):
+            if not replayed:
+                journal.record(index, chunk, translation, model)
+            writer.add(index, chunk, translation, model)
+            manifest.add(index, chunk, translation, model)
+
+        translate_chunks(
+            chunks, aimodel, max_workers=max_workers, completed=completed, on_result=on_result, pack_tokens=pack_tokens, dedup=dedup, stats=stats, retain=False
+        )
+        writer.finish(stats.summary())
+        manifest.finish()
+    failed = complete_output(filepath, output_directory, output_filepath_name, writer.count, writer.missing)
+    print(telemetry.describe(stats.summary()))
+    if config.telemetry is not None:
+        config.telemetry.write_metrics()
+    if failed:
+        print(f"{failed} chunks failed to translate, rerun with resume=True to retry them")
+
+    if config.cache is not None:
+        stats = config.cache.stats()
+        print(f"Translation cache: {stats['hits']} hits, {stats['misses']} misses ({stats['entries']} entries)")
+    return failed
+
+# Chunks a file with the default bottom-up merge, or with content-defined boundaries that stay put when the
+# source is edited (see chunking.iter_content_defined_spans)
+# hard_split: split every line longer than the maximum chunk size, even without sentence endings (unpunctuated scans).
+#   Content-defined chunks always are.
+def chunk_source(filepath, content_defined=False, hard_split=False):
+    if content_defined:
+        return chunking.iter_content_defined_spans(filepath)
+    return chunking.iter_chunk_spans(filepath, hard_split=hard_split)
+
+# Translations from the chunk manifest of a previous run that still match a chunk of the current source,
+# as {index: (source_hash, translation)} for translate_chunks' completed
+def reusable_translations(output_directory, output_filepath_name, aimodel, chunks):
+    previous = checkpoint.load_chunk_manifest(checkpoint.chunk_manifest_path(output_directory, output_filepath_name), aimodel)
+    if not previous:
+        return {}
+    reusable = checkpoint.reusable_chunks(chunks, previous)
+    print(f"Incremental: {len(reusable)} of {len(chunks)} chunks unchanged since the last run, translating the other {len(chunks) - len(reusable)}")
+    return reusable
+
+# Writes the output txt and returns how many chunks failed (None).
+# Only a file with every chunk translated counts as complete, otherwise the journal is kept for the next resume.
+def finish_output(filepath, output_directory, aimodel, output_filepath_name, untranslated_chunks, translated_chunks, stats=None, jsonl=False, models=None):
+    generate_txt(untranslated_chunks, translated_chunks, output_directory, aimodel, output_filepath_name, stats, jsonl, models)
+    checkpoint.write_chunk_manifest(checkpoint.chunk_manifest_path(output_directory, output_filepath_name), aimodel, filepath, untranslated_chunks, translated_chunks, models)
+    failed = sum(1 for t in translated_chunks if t is None)
+    return complete_output(filepath, output_directory, output_filepath_name, len(translated_chunks), failed)
+
+# Marks a written output complete (manifest entry, journal removed) if no chunk failed, returns the failed count.
+def complete_output(filepath, output_directory, output_filepath_name, chunk_count, failed):
+    if chunk_count and failed == 0:
+        checkpoint.mark_complete(output_directory, output_filepath_name, filepath, chunk_count)
+        checkpoint.remove_journal(checkpoint.journal_path(output_directory, output_filepath_name))
+    return failed
 
 # if __name__ == "__main__": # Example implementation
 #     FILEPATH = '古今图书集成博物汇编艺术典医部全录/中恶门.txt'
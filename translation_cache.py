@@ -0,0 +1,164 @@
+# This file holds the on-disk translation cache shared across runs (and processes).
+# Translations are stored in SQLite, keyed by a hash of everything that affects the output:
+# the chunk text, the model name, the system prompt and the generation parameters.
+# Rerunning a file after a prompt tweak on one provider only pays for the chunks whose key changed.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = "translation_cache.sqlite3"
+
+class TranslationCache:
+    # max_entries: keep at most this many translations (least recently used are evicted first)
+    # max_age_days: drop translations created more than this many days ago
+    # Lookups only read: the shared hit/miss totals and last_used are written together every flush_every lookups
+    # (and by stats(), evict() and close()), and last_used only moves once it's touch_after seconds old,
+    # which is plenty for LRU eviction and keeps every lookup off the database write lock.
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=None, max_age_days=None, evict_every=100, flush_every=100, touch_after=3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.evict_every = evict_every
+        self.flush_every = flush_every
+        self.touch_after = touch_after
+
+        # counters for this process only, the totals across every process live in the stats table
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+        self._puts_since_evict = 0
+        # not yet written to the database, see flush()
+        self._pending = {"hits": 0, "misses": 0}
+        self._touched = set()
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "key TEXT PRIMARY KEY, model TEXT, translation TEXT NOT NULL, "
+                "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO stats (name, value) VALUES ('hits', 0), ('misses', 0)")
+        self.evict()
+
+    # sqlite connections can't be shared between threads, so every worker thread gets its own.
+    # WAL mode lets readers continue while another process writes, and the timeout waits out locks.
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    # builds the cache key. Any change to the prompt or parameters produces a different key.
+    @staticmethod
+    def make_key(text, model, system_prompt="", params=None):
+        payload = json.dumps(
+            {"text": text, "model": model, "system_prompt": system_prompt, "params": params or {}},
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # returns the cached translation, or None on a miss
+    def get(self, key):
+        row = self._connection().execute("SELECT translation, last_used FROM translations WHERE key = ?", (key,)).fetchone()
+
+        with self._lock:
+            if row is not None:
+                self.hits += 1
+                self._pending["hits"] += 1
+                if time.time() - row[1] >= self.touch_after:
+                    self._touched.add(key)
+            else:
+                self.misses += 1
+                self._pending["misses"] += 1
+            run_flush = self._pending["hits"] + self._pending["misses"] >= self.flush_every
+        if run_flush:
+            self.flush()
+        return row[0] if row is not None else None
+
+    # writes the lookups counted since the last flush to the stats table, and last_used for the touched keys
+    def flush(self):
+        with self._lock:
+            pending, touched = self._pending, self._touched
+            self._pending, self._touched = {"hits": 0, "misses": 0}, set()
+        if not any(pending.values()) and not touched:
+            return
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.executemany("UPDATE stats SET value = value + ? WHERE name = ?", [(count, name) for name, count in pending.items() if count])
+            conn.executemany("UPDATE translations SET last_used = ? WHERE key = ?", [(now, key) for key in touched])
+
+    # failed translations (None) are never cached, so they get retried on the next run
+    def put(self, key, model, translation):
+        if translation is None:
+            return
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO translations (key, model, translation, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, model, translation, now, now),
+            )
+
+        with self._lock:
+            self._puts_since_evict += 1
+            run_eviction = self._puts_since_evict >= self.evict_every
+            if run_eviction:
+                self._puts_since_evict = 0
+        if run_eviction:
+            self.evict()
+
+    # removes entries that are too old, then the least recently used ones beyond max_entries
+    def evict(self):
+        self.flush() # so entries used since the last flush count as recently used
+        conn = self._connection()
+        with conn:
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 86400
+                conn.execute("DELETE FROM translations WHERE created_at < ?", (cutoff,))
+            if self.max_entries is not None:
+                conn.execute(
+                    "DELETE FROM translations WHERE key IN ("
+                    "SELECT key FROM translations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    def stats(self):
+        self.flush()
+        conn = self._connection()
+        totals = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+        entries = conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "total_hits": totals.get("hits", 0),
+            "total_misses": totals.get("misses", 0),
+            "entries": entries,
+        }
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
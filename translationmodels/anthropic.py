@@ -1,26 +1,57 @@
 import anthropic
 import os
+from translationmodels.governor import get_governor, estimate_tokens, REQUEST_TIMEOUT
+import telemetry
 
 class AnthropicTranslator:
-    def __init__(self, api_key=None):
+    SYSTEM_PROMPT = "Translate the following Classical Chinese text to English with a focus on accuracy. Only output the translation:"
+    PROMPT_CACHING = True # cache_prompt marks the system prompt with cache_control (see prompts.py)
+
+    def __init__(self, api_key=None, temperature=0, max_tokens=1000, timeout=REQUEST_TIMEOUT):
+        self.temperature = temperature
+        self.max_tokens = max_tokens
         self.api_key = api_key or os.getenv("ANTHROPIC_API_KEY")
         if not self.api_key:
             raise ValueError("Anthropic API key is missing. Set it as an environment variable or pass it as an argument.")
         
-        self.client = anthropic.Anthropic(api_key=self.api_key)
+        # retries are handled by the governor (rate limits, backoff, Retry-After), not the SDK
+        self.client = anthropic.Anthropic(api_key=self.api_key, max_retries=0, timeout=timeout)
+        self.governor = get_governor("anthropic")
 
-    def translate(self, text, model, max_tokens=1000, temperature=0):
+    # system_prompt and max_tokens override the defaults for one request (used for packed multi-chunk requests)
+    # cache_prompt: mark the system prompt for prompt caching
+    def translate(self, text, model, max_tokens=None, temperature=None, system_prompt=None, cache_prompt=False):
+        max_tokens = max_tokens or self.max_tokens
+        system_prompt = system_prompt or self.SYSTEM_PROMPT
+        system = system_blocks(system_prompt) if cache_prompt else system_prompt
         try:
-            response = self.client.messages.create(
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                system="Translate the following Classical Chinese text to English with a focus on accuracy. Only output the translation:",
-                messages=[
-                    {"role": "user", "content": [{"type": "text", "text": text}]}
-                ]
+            response = self.governor.call(
+                lambda: self.client.messages.create(
+                    model=model,
+                    max_tokens=max_tokens,
+                    temperature=self.temperature if temperature is None else temperature,
+                    system=system,
+                    messages=[
+                        {"role": "user", "content": [{"type": "text", "text": text}]}
+                    ]
+                ),
+                tokens=estimate_tokens(system_prompt + text) + max_tokens,
+                usage=lambda response: response.usage.input_tokens + response.usage.output_tokens,
+                on_retry=telemetry.record_retry,
             )
+            record_usage(response.usage)
             return response.content[0].text  # Extract translated text
         except Exception as e:
             print(f"Error during translation: {e}")
             return None
+
+# The system prompt as a text block marked for prompt caching
+def system_blocks(system_prompt):
+    return [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+
+# input_tokens doesn't include the tokens read from or written to the prompt cache, telemetry counts all of them as input
+def record_usage(usage):
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    telemetry.record_usage(usage.input_tokens + cache_read + cache_write, usage.output_tokens)
+    telemetry.record_prompt_cache(cache_read, cache_write)
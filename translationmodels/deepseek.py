@@ -1,25 +1,31 @@
-from langchain_ollama import ChatOllama
 import os
+from translationmodels.governor import get_governor
+from translationmodels import ollama
+import telemetry
 import re
 
 class DeepSeekTranslator:
-    def __init__(self, model="deepseek-r1:7b", temperature=0, max_tokens=1200):
+    SYSTEM_PROMPT = "Translate the following Classical Chinese text to English with a focus on accuracy, and no notes other than the translated text: "
+
+    def __init__(self, model="deepseek-r1:7b", temperature=0, max_tokens=1200, timeout=ollama.REQUEST_TIMEOUT):
         self.model = model
         self.temperature = temperature
         self.max_tokens = max_tokens
 
-        # enforce hard cap with model_kwargs
-        self.client = ChatOllama(
-            model=self.model,
-            temperature=self.temperature,
-            model_kwargs={"num_predict": self.max_tokens}
-        )
+        # enforce hard cap with num_predict, plus keep_alive and warm-up in throughput mode
+        self.client = ollama.chat_client(self.model, self.temperature, self.max_tokens, timeout)
+        self.governor = get_governor("deepseek")
 
-    def translate(self, text, aimodel=None):
+    # system_prompt and max_tokens override the defaults for one request (used for packed multi-chunk requests),
+    # max_tokens is sent as that request's num_predict
+    def translate(self, text, aimodel=None, max_tokens=None, system_prompt=None):
+        prompt = (system_prompt or self.SYSTEM_PROMPT) + text
         try:
-            response = self.client.invoke(
-                f"Translate the following Classical Chinese text to English with a focus on accuracy, and no notes other than the translated text: {text}"
+            response = self.governor.call(
+                lambda: ollama.invoke(self.client, prompt, max_tokens),
+                on_retry=telemetry.record_retry,
             )
+            telemetry.record_ollama_response(response)
 
             # strip DeepSeek R1's <think> reasoning blocks
             final_answer = re.sub(
@@ -1,29 +1,50 @@
 import google.generativeai as genai
 import os
+from translationmodels.governor import get_governor, estimate_tokens, REQUEST_TIMEOUT
+import telemetry
 
 class GeminiTranslator:
-    def __init__(self, api_key=None, aimodel='gemini-2.5-flash-lite'):
+    SYSTEM_PROMPT = "Translate the following Classical Chinese text to English with a focus on accuracy. Only output the translation:"
+
+    def __init__(self, api_key=None, aimodel='gemini-2.5-flash-lite', temperature=0, max_tokens=1000, timeout=REQUEST_TIMEOUT):
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.timeout = timeout
         self.api_key = api_key or os.getenv("GEMINI_API_KEY")
         if not self.api_key:
             raise ValueError("Gemini API key is missing. Set it as an environment variable or pass it as an argument.")
 
         genai.configure(api_key=self.api_key)
         self.model = genai.GenerativeModel(aimodel)
+        self.governor = get_governor("gemini")
 
-    def translate(self, text, max_tokens=1000, temperature=0):
+    # aimodel is accepted for a consistent interface, the model is fixed when the client is created
+    # system_prompt and max_tokens override the defaults for one request (used for packed multi-chunk requests)
+    def translate(self, text, aimodel=None, max_tokens=None, system_prompt=None):
+        max_tokens = max_tokens or self.max_tokens
         try:
             prompt_parts = [
-                "Translate the following Classical Chinese text to English with a focus on accuracy. Only output the translation:",
+                system_prompt or self.SYSTEM_PROMPT,
                 f"\n\nClassical Chinese Text:\n{text}",
                 "\n\nEnglish Translation:"
             ]
             
-            response = self.model.generate_content(
-                prompt_parts,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=temperature
-                )
+            response = self.governor.call(
+                lambda: self.model.generate_content(
+                    prompt_parts,
+                    generation_config=genai.types.GenerationConfig(
+                        temperature=self.temperature,
+                        max_output_tokens=max_tokens,
+                    ),
+                    request_options={"timeout": self.timeout},
+                ),
+                tokens=estimate_tokens("".join(prompt_parts)) + max_tokens,
+                usage=lambda response: response.usage_metadata.total_token_count,
+                on_retry=telemetry.record_retry,
             )
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                telemetry.record_usage(usage.prompt_token_count, usage.candidates_token_count)
             return response.text
         except Exception as e:
             print(f"Error during translation: {e}")
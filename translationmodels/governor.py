@@ -0,0 +1,187 @@
+# Shared request governor used by every translator in translationmodels.
+# Each provider gets one governor (shared by every thread) that:
+#   1. Waits on token buckets for requests/minute and tokens/minute before sending a request
+#   2. Retries transient errors (429, 5xx, timeouts, dropped connections) with jittered exponential backoff
+#   3. Honors Retry-After headers, pausing every request to that provider until the server says to continue
+# Permanent errors (bad request, auth, unknown model...) are raised straight away, they won't succeed on retry.
+
+import email.utils
+import random
+import re
+import threading
+import time
+
+# Default limits per provider. None means unlimited. Set these to your account's tier with set_limits().
+PROVIDER_LIMITS = {
+    "openai": {"requests_per_minute": 500, "tokens_per_minute": 200000},
+    "anthropic": {"requests_per_minute": 50, "tokens_per_minute": 50000},
+    "gemini": {"requests_per_minute": 15, "tokens_per_minute": 250000},
+    "llama": {"requests_per_minute": None, "tokens_per_minute": None},
+    "deepseek": {"requests_per_minute": None, "tokens_per_minute": None},
+}
+
+# Seconds a translator waits for one response before giving up on it. A timeout is transient, so the request is
+# retried (and with hedging, see hedging.py, a slow one is usually overtaken well before this).
+REQUEST_TIMEOUT = 120
+
+TRANSIENT_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+# exception class names (from the different SDKs and httpx) that mean "try again later"
+TRANSIENT_ERROR_NAMES = re.compile(r"RateLimit|Timeout|Timed?Out|Connect|Overloaded|ServiceUnavailable|InternalServer|ResourceExhausted|DeadlineExceeded|TooManyRequests")
+
+CJK_CHARACTERS = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+# Rough token count without a tokenizer: about one token per CJK character, four characters per token otherwise.
+def estimate_tokens(text):
+    cjk = len(CJK_CHARACTERS.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+class TokenBucket:
+    # rate_per_minute: how fast the bucket refills, it also holds at most one minute's worth
+    def __init__(self, rate_per_minute):
+        self.rate_per_minute = rate_per_minute
+        self.capacity = rate_per_minute
+        self.available = rate_per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate_per_minute / 60)
+        self.updated = now
+
+    # blocks until amount can be taken from the bucket (a request bigger than the bucket waits for a full one)
+    def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                wait = (amount - self.available) * 60 / self.rate_per_minute
+            time.sleep(wait)
+
+    # returns tokens that were reserved but not used
+    def refund(self, amount):
+        with self._lock:
+            self._refill()
+            self.available = min(self.capacity, self.available + amount)
+
+# Returns "transient" or "permanent" for an exception raised by one of the provider SDKs
+def classify_error(error):
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return "transient"
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is None and isinstance(getattr(error, "code", None), int):
+        status = error.code # google.api_core exceptions
+    if status in TRANSIENT_STATUS_CODES:
+        return "transient"
+    if TRANSIENT_ERROR_NAMES.search(type(error).__name__):
+        return "transient"
+    return "permanent"
+
+# Seconds the server asked us to wait (Retry-After / retry-after-ms headers), or None
+def retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            retry_at = email.utils.parsedate_to_datetime(value) # HTTP-date form
+            return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class RequestGovernor:
+    def __init__(self, provider, requests_per_minute=None, tokens_per_minute=None, max_retries=6, base_delay=1.0, max_delay=60.0):
+        self.provider = provider
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    # every request to this provider waits until the time given by a Retry-After header
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _wait_for_pause(self):
+        while True:
+            with self._lock:
+                wait = self._paused_until - time.monotonic()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def backoff_delay(self, attempt):
+        # "full jitter": anywhere between no wait and the exponential cap, so retrying threads spread out
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    # Sends request() under the rate limits, retrying transient errors.
+    # tokens: tokens to reserve for the request (prompt estimate + max output tokens)
+    # usage: optional usage(response) -> tokens actually used, the unused part of the reservation is refunded
+    # on_retry: optional on_retry(attempt, error, delay) called before each retry
+    def call(self, request, tokens=0, usage=None, on_retry=None):
+        attempt = 0
+        while True:
+            self._wait_for_pause()
+            if self.requests is not None:
+                self.requests.acquire(1)
+            if self.tokens is not None and tokens:
+                self.tokens.acquire(tokens)
+
+            try:
+                response = request()
+            except Exception as e:
+                if classify_error(e) == "permanent" or attempt >= self.max_retries:
+                    raise
+                delay = retry_after(e)
+                if delay is not None:
+                    self.pause(delay)
+                else:
+                    delay = self.backoff_delay(attempt)
+                attempt += 1
+                if on_retry is not None:
+                    on_retry(attempt, e, delay)
+                print(f"\n{self.provider}: {type(e).__name__}, retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            if usage is not None and self.tokens is not None and tokens:
+                try:
+                    used = usage(response)
+                except Exception:
+                    used = None
+                if used is not None and used < tokens:
+                    self.tokens.refund(tokens - used)
+            return response
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+# Returns the shared governor for a provider, creating it from PROVIDER_LIMITS the first time
+def get_governor(provider):
+    with _governors_lock:
+        if provider not in _governors:
+            limits = PROVIDER_LIMITS.get(provider, {})
+            _governors[provider] = RequestGovernor(provider, **limits)
+        return _governors[provider]
+
+# Changes a provider's limits, e.g. set_limits("openai", requests_per_minute=5000, tokens_per_minute=2000000)
+def set_limits(provider, requests_per_minute=None, tokens_per_minute=None, **options):
+    with _governors_lock:
+        PROVIDER_LIMITS[provider] = {"requests_per_minute": requests_per_minute, "tokens_per_minute": tokens_per_minute}
+        _governors[provider] = RequestGovernor(provider, requests_per_minute, tokens_per_minute, **options)
+        return _governors[provider]
@@ -0,0 +1,98 @@
+# Shared setup for the Ollama-backed translators (LlamaTranslator, DeepSeekTranslator), including throughput mode.
+# By default each chunk is one synchronous request and the first one pays for loading the model. Throughput mode
+# (configure(), or translate_file.enable_ollama_throughput()) instead:
+#   1. Preloads the model as soon as its client is created, with a keep_alive so Ollama keeps it in memory
+#      between requests and between files (a process only warms each model up once)
+#   2. Sends every request with the same keep_alive
+#   3. Runs as many requests at once as the server has parallel slots (OLLAMA_NUM_PARALLEL on the server)
+# base_url defaults to OLLAMA_HOST, like the ollama CLI. Point it at benchmarks/fake_ollama.py to test without a GPU.
+
+import json
+import os
+import threading
+import time
+import urllib.request
+
+DEFAULT_NUM_PARALLEL = 4 # Ollama's own default when the server has the memory for it
+REQUEST_TIMEOUT = 600 # longer than for the hosted APIs, local models on a CPU are slow and may still be loading
+
+def default_base_url():
+    host = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+    return host if "://" in host else f"http://{host}"
+
+SETTINGS = {
+    "base_url": default_base_url(),
+    "keep_alive": None, # e.g. "30m", -1 keeps the model loaded until the server stops
+    "warm_up": False,
+    "num_parallel": 1,
+}
+
+_warmed = set()
+_warm_lock = threading.Lock()
+
+# Turns on throughput mode. Returns the number of requests to keep in flight (the server's parallel slots):
+# num_parallel, or OLLAMA_NUM_PARALLEL if it's set here too, or DEFAULT_NUM_PARALLEL.
+def configure(keep_alive="30m", num_parallel=None, base_url=None, warm_up=True):
+    if num_parallel is None:
+        num_parallel = int(os.getenv("OLLAMA_NUM_PARALLEL", DEFAULT_NUM_PARALLEL))
+    SETTINGS.update({
+        "base_url": base_url or SETTINGS["base_url"],
+        "keep_alive": keep_alive,
+        "warm_up": warm_up,
+        "num_parallel": num_parallel,
+    })
+    return num_parallel
+
+def post(path, payload, timeout=600):
+    request = urllib.request.Request(
+        SETTINGS["base_url"].rstrip("/") + path,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+# Loads the model into memory (a generate request without a prompt), once per process and model.
+# Failures are only printed, the first real request will load the model anyway.
+def warm_up(model):
+    key = (SETTINGS["base_url"], model)
+    with _warm_lock:
+        if key in _warmed:
+            return
+        _warmed.add(key)
+    payload = {"model": model}
+    if SETTINGS["keep_alive"] is not None:
+        payload["keep_alive"] = SETTINGS["keep_alive"]
+    start = time.monotonic()
+    try:
+        post("/api/generate", payload)
+        print(f"Loaded {model} in {time.monotonic() - start:.1f}s (keep_alive={SETTINGS['keep_alive']})")
+    except Exception as e:
+        print(f"Could not warm up {model}: {e}")
+        with _warm_lock:
+            _warmed.discard(key)
+
+# Builds the ChatOllama client the translators send requests through, warming the model up in throughput mode
+def chat_client(model, temperature, max_tokens, timeout=REQUEST_TIMEOUT):
+    from langchain_ollama import ChatOllama
+
+    options = {"base_url": SETTINGS["base_url"], "client_kwargs": {"timeout": timeout}}
+    if SETTINGS["keep_alive"] is not None:
+        options["keep_alive"] = SETTINGS["keep_alive"]
+    client = ChatOllama(
+        model=model,
+        temperature=temperature,
+        num_predict=max_tokens, # num_predict is the Ollama equivalent of max_tokens
+        **options,
+    )
+    if SETTINGS["warm_up"]:
+        warm_up(model)
+    return client
+
+# Sends one prompt through a chat_client. num_predict overrides the client's cap for this request: packed requests
+# ask for packing.output_budget(), far more than one chunk needs. Per-call options replace the client's own, so
+# the temperature is sent along with it.
+def invoke(client, prompt, num_predict=None):
+    if num_predict is None or num_predict == client.num_predict:
+        return client.invoke(prompt)
+    return client.invoke(prompt, options={"temperature": client.temperature, "num_predict": num_predict})
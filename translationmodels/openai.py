@@ -1,24 +1,53 @@
 from openai import OpenAI
 import os
+from translationmodels.governor import get_governor, estimate_tokens, REQUEST_TIMEOUT
+import telemetry
+import prompts
 
 class OpenAITranslator:
-    def __init__(self, api_key=None):
+    SYSTEM_PROMPT = "Translate the following Classical Chinese text to English with a focus on accuracy:"
+    PROMPT_CACHING = True # cache_prompt sends a prompt_cache_key (see prompts.py)
+
+    def __init__(self, api_key=None, temperature=0, max_tokens=1000, timeout=REQUEST_TIMEOUT):
+        self.temperature = temperature
+        self.max_tokens = max_tokens
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OpenAI API key is missing. Set it as an environment variable or pass it as an argument.")
-        self.client = OpenAI(api_key=self.api_key)
+        # retries are handled by the governor (rate limits, backoff, Retry-After), not the SDK
+        self.client = OpenAI(api_key=self.api_key, max_retries=0, timeout=timeout)
+        self.governor = get_governor("openai")
 
-    def translate(self, text, model, max_completion_tokens=1000, temperature=0):
+    # system_prompt and max_tokens override the defaults for one request (used for packed multi-chunk requests)
+    # cache_prompt: route the request to the prompt cache for its system prompt
+    def translate(self, text, model, max_tokens=None, temperature=None, system_prompt=None, cache_prompt=False):
+        max_output_tokens = max_tokens or self.max_tokens
+        system_prompt = system_prompt or self.SYSTEM_PROMPT
+        options = {"prompt_cache_key": prompts.cache_key(system_prompt)} if cache_prompt else {}
         try:
-            response = self.client.responses.create(
-                model=model,
-                input=[
-                    {"role": "system", "content": "Translate the following Classical Chinese text to English with a focus on accuracy:"},
-                    {"role": "user", "content": text}
-                ],
-                max_output_tokens=max_completion_tokens,
+            response = self.governor.call(
+                lambda: self.client.responses.create(
+                    model=model,
+                    input=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": text}
+                    ],
+                    max_output_tokens=max_output_tokens,
+                    **options,
+                ),
+                tokens=estimate_tokens(system_prompt + text) + max_output_tokens,
+                usage=lambda response: response.usage.total_tokens,
+                on_retry=telemetry.record_retry,
             )
+            if response.usage is not None:
+                record_usage(response.usage)
             return response.output_text
         except Exception as e:
             print(f"Error during translation: {e}")
             return None
+
+# input_tokens includes the cached part, which is reported separately
+def record_usage(usage):
+    telemetry.record_usage(usage.input_tokens, usage.output_tokens)
+    details = getattr(usage, "input_tokens_details", None)
+    telemetry.record_prompt_cache(getattr(details, "cached_tokens", None))
@@ -0,0 +1,107 @@
+# Provider registry: the one place that decides which translator handles a model name.
+# Each provider is registered with a match rule and the module/class of its translator. The module (and with it
+# the provider's SDK: openai, anthropic, langchain_ollama...) is only imported the first time that provider is used,
+# so a run with one provider never pays for importing the others.
+# Providers are checked in registration order, the first match wins, and names nothing matches go to ollama ("llama").
+#
+# Third-party providers can be added with register(), or from an installed package through an entry point in the
+# "classical_chinese_tool.providers" group that points to a Provider (or a dict of Provider arguments), e.g.
+#     [project.entry-points."classical_chinese_tool.providers"]
+#     mistral = "my_package.mistral_provider:PROVIDER"
+# Entry point providers are checked before the built-in ones, so they can also take over a built-in name pattern.
+
+import importlib
+import re
+import threading
+
+ENTRY_POINT_GROUP = "classical_chinese_tool.providers"
+DEFAULT_PROVIDER = "llama"
+
+class Provider:
+    # name: provider name used everywhere else (governor limits, MAX_IN_FLIGHT, telemetry labels)
+    # match: function(model name in lower case) -> bool
+    # module / class_name: where the translator lives, imported on first use
+    # api_key_env: environment variable the translator reads its key from, None if it doesn't need one
+    # model_argument: constructor keyword that takes the model name (None if the translator doesn't take one)
+    # label: name used in messages
+    def __init__(self, name, match, module, class_name, api_key_env=None, model_argument=None, label=None):
+        self.name = name
+        self.match = match
+        self.module = module
+        self.class_name = class_name
+        self.api_key_env = api_key_env
+        self.model_argument = model_argument
+        self.label = label or name
+
+    def load(self):
+        return getattr(importlib.import_module(self.module), self.class_name)
+
+    def create(self, aimodel, api_key=None):
+        kwargs = {}
+        if self.api_key_env is not None:
+            kwargs["api_key"] = api_key
+        if self.model_argument is not None:
+            kwargs[self.model_argument] = aimodel
+        return self.load()(**kwargs)
+
+def is_openai(model):
+    # gpt-* models and the o-series (o1, o3-mini, o4-mini...), but not open-weight gpt-oss run through ollama
+    return ("gpt" in model and "gpt-oss" not in model) or re.match(r"o\d", model) is not None
+
+_providers = [
+    Provider("openai", is_openai, "translationmodels.openai", "OpenAITranslator", api_key_env="OPENAI_API_KEY", label="OpenAI"),
+    Provider("anthropic", lambda model: "claude" in model, "translationmodels.anthropic", "AnthropicTranslator", api_key_env="ANTHROPIC_API_KEY", label="Anthropic"),
+    Provider("gemini", lambda model: "gemini" in model, "translationmodels.gemini", "GeminiTranslator", api_key_env="GEMINI_API_KEY", model_argument="aimodel", label="Gemini"),
+    Provider("llama", lambda model: "llama" in model, "translationmodels.llama", "LlamaTranslator", model_argument="model", label="Llama"),
+    Provider("deepseek", lambda model: "deepseek" in model, "translationmodels.deepseek", "DeepSeekTranslator", model_argument="model", label="DeepSeek"),
+]
+_entry_points_loaded = False
+_lock = threading.Lock()
+
+# Adds a provider. first=True checks it before the providers already registered.
+def register(provider, first=False):
+    with _lock:
+        _providers[:] = [existing for existing in _providers if existing.name != provider.name]
+        if first:
+            _providers.insert(0, provider)
+        else:
+            _providers.append(provider)
+    return provider
+
+def load_entry_points():
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    try:
+        from importlib.metadata import entry_points
+        found = entry_points(group=ENTRY_POINT_GROUP)
+    except Exception as e:
+        print(f"Could not read translation provider entry points: {e}")
+        return
+    for entry_point in found:
+        try:
+            provider = entry_point.load()
+            if isinstance(provider, dict):
+                provider = Provider(**provider)
+            register(provider, first=True)
+        except Exception as e:
+            print(f"Could not load translation provider {entry_point.name}: {e}")
+
+def providers():
+    load_entry_points()
+    return list(_providers)
+
+def get(name):
+    for provider in providers():
+        if provider.name == name:
+            return provider
+    raise KeyError(f"Unknown translation provider: {name}")
+
+# The single model name -> provider name resolution step
+def resolve(aimodel):
+    model = aimodel.lower()
+    for provider in providers():
+        if provider.match(model):
+            return provider.name
+    return DEFAULT_PROVIDER